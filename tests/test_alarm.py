@@ -0,0 +1,39 @@
+"""Alarm lifecycle against a stand-in player process."""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+
+from wakey import alarm, audio, journal
+from wakey.models import Alarm
+
+
+def test_dismiss_while_audio_starts_stops_the_player(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "JOURNAL_FILE", tmp_path / "alarms.journal")
+    monkeypatch.setattr(audio, "_find_player",
+                        lambda: (sys.executable, ["-c", "import time; time.sleep(60)"], []))
+    monkeypatch.setattr(audio, "_set_volume", lambda percent, sink=audio.DEFAULT_SINK: None)
+    monkeypatch.setattr(audio.resolver, "get_url", lambda station_id: "http://127.0.0.1:9/radio")
+    monkeypatch.setattr(alarm.bluetooth, "get_connected_devices", lambda: [])
+
+    async def slow_sink(speakers):
+        await asyncio.sleep(0.3)
+        return audio.DEFAULT_SINK
+
+    monkeypatch.setattr(audio.bluetooth, "ensure_zone_sink", slow_sink)
+    a = Alarm(id="dismissed", hue={"enabled": False},
+              audio={"speakers": ["AA:BB:CC:DD:EE:FF"], "ramp_seconds": 0})
+
+    async def run() -> None:
+        await alarm.trigger_alarm(a)
+        await asyncio.sleep(0.1)    # the zone sink is still being set up
+        await alarm.dismiss(a.id)
+        await asyncio.sleep(0.5)
+        try:
+            assert alarm.get_active() == []
+            assert not audio.is_playing()
+        finally:
+            audio.stop_playback()
+
+    asyncio.run(run())
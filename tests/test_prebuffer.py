@@ -0,0 +1,172 @@
+"""Pre-buffer recorder against a local HTTP stream server."""
+
+from __future__ import annotations
+
+import asyncio
+import subprocess
+import sys
+
+from wakey import audio, prebuffer, resolver
+from wakey.models import Alarm
+from wakey.scheduler import _before
+
+CHUNK = 4096
+
+
+async def _stream_server(bodies: dict[str, bytes]) -> tuple[asyncio.AbstractServer, str, list[str]]:
+    """Serve each path's body as an endless-looking stream that ends by closing."""
+    requests: list[str] = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        path = (await reader.readline()).split()[1].decode()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        requests.append(path)
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: audio/mpeg\r\nicy-br: 64\r\n"
+                     b"Connection: close\r\n\r\n")
+        body = bodies[path]
+        for i in range(0, len(body), CHUNK):
+            writer.write(body[i:i + CHUNK])
+            await writer.drain()
+            await asyncio.sleep(0.005)
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}", requests
+
+
+async def _until(predicate, timeout: float = 5) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def test_recorder_keeps_the_latest_audio_and_reconnects(tmp_path, monkeypatch):
+    monkeypatch.setattr(prebuffer, "BUFFER_DIR", tmp_path)
+    body = bytes(range(256)) * 256  # 64 KB
+
+    async def run() -> None:
+        server, url, requests = await _stream_server({"/radio": body})
+        rec = prebuffer.Recorder("radio", url + "/radio", capacity=16 * 1024)
+        rec.start(max_seconds=30)
+        try:
+            await _until(lambda: rec.buffer.written >= len(body))
+            assert rec.bitrate_kbps == 64
+            offset, data = rec.buffer.read(0, len(body))
+            assert offset == len(body) - 16 * 1024
+            assert data == body[-16 * 1024:]
+            # The server closed the stream; the recorder dials again
+            await _until(lambda: len(requests) >= 2)
+        finally:
+            rec.stop()
+            rec.buffer.close()
+            server.close()
+
+    asyncio.run(run())
+
+
+def test_snooze_extends_the_recording(tmp_path, monkeypatch):
+    monkeypatch.setattr(prebuffer, "BUFFER_DIR", tmp_path)
+
+    async def run() -> None:
+        server, url, _ = await _stream_server({"/radio": b"x" * CHUNK})
+        rec = prebuffer.Recorder("radio", url + "/radio", capacity=CHUNK)
+        rec.start(max_seconds=0.2)
+        rec.extend(1)
+        await asyncio.sleep(0.5)
+        assert rec.running
+        await _until(lambda: not rec.running, timeout=2)
+        rec.buffer.close()
+        server.close()
+
+    asyncio.run(run())
+
+
+def test_player_switches_to_the_live_stream_when_the_recorder_stops(tmp_path, monkeypatch):
+    monkeypatch.setattr(prebuffer, "BUFFER_DIR", tmp_path)
+    out = tmp_path / "played"
+    buffered, live = b"B" * 8 * CHUNK, b"L" * 8 * CHUNK
+
+    async def run() -> None:
+        server, url, _ = await _stream_server({"/buffered": buffered, "/live": live})
+        monkeypatch.setattr(audio.resolver, "get_url", lambda station_id: url + "/live")
+        rec = prebuffer.Recorder("radio", url + "/buffered", capacity=len(buffered))
+        rec.start(max_seconds=30)
+        await _until(lambda: rec.buffer.written >= len(buffered))
+        rec.stop()
+
+        # Stands in for mpv reading "-": copies stdin to a file
+        proc = subprocess.Popen(
+            [sys.executable, "-c",
+             f"import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, open({str(out)!r}, 'wb'))"],
+            stdin=subprocess.PIPE,
+        )
+        feeder = asyncio.create_task(audio._feed_from_buffer(proc, rec, start_seconds=3600))
+        await _until(lambda: out.exists() and out.stat().st_size > len(buffered) + CHUNK)
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+        proc.wait(timeout=5)
+        rec.buffer.close()
+        server.close()
+
+    asyncio.run(run())
+    played = out.read_bytes()
+    assert played.startswith(buffered)
+    assert set(played[len(buffered):]) == {ord("L")}
+
+
+def test_prebuffer_start_moves_to_the_previous_day_across_midnight():
+    assert _before(Alarm(time="00:01", days=[0, 3]), 3) == (23, 58, "wed,sun")
+    assert _before(Alarm(time="07:00", days=[6]), 20) == (6, 40, "sun")
+
+
+def test_recorder_falls_back_from_a_dead_cached_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(prebuffer, "BUFFER_DIR", tmp_path)
+    monkeypatch.setattr(resolver, "CACHE_FILE", tmp_path / "station_cache.json")
+
+    async def run() -> None:
+        server, url, requests = await _stream_server({"/radio": b"x" * CHUNK})
+        # Nothing listens on a closed server's port
+        dead_server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        dead = "http://127.0.0.1:%d/mirror" % dead_server.sockets[0].getsockname()[1]
+        dead_server.close()
+        await dead_server.wait_closed()
+        monkeypatch.setitem(resolver.RADIO_STATIONS, "radio", {"name": "Radio", "url": url + "/radio"})
+        monkeypatch.setattr(resolver, "_cache", {"radio": {"url": dead, "source_url": url + "/radio"}})
+
+        rec = prebuffer.Recorder("radio", resolver.get_url("radio"), capacity=CHUNK)
+        rec.start(max_seconds=30)
+        try:
+            await _until(lambda: rec.buffer.written > 0, timeout=5)
+            assert requests and rec.url == url + "/radio"
+            assert "radio" not in resolver.get_cache()
+        finally:
+            rec.stop()
+            rec.buffer.close()
+            server.close()
+
+    asyncio.run(run())
+
+
+def test_recording_outlives_other_alarms_until_its_own_ends(tmp_path, monkeypatch):
+    monkeypatch.setattr(prebuffer, "BUFFER_DIR", tmp_path)
+
+    async def run() -> None:
+        server, url, _ = await _stream_server({"/radio": b"x" * CHUNK})
+        # An upcoming alarm starts the recording in its lead time
+        await prebuffer.start_recording("radio", url + "/radio", 1, 30, "upcoming")
+        try:
+            prebuffer.release("ringing")    # another alarm is dismissed
+            assert prebuffer.get_status()["recording"]
+            await prebuffer.start_recording("radio", url + "/radio", 1, 30, "second")
+            prebuffer.release("upcoming")
+            assert prebuffer.get_status()["recording"]
+            prebuffer.release("second")
+            assert not prebuffer.get_status()["recording"]
+        finally:
+            prebuffer.stop_recording()
+            server.close()
+
+    asyncio.run(run())
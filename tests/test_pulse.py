@@ -0,0 +1,61 @@
+"""pacmd command session against fake pacmd/pactl binaries."""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+from wakey import pulse
+
+# Like pacmd: interactive (welcome text, ">>> " prompts) only after "hello",
+# silent on success, an error message for an unknown sink
+FAKE_PACMD = f"""#!{sys.executable}
+import sys
+interactive = False
+for line in sys.stdin:
+    cmd = line.split()
+    if cmd == ["hello"]:
+        interactive = True
+        sys.stdout.write("Welcome to PulseAudio! Use \\"help\\" for usage information.\\n")
+    elif "missing" in cmd:
+        sys.stdout.write("No sink found by this name or index.\\n")
+    if interactive:
+        sys.stdout.write(">>> ")
+    sys.stdout.flush()
+"""
+
+FAKE_PACTL = f"""#!{sys.executable}
+import sys
+with open(sys.argv[0] + ".log", "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+"""
+
+
+def test_rejected_pacmd_commands_are_retried_with_pactl(tmp_path, monkeypatch):
+    for name, body in (("pacmd", FAKE_PACMD), ("pactl", FAKE_PACTL)):
+        (tmp_path / name).write_text(body)
+        (tmp_path / name).chmod(0o755)
+    log = tmp_path / "pactl.log"
+    monkeypatch.setattr(pulse, "_ENV", dict(os.environ, LC_ALL="C",
+                                            PATH=f"{tmp_path}{os.pathsep}{os.environ['PATH']}"))
+    monkeypatch.setattr(pulse, "_pacmd_missing", False)
+    monkeypatch.setattr(pulse, "_cmd_proc", None)
+
+    pulse.set_sink_volume("speaker", 50)
+    pulse.set_sink_volume("missing", 40)
+    pulse.set_default_sink("speaker")
+    proc = pulse._cmd_proc
+    try:
+        deadline = time.monotonic() + 5
+        while not (log.exists() and not pulse._cmd_pending):
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.02)
+        assert log.read_text() == "set-sink-volume missing 40%\n"
+    finally:
+        proc.stdin.close()
+        proc.wait(timeout=5)
+    time.sleep(0.2)     # the reader thread sees EOF
+    # A session that answered is not mistaken for a missing pacmd
+    assert not pulse._pacmd_missing
+    assert log.read_text() == "set-sink-volume missing 40%\n"
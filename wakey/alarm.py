@@ -1,180 +1,257 @@
-"""Alarm lifecycle state machine / orchestrator."""
+"""Alarm lifecycle state machine / orchestrator.
+
+Every triggered alarm gets its own state machine and timeline (sunrise,
+audio, auto-stop, snooze resume), so overlapping alarms run side by side and
+can be dismissed or snoozed independently.
+"""
 
 from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable
 
-from . import audio, hue, spotify
+from . import audio, bluetooth, hue, journal, latency, prebuffer, profiler, spotify, timeline
 from .config import load_config
 from .models import Alarm, AlarmState, AppState
 
 logger = logging.getLogger(__name__)
 
-state = AppState()
+# Most to least urgent, for picking the alarm summarised in get_state()
+_PRIORITY = (AlarmState.ACTIVE, AlarmState.SUNRISE, AlarmState.SNOOZED)
+
+
+class ActiveAlarm:
+    """State and timeline of one triggered alarm.
+
+    The timeline carries the light ramp, the audio start and volume ramp,
+    and the auto-stop cue, all on one clock.
+    """
 
-_sunrise_task: asyncio.Task | None = None
-_audio_task: asyncio.Task | None = None
-_auto_stop_task: asyncio.Task | None = None
+    def __init__(self, alarm: Alarm):
+        self.alarm = alarm
+        self.state = AppState(active_alarm_id=alarm.id)
+        self.timeline = timeline.Timeline("alarm:" + alarm.id)
+        # Bumped by _stop_audio, so a start still in flight knows it was stopped
+        self.audio_epoch = 0
+
+
+_active: dict[str, ActiveAlarm] = {}
+# Which alarm's audio is playing: zone -> alarm id, and the Spotify player's alarm
+_zone_owner: dict[str, str] = {}
+_spotify_owner: str | None = None
+_tasks: set[asyncio.Task] = set()
 
 
 def get_state() -> AppState:
-    return state
+    """Summary state: the most urgent active alarm, or IDLE."""
+    for st in _PRIORITY:
+        for a in _active.values():
+            if a.state.state == st:
+                return a.state
+    return AppState()
 
 
-async def trigger_alarm(alarm: Alarm) -> None:
-    """Called by scheduler at T - offset_minutes. Starts the full alarm sequence."""
-    global _sunrise_task, _audio_task, _auto_stop_task
+def get_active() -> list[ActiveAlarm]:
+    return list(_active.values())
 
-    if state.state != AlarmState.IDLE:
-        logger.warning("Alarm already active, ignoring trigger for %s", alarm.id)
-        return
 
-    logger.info("Triggering alarm %s (%s)", alarm.id, alarm.time)
-    state.active_alarm_id = alarm.id
+def get_alarm(alarm_id: str) -> ActiveAlarm | None:
+    return _active.get(alarm_id)
 
-    gcfg = load_config().hue
+
+async def trigger_alarm(alarm: Alarm, position: float = 0, audio_at: float | None = None) -> None:
+    """Called by scheduler at T - offset_minutes. Starts the full alarm sequence.
+
+    When resuming after a restart, the timeline starts at `position` seconds,
+    and `audio_at` is the audio start of a snoozed alarm.
+    """
+    latency.mark("trigger")
+    profiler.alarm_triggered()
+    if alarm.id in _active:
+        logger.warning("Alarm %s already active, ignoring trigger", alarm.id)
+        return
+
+    logger.info("Triggering alarm %s (%s), %d other(s) active",
+                alarm.id, alarm.time, len(_active))
+    a = _active[alarm.id] = ActiveAlarm(alarm)
+    tl = a.timeline
+    started = time.time() - position
+    journal.record_trigger(alarm, started)
 
     # Phase 1: Sunrise
     offset = alarm.hue.offset_minutes if alarm.hue.enabled else 0
     if alarm.hue.enabled and offset > 0:
-        state.state = AlarmState.SUNRISE
-        state.sunrise_start = datetime.now(timezone.utc).isoformat()
-        _sunrise_task = asyncio.create_task(_run_sunrise(alarm, gcfg))
+        a.state.state = AlarmState.SUNRISE
+        a.state.sunrise_start = datetime.fromtimestamp(started, timezone.utc).isoformat()
+        for track in hue.sunrise_tracks(load_config().hue, alarm.hue, offset):
+            tl.add(track)
     else:
         offset = 0
+        # Nothing to show until audio starts, but the alarm is in flight
+        a.state.state = AlarmState.ACTIVE
 
-    # Phase 2: Audio starts after offset delay
-    _audio_task = asyncio.create_task(_run_audio(alarm, delay_seconds=offset * 60))
-
-    # Auto-stop
-    total_timeout = (offset * 60) + (alarm.auto_stop_minutes * 60)
-    _auto_stop_task = asyncio.create_task(_run_auto_stop(total_timeout))
-
-
-async def _run_sunrise(alarm, gcfg) -> None:
-    try:
-        await hue.sunrise_ramp(gcfg, alarm.hue, alarm.hue.offset_minutes)
-    except asyncio.CancelledError:
-        pass
-    except Exception:
-        logger.exception("Sunrise ramp failed")
-
-
-async def _run_audio(alarm: Alarm, delay_seconds: int) -> None:
-    try:
-        if delay_seconds > 0:
-            await asyncio.sleep(delay_seconds)
-
-        state.state = AlarmState.ACTIVE
-        state.audio_start = datetime.now(timezone.utc).isoformat()
-
-        if alarm.audio.enabled:
-            if alarm.audio.source == "spotify" and alarm.audio.spotify_uri:
-                ok = await spotify.play(uri=alarm.audio.spotify_uri)
-                if ok:
-                    await _spotify_volume_ramp(
-                        alarm.audio.volume, alarm.audio.ramp_seconds
-                    )
-                else:
-                    logger.warning("Spotify play failed, falling back to radio")
-                    await audio.start_playback(alarm.audio)
-            else:
-                await audio.start_playback(alarm.audio)
-    except asyncio.CancelledError:
-        pass
-    except Exception:
-        logger.exception("Audio playback failed")
-
-
-async def _run_auto_stop(timeout_seconds: int) -> None:
-    try:
-        await asyncio.sleep(timeout_seconds)
-        logger.info("Auto-stop triggered after %d seconds", timeout_seconds)
-        await dismiss()
-    except asyncio.CancelledError:
-        pass
-
-
-async def dismiss() -> None:
-    """Dismiss the current alarm."""
-    logger.info("Dismissing alarm")
-    _cancel_tasks()
-    audio.stop_playback()
-    await spotify.stop()
-    _reset_state()
-
-
-async def snooze(alarm: Alarm) -> None:
-    """Snooze: stop audio, wait snooze_minutes, restart."""
-    global _audio_task, _auto_stop_task
-
-    logger.info("Snoozing alarm for %d minutes", alarm.snooze_minutes)
-    audio.stop_playback()
-    await spotify.stop()
-    if _audio_task:
-        _audio_task.cancel()
-    if _auto_stop_task:
-        _auto_stop_task.cancel()
-
-    state.state = AlarmState.SNOOZED
-
-    _audio_task = asyncio.create_task(_run_snooze_resume(alarm))
-    _auto_stop_task = asyncio.create_task(
-        _run_auto_stop(alarm.snooze_minutes * 60 + alarm.auto_stop_minutes * 60)
-    )
-
-
-async def _run_snooze_resume(alarm: Alarm) -> None:
-    try:
-        await asyncio.sleep(alarm.snooze_minutes * 60)
-        state.state = AlarmState.ACTIVE
-        state.audio_start = datetime.now(timezone.utc).isoformat()
-        if alarm.audio.enabled:
-            if alarm.audio.source == "spotify" and alarm.audio.spotify_uri:
-                ok = await spotify.play(uri=alarm.audio.spotify_uri)
-                if ok:
-                    await _spotify_volume_ramp(
-                        alarm.audio.volume, alarm.audio.ramp_seconds
-                    )
-                else:
-                    logger.warning("Spotify play failed on snooze resume, falling back to radio")
-                    await audio.start_playback(alarm.audio)
-            else:
-                await audio.start_playback(alarm.audio)
-    except asyncio.CancelledError:
-        pass
-
-
-async def _spotify_volume_ramp(target_percent: int, ramp_seconds: int) -> None:
-    """Gradually ramp Spotify volume from 10% to target over ramp_seconds."""
-    if ramp_seconds <= 0:
-        vol = int(target_percent / 100 * 65535)
-        await spotify.set_volume(vol)
-        return
-
-    start_pct = 10
-    steps = max(1, ramp_seconds // 3)
-    for i in range(steps + 1):
-        t = i / steps
-        pct = int(start_pct + t * (target_percent - start_pct))
-        vol = int(pct / 100 * 65535)
-        await spotify.set_volume(vol)
-        if i < steps:
-            await asyncio.sleep(3)
-
-
-def _cancel_tasks() -> None:
-    global _sunrise_task, _audio_task, _auto_stop_task
-    for task in (_sunrise_task, _audio_task, _auto_stop_task):
-        if task and not task.done():
-            task.cancel()
-    _sunrise_task = _audio_task = _auto_stop_task = None
-
-
-def _reset_state() -> None:
-    state.state = AlarmState.IDLE
-    state.active_alarm_id = None
-    state.sunrise_start = None
-    state.audio_start = None
+    # Phase 2: Audio starts after offset delay, then auto-stop
+    if audio_at is None:
+        audio_at = offset * 60
+    else:
+        a.state.state = AlarmState.SNOOZED
+        journal.record_snooze(alarm.id, audio_at)
+    latency.set_audio_offset(audio_at)
+    _schedule_audio(a, audio_at)
+    tl.start(position)
+
+
+def _schedule_audio(a: ActiveAlarm, at: float) -> None:
+    """Put audio start, volume ramp and auto-stop on the alarm's timeline."""
+    cfg = a.alarm.audio
+    a.timeline.add(timeline.Track(
+        "audio",
+        timeline.volume_keyframes(audio.RAMP_START_VOLUME, cfg.volume, cfg.ramp_seconds),
+        step_seconds=audio.RAMP_STEP_SECONDS,
+        at=at,
+        prepare=lambda: _start_audio(a),
+    ))
+
+    async def auto_stop() -> None:
+        logger.info("Auto-stop of alarm %s", a.alarm.id)
+        await dismiss(a.alarm.id)
+
+    a.timeline.add(timeline.cue("auto_stop", at + a.alarm.auto_stop_minutes * 60, auto_stop))
+
+
+async def _start_audio(a: ActiveAlarm) -> timeline.Actuator | None:
+    """Start the alarm's audio; returns the volume actuator for its ramp."""
+    a.state.state = AlarmState.ACTIVE
+    a.state.audio_start = datetime.now(timezone.utc).isoformat()
+
+    cfg = a.alarm.audio
+    if not cfg.enabled:
+        return None
+    if not bluetooth.get_connected_devices():
+        logger.warning("No Bluetooth speaker connected, audio uses the default output")
+    global _spotify_owner
+    aid = a.alarm.id
+    if cfg.source == "spotify" and cfg.spotify_uri:
+        # Owned from the start, so a dismiss while it starts still stops it
+        _spotify_owner = aid
+        if await _start(a, spotify.play(uri=cfg.spotify_uri), _stop_orphaned_spotify):
+            return _spotify_volume
+        if _spotify_owner == aid:
+            _spotify_owner = None
+        logger.warning("Spotify play failed for alarm %s, falling back to radio", aid)
+    zone = audio.zone_id(cfg)
+    _zone_owner[zone] = aid
+    if await _start(a, audio.start_playback(cfg, ramp=False), lambda: _stop_orphaned_zone(zone)):
+        if _zone_owner.get(zone) == aid:
+            del _zone_owner[zone]
+        return None
+
+    async def radio_volume(percent: int) -> None:
+        audio.set_volume(percent, zone)
+
+    return radio_volume
+
+
+async def _start(a: ActiveAlarm, start: Awaitable[Any], undo: Callable[[], None]) -> Any:
+    """Await an audio start that outlives cancellation of the alarm's timeline.
+
+    Starts are shared and shielded, so a dismiss or snooze can't interrupt
+    one; if the alarm's audio was stopped meanwhile, `undo` runs once it
+    has finished.
+    """
+    epoch = a.audio_epoch
+    task = asyncio.ensure_future(start)
+
+    def done(t: asyncio.Task) -> None:
+        if a.audio_epoch != epoch and not t.cancelled() and t.exception() is None:
+            undo()
+
+    task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+
+def _stop_orphaned_zone(zone: str) -> None:
+    if zone not in _zone_owner:
+        logger.info("Stopping audio in zone %s: its alarm ended while it started", zone)
+        audio.stop_playback(zone)
+
+
+def _stop_orphaned_spotify() -> None:
+    if _spotify_owner is None:
+        logger.info("Stopping Spotify: its alarm ended while it started")
+        task = asyncio.create_task(spotify.stop())
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def _spotify_volume(percent: int) -> None:
+    await spotify.set_volume(int(percent / 100 * 65535))
+
+
+async def _stop_audio(a: ActiveAlarm) -> None:
+    """Stop the output this alarm started, unless another ringing alarm uses it.
+
+    An alarm that is only in its sunrise or snoozed does not keep the
+    stream alive; it starts its own audio when its time comes.
+    """
+    global _spotify_owner
+    aid = a.alarm.id
+    a.audio_epoch += 1
+    ringing = [o for o in _active.values() if o is not a and o.state.state == AlarmState.ACTIVE]
+    zone = audio.zone_id(a.alarm.audio)
+    if _zone_owner.get(zone) == aid:
+        heir = next((o for o in ringing if audio.zone_id(o.alarm.audio) == zone), None)
+        if heir is not None:
+            _zone_owner[zone] = heir.alarm.id
+        else:
+            del _zone_owner[zone]
+            audio.stop_playback(zone)
+    if _spotify_owner == aid:
+        heir = next((o for o in ringing if o.alarm.audio.source == "spotify"), None)
+        _spotify_owner = heir.alarm.id if heir is not None else None
+        if heir is None:
+            await spotify.stop()
+
+
+async def dismiss(alarm_id: str | None = None) -> None:
+    """Dismiss one alarm, or every active alarm when alarm_id is None."""
+    ids = list(_active) if alarm_id is None else [alarm_id]
+    for aid in ids:
+        a = _active.get(aid)
+        if a is None:
+            continue
+        logger.info("Dismissing alarm %s", aid)
+        a.timeline.cancel()
+        await _stop_audio(a)
+        _active.pop(aid, None)
+        journal.record_dismiss(aid)
+        # A recording an upcoming alarm started in its lead time keeps going
+        prebuffer.release(aid)
+    if not _active:
+        journal.compact()
+
+
+async def snooze(alarm_id: str) -> int:
+    """Snooze: stop this alarm's audio, restart it snooze_minutes later.
+
+    The sunrise keeps going. Returns the snooze length in minutes.
+    """
+    a = _active[alarm_id]
+    alarm = a.alarm
+    logger.info("Snoozing alarm %s for %d minutes", alarm_id, alarm.snooze_minutes)
+    a.timeline.remove("audio")
+    a.timeline.remove("auto_stop")
+    await _stop_audio(a)
+
+    a.state.state = AlarmState.SNOOZED
+    audio_at = a.timeline.position + alarm.snooze_minutes * 60
+    _schedule_audio(a, audio_at)
+    if alarm.audio.source == "radio":
+        # Each snooze needs the pre-buffer for another snooze and auto-stop
+        prebuffer.extend_recording(alarm.audio.station,
+                                   (alarm.snooze_minutes + alarm.auto_stop_minutes) * 60)
+    journal.record_snooze(alarm_id, audio_at)
+    return alarm.snooze_minutes
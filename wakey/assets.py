@@ -0,0 +1,141 @@
+"""Static assets, fingerprinted and precompressed once at startup.
+
+build() reads every file in static/, names it by content hash
+(app.js -> app.3f9c1a2b7e.js) and keeps it in memory together with gzip and,
+when the brotli package is installed, brotli variants. Hashed URLs never
+change content, so they are served with a one-year immutable Cache-Control;
+a new build changes the URL instead. The index page is rendered once with
+the hashed URLs and served from memory, revalidated by ETag.
+
+The plain /static/ mount stays for anything still referring to it.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+from pathlib import Path
+
+from fastapi import Request, Response
+
+from . import conditional
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+URL_PREFIX = "/assets/"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Smaller than this is not worth compressing
+MIN_COMPRESS_BYTES = 512
+_ETAG_SUFFIXES = {"gzip": "-gz", "br": "-br"}
+
+
+class Asset:
+    """One file with its encoded variants ("identity", "gzip", "br").
+
+    Each variant is a different representation, so each has its own ETag.
+    """
+
+    def __init__(self, data: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        self.variants = {"identity": data}
+        if len(data) >= MIN_COMPRESS_BYTES:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gz) < len(data):
+                self.variants["gzip"] = gz
+            if brotli is not None:
+                br = brotli.compress(data, quality=11)
+                if len(br) < len(data):
+                    self.variants["br"] = br
+
+    def etag(self, encoding: str) -> str:
+        suffix = _ETAG_SUFFIXES.get(encoding, "")
+        return '"' + self.digest + suffix + '"'
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        encoding = _negotiate(request.headers.get("accept-encoding", ""), self.variants)
+        tag = self.etag(encoding)
+        headers = {"ETag": tag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if conditional.matches(request, tag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+
+def _negotiate(header: str, variants: dict[str, bytes]) -> str:
+    """Best encoding the client accepts: br, then gzip, then identity."""
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+_assets: dict[str, Asset] = {}       # hashed name -> asset
+_urls: dict[str, str] = {}           # original name -> hashed URL
+_index: Asset | None = None
+
+
+def _hashed_name(name: str, data: bytes) -> str:
+    stem, dot, suffix = name.rpartition(".")
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    return f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+
+
+def build(static_dir: Path) -> None:
+    """Fingerprint and compress everything in `static_dir`."""
+    _assets.clear()
+    _urls.clear()
+    for path in sorted(p for p in static_dir.rglob("*") if p.is_file()):
+        name = path.relative_to(static_dir).as_posix()
+        data = path.read_bytes()
+        hashed = _hashed_name(name, data)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type == "application/javascript":
+            media_type += "; charset=utf-8"
+        _assets[hashed] = Asset(data, media_type)
+        _urls[name] = URL_PREFIX + hashed
+    total = sum(len(a.variants["identity"]) for a in _assets.values())
+    logger.info("Built %d static assets (%d KB%s)", len(_assets), total // 1024,
+                ", brotli" if brotli is not None else "")
+
+
+def url(name: str) -> str:
+    """Hashed URL of a static file, for templates."""
+    return _urls.get(name, "/static/" + name)
+
+
+def set_index(html: str) -> None:
+    global _index
+    _index = Asset(html.encode(), "text/html; charset=utf-8")
+
+
+def asset_response(name: str, request: Request) -> Response:
+    asset = _assets.get(name)
+    if asset is None:
+        return Response(status_code=404)
+    return asset.response(request, IMMUTABLE)
+
+
+def index_response(request: Request) -> Response:
+    # The page itself must not be cached blindly: it names the current assets
+    return _index.response(request, "no-cache")
@@ -1,18 +1,34 @@
-"""Audio playback via subprocess (mpv/ffplay/vlc) + volume control."""
+"""Audio playback via subprocess (mpv/ffplay/vlc) + volume control.
+
+Playback is organised in zones: each zone is a set of Bluetooth speakers
+(or the default output) with its own player process, volume and ramp, so
+several alarms can play different stations to different rooms at once.
+"""
 
 from __future__ import annotations
 
 import asyncio
 import logging
+import os
 import platform
 import shutil
 import subprocess
 
-from .models import AudioConfig, RADIO_STATIONS
+import httpx
+
+from . import bluetooth, catalog, latency, metrics, prebuffer, pulse, resolver, singleflight, timeline
+from .config import load_config
+from .models import AudioConfig
 
 logger = logging.getLogger(__name__)
 
-_process: subprocess.Popen | None = None
+DEFAULT_ZONE = "default"
+DEFAULT_SINK = "@DEFAULT_SINK@"
+
+RAMP_START_VOLUME = 10
+RAMP_STEP_SECONDS = 3
+# A player that exits this soon after starting could not play its URL
+PLAYER_CHECK_SECONDS = 10
 
 # Player commands in priority order: (binary, args_before_url, args_after_url)
 _PLAYERS = [
@@ -22,6 +38,53 @@ _PLAYERS = [
 ]
 
 
+class Player:
+    """One zone's player process, pre-buffer feeder and volume ramp."""
+
+    def __init__(self, zone: str, sink: str):
+        self.zone = zone
+        self.sink = sink
+        self.station = ""
+        self.process: subprocess.Popen | None = None
+        self.feeder_task: asyncio.Task | None = None
+        self.ramp: timeline.Timeline | None = None
+        self.confirm_task: asyncio.Task | None = None
+        self.check_task: asyncio.Task | None = None
+
+    def is_playing(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self) -> None:
+        if self.ramp is not None:
+            self.ramp.cancel()
+            self.ramp = None
+        for task in (self.feeder_task, self.confirm_task, self.check_task):
+            if task is not None:
+                task.cancel()
+        self.feeder_task = self.confirm_task = self.check_task = None
+        if self.process is not None:
+            try:
+                self.process.terminate()
+                self.process.wait(timeout=3)
+            except Exception:
+                try:
+                    self.process.kill()
+                except Exception:
+                    pass
+            self.process = None
+            logger.info("Playback stopped (zone %s)", self.zone)
+
+
+_zones: dict[str, Player] = {}
+
+
+def zone_id(cfg: AudioConfig) -> str:
+    """Zone key for an audio config: its sorted speaker MACs, or the default output."""
+    if not cfg.speakers:
+        return DEFAULT_ZONE
+    return ",".join(sorted(m.upper() for m in cfg.speakers))
+
+
 def _find_player() -> tuple[str, list[str], list[str]] | None:
     for binary, pre, post in _PLAYERS:
         if shutil.which(binary):
@@ -29,76 +92,252 @@ def _find_player() -> tuple[str, list[str], list[str]] | None:
     return None
 
 
-async def start_playback(cfg: AudioConfig) -> str | None:
-    """Start streaming. Returns error string or None on success."""
-    global _process
-    stop_playback()
+@singleflight.shared(
+    lambda cfg, ramp=True: f"audio:play:{zone_id(cfg)}:{cfg.station}:{cfg.volume}:{cfg.ramp_seconds}:{ramp}"
+)
+async def start_playback(cfg: AudioConfig, ramp: bool = True) -> str | None:
+    """Start streaming in the config's zone. Returns error string or None on success.
 
-    station = RADIO_STATIONS.get(cfg.station)
+    Identical concurrent requests share one start; a different request for
+    the same zone replaces its player and cancels the previous volume ramp.
+    Other zones are not affected. With ramp=False the player starts at the
+    ramp's start volume and the caller drives the volume (alarm timeline).
+    """
+    zone = zone_id(cfg)
+    async with singleflight.lock("audio:zone:" + zone):
+        err, sink = await _start_player(cfg, zone)
+    if err:
+        return err
+    if not ramp or cfg.ramp_seconds <= 0:
+        return None
+
+    tl = _zones[zone].ramp = timeline.Timeline("volume:" + zone)
+    tl.add(volume_track(cfg))
+    tl.start()
+    try:
+        # Returns normally if a newer playback cancels this ramp
+        await tl.wait()
+    except asyncio.CancelledError:
+        tl.cancel()
+        raise
+    return None
+
+
+def volume_track(cfg: AudioConfig) -> timeline.Track:
+    """Timeline track ramping the zone's volume up to cfg.volume."""
+    zone = zone_id(cfg)
+
+    async def apply(percent: int) -> None:
+        set_volume(percent, zone)
+
+    return timeline.Track(
+        "volume",
+        timeline.volume_keyframes(RAMP_START_VOLUME, cfg.volume, cfg.ramp_seconds),
+        apply,
+        step_seconds=RAMP_STEP_SECONDS,
+    )
+
+
+async def _start_player(cfg: AudioConfig, zone: str) -> tuple[str | None, str]:
+    """Replace the zone's player. Returns (error, sink).
+
+    Only the previous player process is stopped; its zone sink is reused
+    when the new one plays to the same speakers, so restarts (snooze
+    resume, tests) don't unload and reload the combine module.
+    """
+    previous = _zones.pop(zone, None)
+    if previous is not None:
+        previous.stop()
+    old_sink = previous.sink if previous is not None else DEFAULT_SINK
+
+    station = await catalog.get_station_async(cfg.station)
     if not station:
-        return "Unknown station: " + cfg.station
+        _release_sink(old_sink)
+        return "Unknown station: " + cfg.station, DEFAULT_SINK
 
     player = _find_player()
     if not player:
+        _release_sink(old_sink)
         msg = "No audio player found. Install one: brew install mpv (or ffmpeg)"
         logger.error(msg)
-        return msg
+        return msg, DEFAULT_SINK
+
+    sink = DEFAULT_SINK
+    if zone != DEFAULT_ZONE:
+        sink = await bluetooth.ensure_zone_sink(cfg.speakers) or DEFAULT_SINK
+        if sink == DEFAULT_SINK:
+            logger.warning("No speakers of zone %s connected, using default output", zone)
+    if old_sink != sink:
+        _release_sink(old_sink)
+    p = _zones[zone] = Player(zone, sink)
+    p.station = cfg.station
 
     binary, pre_args, post_args = player
-    url = station["url"]
+    recorder = prebuffer.get_recorder(cfg.station)
+    # With a pre-buffer the player reads from stdin ("-") and is fed locally
+    url = "-" if recorder else resolver.get_url(cfg.station)
     cmd = [binary] + pre_args + [url] + post_args
-    logger.info("Starting playback: %s via %s", station["name"], binary)
+    logger.info("Starting playback: %s via %s in zone %s%s", station["name"], binary, zone,
+                " (pre-buffered)" if recorder else "")
+
+    # Start quiet if a ramp follows, so the stream never blasts at the old volume
+    _set_volume(RAMP_START_VOLUME if cfg.ramp_seconds > 0 else cfg.volume, sink)
+
+    env = None
+    if sink != DEFAULT_SINK:
+        # Route this player's stream to the zone sink
+        env = dict(os.environ, PULSE_SINK=sink)
 
     try:
-        _process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
+        with metrics.timed("player", binary):
+            p.process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if recorder else subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                env=env,
+            )
     except Exception as e:
         msg = "Failed to start " + binary + ": " + str(e)
         logger.error(msg)
-        return msg
+        return msg, sink
+    latency.mark("player_started")
+    if latency.current() is not None and platform.system() != "Darwin":
+        p.confirm_task = asyncio.create_task(_confirm_audio(p.process.pid))
 
-    # Volume ramp
-    if cfg.ramp_seconds > 0:
-        await _volume_ramp(10, cfg.volume, cfg.ramp_seconds)
+    if recorder:
+        start_seconds = load_config().prebuffer.start_seconds
+        p.feeder_task = asyncio.create_task(_feed_from_buffer(p.process, recorder, start_seconds))
     else:
-        _set_volume(cfg.volume)
+        p.check_task = asyncio.create_task(_retry_if_dead(p, cmd, url, env))
+    return None, sink
+
+
+def stop_playback(zone: str | None = None) -> None:
+    """Stop one zone, or every zone when `zone` is None."""
+    zones = list(_zones) if zone is None else [zone]
+    for z in zones:
+        p = _zones.pop(z, None)
+        if p is not None:
+            p.stop()
+            _release_sink(p.sink)
+
+
+def _release_sink(sink: str) -> None:
+    """Unload a zone's combined sink once no player uses it."""
+    if sink.startswith(bluetooth.ZONE_SINK_PREFIX) and all(p.sink != sink for p in _zones.values()):
+        bluetooth.remove_zone_sink(sink)
+
+
+def is_playing(zone: str | None = None) -> bool:
+    if zone is not None:
+        return zone in _zones and _zones[zone].is_playing()
+    return any(p.is_playing() for p in _zones.values())
+
+
+def set_volume(percent: int, zone: str = DEFAULT_ZONE) -> None:
+    """Set the volume of a zone's output."""
+    p = _zones.get(zone)
+    _set_volume(percent, p.sink if p else DEFAULT_SINK)
+
+
+def get_zones() -> list[dict]:
+    return [
+        {"zone": p.zone, "sink": p.sink, "station": p.station, "playing": p.is_playing()}
+        for p in _zones.values()
+    ]
+
+
+async def _retry_if_dead(p: Player, cmd: list[str], url: str, env: dict | None) -> None:
+    """Restart a player that quit right away on a cached URL with the configured one."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PLAYER_CHECK_SECONDS
+    while p.process is not None and p.process.poll() is None:
+        if loop.time() > deadline:
+            return
+        await asyncio.sleep(0.2)
+    fallback = resolver.invalidate(p.station, url)
+    if fallback is None or p.process is None or _zones.get(p.zone) is not p:
+        return
+    logger.warning("Player exited on %s, retrying with %s", url, fallback)
+    try:
+        p.process = subprocess.Popen(
+            [fallback if arg == url else arg for arg in cmd],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env,
+        )
+    except Exception as e:
+        logger.error("Failed to restart the player: %s", e)
 
-    return None
+
+async def _confirm_audio(pid: int) -> None:
+    """Record wake latency once the player's stream shows up in PulseAudio."""
+    try:
+        if await pulse.wait_for_sink_input(pid):
+            latency.mark("audio_playing")
+    except asyncio.CancelledError:
+        pass
 
 
-def stop_playback() -> None:
-    global _process
-    if _process is not None:
+async def _feed_from_buffer(proc: subprocess.Popen, recorder: prebuffer.Recorder,
+                            start_seconds: int) -> None:
+    """Pipe buffered audio into the player, then keep following the recorder."""
+    loop = asyncio.get_running_loop()
+    offset = recorder.start_offset(start_seconds)
+    try:
+        while proc.poll() is None:
+            offset, chunk = recorder.buffer.read(offset, 64 * 1024)
+            if not chunk:
+                if not recorder.running:
+                    logger.warning("Pre-buffer recorder stopped, switching to the live stream")
+                    await _feed_live(proc, recorder.station_id)
+                    break
+                await recorder.wait_for_data(timeout=1)
+                continue
+            offset += len(chunk)
+            await loop.run_in_executor(None, _write_chunk, proc, chunk)
+    except asyncio.CancelledError:
+        pass
+    except Exception:
+        logger.exception("Pre-buffer feeder failed")
+    finally:
         try:
-            _process.terminate()
-            _process.wait(timeout=3)
+            proc.stdin.close()
         except Exception:
-            try:
-                _process.kill()
-            except Exception:
-                pass
-        _process = None
-        logger.info("Playback stopped")
+            pass
 
 
-def is_playing() -> bool:
-    return _process is not None and _process.poll() is None
+async def _feed_live(proc: subprocess.Popen, station_id: str) -> None:
+    """Keep a stdin-fed player going from the live stream once the pre-buffer ends."""
+    loop = asyncio.get_running_loop()
+    backoff = 1
+    async with httpx.AsyncClient(timeout=httpx.Timeout(10, read=30), follow_redirects=True) as client:
+        while proc.poll() is None:
+            url = resolver.get_url(station_id)
+            try:
+                async with client.stream("GET", url) as resp:
+                    resp.raise_for_status()
+                    backoff = 1
+                    async for chunk in resp.aiter_bytes(64 * 1024):
+                        await loop.run_in_executor(None, _write_chunk, proc, chunk)
+                logger.warning("Live stream for %s ended, reconnecting", station_id)
+            except httpx.HTTPError as e:
+                logger.warning("Live stream for %s failed: %s", station_id, e)
+                resolver.invalidate(station_id, url)
+            except OSError:
+                return  # the player exited
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
 
 
-async def _volume_ramp(start: int, end: int, duration_seconds: int) -> None:
-    steps = max(1, duration_seconds // 3)
-    for i in range(steps + 1):
-        t = i / steps
-        vol = int(start + t * (end - start))
-        _set_volume(vol)
-        if i < steps:
-            await asyncio.sleep(3)
+def _write_chunk(proc: subprocess.Popen, chunk: bytes) -> None:
+    proc.stdin.write(chunk)
+    proc.stdin.flush()
 
 
-def _set_volume(percent: int) -> None:
+def _set_volume(percent: int, sink: str = DEFAULT_SINK) -> None:
     system = platform.system()
     try:
         if system == "Darwin":
@@ -110,10 +349,6 @@ def _set_volume(percent: int) -> None:
             )
         else:
             # Linux (PulseAudio)
-            subprocess.run(
-                ["pactl", "set-sink-volume", "@DEFAULT_SINK@", str(percent) + "%"],
-                capture_output=True,
-                timeout=3,
-            )
+            pulse.set_sink_volume(sink, percent)
     except Exception:
         logger.debug("Volume set failed (no pactl/osascript?)")
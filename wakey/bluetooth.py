@@ -3,68 +3,211 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import logging
+import re
 import subprocess
+import time
+from contextlib import asynccontextmanager
+
+from . import metrics, pulse, singleflight
 
 logger = logging.getLogger(__name__)
 
+_DEVICE_IFACE = "org.bluez.Device1"
 
-def _run(args: list[str], timeout: int = 10) -> str:
-    """Run a bluetoothctl command and return stdout."""
-    try:
-        result = subprocess.run(
-            ["bluetoothctl"] + args,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-        )
-        return result.stdout + result.stderr
-    except FileNotFoundError:
-        return "ERROR: bluetoothctl not found"
-    except subprocess.TimeoutExpired:
-        return ""
-    except Exception as e:
-        return "ERROR: " + str(e)
+# Per-zone combined sinks are named with this prefix
+ZONE_SINK_PREFIX = "wakey_zone_"
 
+# Device table kept up to date by the bluetoothctl event watcher
+_cache: dict[str, dict] = {}
+_cache_live = False
+_watch_task: asyncio.Task | None = None
 
-def _pactl(args: list[str], timeout: int = 5) -> str:
-    """Run a pactl command and return stdout."""
-    try:
-        result = subprocess.run(
-            ["pactl"] + args,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-        )
-        if result.returncode != 0:
-            logger.warning("pactl %s failed (rc=%d): %s",
-                           " ".join(args), result.returncode, result.stderr.strip())
-        return result.stdout
-    except FileNotFoundError:
-        logger.error("pactl not found")
-        return ""
-    except subprocess.TimeoutExpired:
-        logger.warning("pactl %s timed out", " ".join(args))
-        return ""
-    except Exception as e:
-        logger.error("pactl %s error: %s", " ".join(args), e)
-        return ""
+# Shared discovery session: one bluetoothctl scan for all subscribers
+SCAN_MAX_SECONDS = 120
+_scan_subscribers: set[asyncio.Queue] = set()
+_scan_task: asyncio.Task | None = None
+
+_ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x01|\x02")
+_EVENT_RE = re.compile(r"\[(NEW|CHG|DEL)\] Device ([0-9A-Fa-f:]{17})\s?(.*)")
+_EVENT_PROPS = {
+    "Paired": "paired",
+    "Connected": "connected",
+    "Trusted": "trusted",
+    "Icon": "icon",
+    "RSSI": "rssi",
+    "Alias": "name",
+}
 
 
+def _run(args: list[str], timeout: int = 10) -> str:
+    """Run a bluetoothctl command and return stdout."""
+    with metrics.timed("bluetoothctl", args[0] if args else "") as call:
+        try:
+            result = subprocess.run(
+                ["bluetoothctl"] + args,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+            )
+            if result.returncode != 0:
+                call.outcome = "failed"
+            return result.stdout + result.stderr
+        except FileNotFoundError:
+            call.outcome = "missing"
+            return "ERROR: bluetoothctl not found"
+        except subprocess.TimeoutExpired:
+            call.outcome = "timeout"
+            return ""
+        except Exception as e:
+            call.outcome = "error"
+            return "ERROR: " + str(e)
+
+
+@singleflight.shared(lambda duration=8: "bt:scan")
 async def scan(duration: int = 8) -> list[dict]:
     """Scan for nearby Bluetooth devices. Blocks for `duration` seconds."""
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, lambda: subprocess.run(
-        ["bluetoothctl", "--timeout", str(duration), "scan", "on"],
-        capture_output=True,
-        text=True,
-        timeout=duration + 5,
-    ))
+    async with scan_session():
+        await asyncio.sleep(duration)
     return list_devices()
 
 
+@asynccontextmanager
+async def scan_session():
+    """Subscribe to the shared discovery session.
+
+    Yields a queue receiving device dicts as they are discovered or change,
+    and None when discovery ends. Discovery starts with the first subscriber
+    and stops when the last one leaves.
+    """
+    global _scan_task
+    queue: asyncio.Queue = asyncio.Queue()
+    _scan_subscribers.add(queue)
+    if _scan_task is None or _scan_task.done():
+        _scan_task = asyncio.create_task(_run_discovery())
+    try:
+        yield queue
+    finally:
+        _scan_subscribers.discard(queue)
+        if not _scan_subscribers and _scan_task is not None:
+            _scan_task.cancel()
+            _scan_task = None
+
+
+async def _run_discovery() -> None:
+    """Run one bluetoothctl discovery, feeding its device events to the cache."""
+    logger.info("Bluetooth discovery started")
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "bluetoothctl", "--timeout", str(SCAN_MAX_SECONDS), "scan", "on",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            m = _EVENT_RE.search(_ANSI_RE.sub("", line.decode(errors="replace")))
+            if m:
+                _apply_event(*m.groups())
+    except FileNotFoundError:
+        logger.error("bluetoothctl not found, cannot scan")
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if proc is not None and proc.returncode is None:
+            proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), 3)
+            except asyncio.TimeoutError:
+                proc.kill()
+        # A cancelled session may finish after a new one started; its
+        # subscribers belong to the new session and must not be ended
+        if _scan_task is asyncio.current_task():
+            for queue in _scan_subscribers:
+                queue.put_nowait(None)
+        logger.info("Bluetooth discovery stopped")
+
+
+def _managed_objects() -> dict | None:
+    """Fetch all BlueZ objects and properties with one D-Bus GetManagedObjects call.
+
+    Uses busctl's JSON output; returns None if busctl or BlueZ is unavailable.
+    """
+    with metrics.timed("busctl", "GetManagedObjects") as call:
+        try:
+            result = subprocess.run(
+                ["busctl", "--system", "--json=short", "call", "org.bluez", "/",
+                 "org.freedesktop.DBus.ObjectManager", "GetManagedObjects"],
+                capture_output=True,
+                text=True,
+                timeout=5,
+            )
+        except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+            call.outcome = "missing" if isinstance(e, FileNotFoundError) else "timeout"
+            return None
+        if result.returncode != 0:
+            call.outcome = "failed"
+    if result.returncode != 0:
+        logger.debug("GetManagedObjects failed: %s", result.stderr.strip())
+        return None
+    try:
+        return json.loads(result.stdout)["data"][0]
+    except (ValueError, KeyError, IndexError):
+        logger.warning("Unexpected GetManagedObjects output")
+        return None
+
+
+def _device_from_props(props: dict) -> dict:
+    """Build a device dict from BlueZ Device1 properties (busctl variants)."""
+    values = {k: v.get("data") if isinstance(v, dict) else v for k, v in props.items()}
+    mac = values.get("Address", "")
+    return {
+        "mac": mac,
+        "name": values.get("Alias") or values.get("Name") or mac,
+        "paired": bool(values.get("Paired", False)),
+        "connected": bool(values.get("Connected", False)),
+        "trusted": bool(values.get("Trusted", False)),
+        "icon": values.get("Icon", "") or "",
+        "rssi": values.get("RSSI"),
+    }
+
+
+def _sort_devices(devices: list[dict]) -> list[dict]:
+    # Sort: connected first, then paired, then the rest
+    devices.sort(key=lambda d: (not d["connected"], not d["paired"], d["name"]))
+    return devices
+
+
 def list_devices() -> list[dict]:
-    """List all known Bluetooth devices, sorted: connected > paired > rest."""
+    """List all known Bluetooth devices, sorted: connected > paired > rest.
+
+    Served from the watcher's device table when it is running.
+    """
+    if _cache_live:
+        return _sort_devices([dict(d) for d in _cache.values()])
+    return _snapshot_devices()
+
+
+def _snapshot_devices() -> list[dict]:
+    """Query BlueZ for the current device list."""
+    objects = _managed_objects()
+    if objects is None:
+        return _list_devices_bluetoothctl()
+    devices = [
+        _device_from_props(ifaces[_DEVICE_IFACE])
+        for ifaces in objects.values()
+        if _DEVICE_IFACE in ifaces
+    ]
+    return _sort_devices(devices)
+
+
+def _list_devices_bluetoothctl() -> list[dict]:
+    """Fallback listing: `bluetoothctl devices` plus one `info` call per device."""
     output = _run(["devices"])
     devices = []
     for line in output.strip().splitlines():
@@ -81,10 +224,132 @@ def list_devices() -> list[dict]:
                     "connected": info.get("connected", False),
                     "trusted": info.get("trusted", False),
                     "icon": info.get("icon", ""),
+                    "rssi": None,
                 })
-    # Sort: connected first, then paired, then the rest
-    devices.sort(key=lambda d: (not d["connected"], not d["paired"], d["name"]))
-    return devices
+    return _sort_devices(devices)
+
+
+def get_device(mac: str) -> dict | None:
+    """Return a known device by MAC address."""
+    mac = mac.upper()
+    for dev in list_devices():
+        if dev["mac"].upper() == mac:
+            return dev
+    return None
+
+
+def _new_device(mac: str, name: str = "") -> dict:
+    return {"mac": mac, "name": name or mac, "paired": False, "connected": False,
+            "trusted": False, "icon": "", "rssi": None}
+
+
+def _apply_event(kind: str, mac: str, rest: str) -> None:
+    """Apply one bluetoothctl [NEW]/[CHG]/[DEL] device event to the cache."""
+    mac = mac.upper()
+    if kind == "DEL":
+        _cache.pop(mac, None)
+        return
+    dev = _cache.get(mac)
+    if dev is None:
+        dev = _cache[mac] = _new_device(mac, rest.strip() if kind == "NEW" else "")
+    if kind == "NEW" or ":" not in rest:
+        _publish(dev)
+        return
+
+    key, value = rest.split(":", 1)
+    prop = _EVENT_PROPS.get(key.strip())
+    if not prop:
+        return
+    value = value.strip()
+    if prop == "rssi":
+        # "-60" or, on newer BlueZ, "0xffffffc4 (-60)"
+        m = re.search(r"\((-?\d+)\)", value) or re.match(r"(-?\d+)", value)
+        dev["rssi"] = int(m.group(1)) if m else None
+    elif prop in ("paired", "connected", "trusted"):
+        new = value.startswith("yes")
+        if prop == "connected" and new != dev["connected"]:
+            if new:
+                logger.info("Bluetooth device %s (%s) connected", dev["name"], mac)
+            else:
+                logger.warning("Bluetooth device %s (%s) disconnected", dev["name"], mac)
+        dev[prop] = new
+    else:
+        dev[prop] = value
+    _publish(dev)
+
+
+def _publish(dev: dict) -> None:
+    for queue in _scan_subscribers:
+        queue.put_nowait(dict(dev))
+
+
+async def _watch() -> None:
+    """Follow bluetoothctl device events and keep the device table current.
+
+    A bluetoothctl session prints [NEW]/[CHG]/[DEL] lines for BlueZ
+    InterfacesAdded/PropertiesChanged/InterfacesRemoved signals, which works
+    without the root privileges a raw D-Bus monitor needs.
+    """
+    global _cache, _cache_live
+    loop = asyncio.get_running_loop()
+    backoff = 1
+    while True:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "bluetoothctl",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            logger.info("bluetoothctl not found, Bluetooth state cache disabled")
+            return
+
+        started = time.monotonic()
+        try:
+            # Seed after the session is up so no events are missed in between
+            devices = await loop.run_in_executor(None, _snapshot_devices)
+            _cache = {d["mac"].upper(): d for d in devices}
+            _cache_live = True
+            logger.info("Bluetooth state cache live (%d devices)", len(_cache))
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                m = _EVENT_RE.search(_ANSI_RE.sub("", line.decode(errors="replace")))
+                if m:
+                    _apply_event(*m.groups())
+        finally:
+            _cache_live = False
+            if proc.returncode is None:
+                proc.terminate()
+                try:
+                    await asyncio.wait_for(proc.wait(), 3)
+                except asyncio.TimeoutError:
+                    proc.kill()
+
+        if time.monotonic() - started > 60:
+            backoff = 1
+        logger.warning("bluetoothctl event session exited, restarting in %ds", backoff)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+def start_watcher() -> None:
+    global _watch_task
+    if _watch_task is None or _watch_task.done():
+        _watch_task = asyncio.create_task(_watch())
+
+
+async def stop_watcher() -> None:
+    global _watch_task
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except asyncio.CancelledError:
+            pass
+        _watch_task = None
 
 
 def _get_device_info(mac: str) -> dict:
@@ -104,12 +369,22 @@ def _get_device_info(mac: str) -> dict:
     return info
 
 
+@singleflight.shared(lambda mac: "bt:connect:" + mac.upper())
 async def connect_device(mac: str) -> dict:
-    """Pair, trust, and connect to a Bluetooth device."""
+    """Pair, trust, and connect to a Bluetooth device.
+
+    Concurrent calls for one MAC share a single attempt; connecting and
+    disconnecting the same device are serialized.
+    """
+    async with singleflight.lock("bt:" + mac.upper()):
+        return await _connect_device(mac)
+
+
+async def _connect_device(mac: str) -> dict:
     loop = asyncio.get_event_loop()
 
     # Check if already connected
-    info = _get_device_info(mac)
+    info = get_device(mac) or {}
     if info.get("connected"):
         return {"ok": True, "already": True}
 
@@ -132,34 +407,40 @@ async def connect_device(mac: str) -> dict:
         return {"ok": False, "error": "Connection failed: " + _extract_error(conn_out)}
 
     # Wait for PulseAudio to pick up the new sink
-    await asyncio.sleep(2)
+    await wait_for_sink(mac, present=True)
 
     # If multiple devices connected, set up combined sink
     connected = get_connected_devices()
     if len(connected) > 1:
-        await loop.run_in_executor(None, setup_combined_sink)
+        await ensure_combined_sink()
 
     logger.info("Connected to %s", mac)
     return {"ok": True}
 
 
+@singleflight.shared(lambda mac: "bt:disconnect:" + mac.upper())
 async def disconnect_device(mac: str) -> dict:
     """Disconnect a Bluetooth device."""
+    async with singleflight.lock("bt:" + mac.upper()):
+        return await _disconnect_device(mac)
+
+
+async def _disconnect_device(mac: str) -> dict:
     loop = asyncio.get_event_loop()
     output = await loop.run_in_executor(None, lambda: _run(["disconnect", mac], timeout=10))
     if "Failed" in output:
         return {"ok": False, "error": _extract_error(output)}
 
     # Wait for PulseAudio to update
-    await asyncio.sleep(1)
+    await wait_for_sink(mac, present=False)
 
     # Update combined sink if there are still multiple connected
     connected = get_connected_devices()
     if len(connected) > 1:
-        await loop.run_in_executor(None, setup_combined_sink)
+        await ensure_combined_sink()
     elif len(connected) == 1:
         # Single device left, remove combined sink and use it directly
-        await loop.run_in_executor(None, remove_combined_sink)
+        await clear_combined_sink()
     return {"ok": True}
 
 
@@ -177,29 +458,26 @@ def get_connected_device() -> dict | None:
 
 def get_bt_sinks() -> list[str]:
     """Get PulseAudio sink names for connected Bluetooth devices."""
-    output = _pactl(["list", "sinks", "short"])
-    sinks = []
-    for line in output.strip().splitlines():
-        parts = line.split("\t")
-        if len(parts) >= 2 and "bluez" in parts[1].lower():
-            sinks.append(parts[1])
-    return sinks
+    return [name for name in pulse.sink_names() if "bluez" in name.lower()]
 
 
 def setup_combined_sink() -> bool:
     """Create a PulseAudio combined sink for all connected BT devices."""
-    sinks = get_bt_sinks()
+    sinks = sorted(get_bt_sinks())
     logger.info("setup_combined_sink: found %d bluez sinks: %s", len(sinks), sinks)
     if len(sinks) < 2:
         return False
 
+    slaves = ",".join(sinks)
+    if _combined_sink_slaves() == slaves:
+        logger.info("Combined sink already covers %s", slaves)
+        return True
+
     # Remove existing combined sink first
     remove_combined_sink()
 
-    slaves = ",".join(sinks)
     logger.info("Creating combined sink with slaves: %s", slaves)
-    output = _pactl([
-        "load-module", "module-combine-sink",
+    output = pulse.load_module("module-combine-sink", [
         "sink_name=wakey_combined",
         "sink_properties=device.description=Wakey_Combined",
         "slaves=" + slaves,
@@ -207,19 +485,114 @@ def setup_combined_sink() -> bool:
     logger.info("load-module result: %s", output.strip())
 
     # Set as default
-    _pactl(["set-default-sink", "wakey_combined"])
+    pulse.set_default_sink("wakey_combined")
     return True
 
 
+def _combined_sink_slaves() -> str | None:
+    """Slaves argument of the current combined sink module, if loaded."""
+    for module in _combined_sink_modules():
+        for arg in module["args"].split():
+            if arg.startswith("slaves="):
+                return arg[len("slaves="):]
+    return None
+
+
+def _combined_sink_modules() -> list[dict]:
+    return [
+        m for m in pulse.modules()
+        if m["name"] == "module-combine-sink" and "wakey_combined" in m["args"]
+    ]
+
+
+async def _combined_sink_op(name: str, fn):
+    """Run a blocking combined-sink operation in a thread.
+
+    Identical operations share one run; setup and removal never overlap.
+    """
+    async def locked():
+        async with singleflight.lock("pa:combined"):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, fn)
+    return await singleflight.run("pa:combined:" + name, locked)
+
+
+def _sinks_for(macs: list[str]) -> list[str]:
+    """PulseAudio sink names of the given (connected) devices."""
+    names = get_bt_sinks()
+    sinks = []
+    for mac in macs:
+        key = mac.replace(":", "_").upper()
+        sinks += [n for n in names if key in n.upper()][:1]
+    return sorted(sinks)
+
+
+def setup_zone_sink(macs: list[str]) -> str | None:
+    """Return a sink playing to exactly these speakers, creating one if needed.
+
+    One speaker uses its own sink; several get a dedicated combined sink.
+    Returns None if none of the speakers has a sink.
+    """
+    sinks = _sinks_for(macs)
+    if not sinks:
+        return None
+    if len(sinks) == 1:
+        return sinks[0]
+
+    slaves = ",".join(sinks)
+    name = ZONE_SINK_PREFIX + hashlib.sha1(slaves.encode()).hexdigest()[:8]
+    for module in pulse.modules():
+        if module["name"] == "module-combine-sink" and "sink_name=" + name in module["args"]:
+            return name
+    logger.info("Creating zone sink %s with slaves: %s", name, slaves)
+    pulse.load_module("module-combine-sink", [
+        "sink_name=" + name,
+        "sink_properties=device.description=Wakey_Zone",
+        "slaves=" + slaves,
+    ])
+    return name
+
+
+def remove_zone_sink(name: str) -> None:
+    for module in pulse.modules():
+        if module["name"] == "module-combine-sink" and "sink_name=" + name in module["args"]:
+            pulse.unload_module(module["index"])
+            logger.info("Removed zone sink %s", name)
+
+
+async def ensure_zone_sink(macs: list[str]) -> str | None:
+    key = ",".join(sorted(m.upper() for m in macs))
+    return await _combined_sink_op("zone:" + key, lambda: setup_zone_sink(macs))
+
+
+async def ensure_combined_sink() -> bool:
+    return await _combined_sink_op("setup", setup_combined_sink)
+
+
+async def clear_combined_sink() -> None:
+    await _combined_sink_op("remove", remove_combined_sink)
+
+
 def remove_combined_sink() -> None:
     """Remove the combined sink if it exists."""
-    output = _pactl(["list", "modules", "short"])
-    for line in output.strip().splitlines():
-        parts = line.split("\t")
-        if len(parts) >= 2 and "module-combine-sink" in line and "wakey_combined" in line:
-            module_id = parts[0]
-            _pactl(["unload-module", module_id])
-            logger.info("Removed combined sink module %s", module_id)
+    for module in _combined_sink_modules():
+        pulse.unload_module(module["index"])
+        logger.info("Removed combined sink module %s", module["index"])
+
+
+async def wait_for_sink(mac: str, present: bool = True, timeout: float = 5) -> bool:
+    """Wait until the device's PulseAudio sink appears (or disappears)."""
+    key = mac.replace(":", "_").upper()
+    deadline = time.monotonic() + timeout
+    while True:
+        found = any(key in name.upper() for name in get_bt_sinks())
+        if found == present:
+            return True
+        if time.monotonic() >= deadline:
+            logger.warning("Sink for %s did not %s within %.0fs",
+                           mac, "appear" if present else "disappear", timeout)
+            return False
+        await asyncio.sleep(0.25)
 
 
 def _mac_to_sink(mac: str) -> str:
@@ -244,23 +617,15 @@ def get_sink_volumes() -> list[dict]:
 
 def _get_sink_volume(sink_name: str) -> int:
     """Get volume percentage for a specific sink."""
-    output = _pactl(["get-sink-volume", sink_name])
-    # Output like: Volume: front-left: 28835 /  44% / -7.13 dB, ...
-    for part in output.split("/"):
-        part = part.strip()
-        if part.endswith("%"):
-            try:
-                return int(part[:-1].strip())
-            except ValueError:
-                pass
-    return 50  # fallback
+    vol = pulse.get_sink_volume(sink_name)
+    return vol if vol is not None else 50  # fallback
 
 
 def set_sink_volume(mac: str, volume: int) -> bool:
     """Set volume for a specific BT device by MAC address."""
     sink = _mac_to_sink(mac)
     volume = max(0, min(100, volume))
-    _pactl(["set-sink-volume", sink, str(volume) + "%"])
+    pulse.set_sink_volume(sink, volume)
     return True
 
 
@@ -0,0 +1,228 @@
+"""Large radio station catalog with a compact in-memory search index.
+
+The catalog is an optional file (e.g. an offline radio-browser dump) set via
+WAKEY_STATION_CATALOG. It is loaded on first use only, so startup is not
+affected when it is unused. Supported formats: JSON array, JSON lines
+(.jsonl/.ndjson) and CSV, using radio-browser field names.
+
+Catalog stations get ids of the form "rb:<stationuuid>" and can be used
+anywhere a RADIO_STATIONS id is accepted.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Iterable
+
+from .models import RADIO_STATIONS
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FILE = os.environ.get("WAKEY_STATION_CATALOG", "")
+
+ID_PREFIX = "rb:"
+MAX_PAGE_SIZE = 200
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_index: StationIndex | None = None
+_load_lock = threading.Lock()
+# Catalog files that failed to load; not retried until restart
+_failed: set[str] = set()
+_preload_task: asyncio.Task | None = None
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class StationIndex:
+    """Column-oriented station table plus token, tag and country indexes.
+
+    Rows are ordered by popularity (votes) so any ascending list of row
+    numbers is already in ranking order.
+    """
+
+    def __init__(self, rows: list[tuple]):
+        rows.sort(key=lambda r: -r[5])
+        self.ids = [r[0] for r in rows]
+        self.names = [r[1] for r in rows]
+        self.urls = [r[2] for r in rows]
+        self.countries = [r[3] for r in rows]
+        self.tags = [r[4] for r in rows]
+        self.row_by_id = {sid: i for i, sid in enumerate(self.ids)}
+
+        tokens: dict[str, array] = {}
+        by_tag: dict[str, array] = {}
+        by_country: dict[str, array] = {}
+        for i, (_, name, _, country, tags, _) in enumerate(rows):
+            for tok in set(_tokenize(name)):
+                tokens.setdefault(sys.intern(tok), array("I")).append(i)
+            for tag in tags:
+                by_tag.setdefault(tag, array("I")).append(i)
+            if country:
+                by_country.setdefault(country, array("I")).append(i)
+        self.tokens = tokens
+        self.sorted_tokens = sorted(tokens)
+        self.by_tag = by_tag
+        self.by_country = by_country
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _prefix_rows(self, prefix: str) -> set[int]:
+        rows: set[int] = set()
+        i = bisect_left(self.sorted_tokens, prefix)
+        while i < len(self.sorted_tokens) and self.sorted_tokens[i].startswith(prefix):
+            rows.update(self.tokens[self.sorted_tokens[i]])
+            i += 1
+        return rows
+
+    def search(self, q: str = "", tag: str = "", country: str = "",
+               offset: int = 0, limit: int = 50) -> tuple[int, list[dict]]:
+        """Prefix-match every query token, then filter. Returns (total, page)."""
+        matched: set[int] | None = None
+        for tok in _tokenize(q):
+            rows = self._prefix_rows(tok)
+            matched = rows if matched is None else matched & rows
+            if not matched:
+                return 0, []
+        if tag:
+            rows = set(self.by_tag.get(tag.casefold(), ()))
+            matched = rows if matched is None else matched & rows
+        if country:
+            rows = set(self.by_country.get(country.upper(), ()))
+            matched = rows if matched is None else matched & rows
+
+        if matched is None:
+            total = len(self)
+            page = range(offset, min(total, offset + limit))
+        else:
+            total = len(matched)
+            page = sorted(matched)[offset:offset + limit]
+        return total, [self.row(i) for i in page]
+
+    def row(self, i: int) -> dict:
+        return {
+            "id": ID_PREFIX + self.ids[i],
+            "name": self.names[i],
+            "country": self.countries[i],
+            "tags": list(self.tags[i]),
+        }
+
+    def get(self, station_id: str) -> dict | None:
+        i = self.row_by_id.get(station_id)
+        if i is None:
+            return None
+        return {"name": self.names[i], "url": self.urls[i]}
+
+
+def _iter_records(path: Path):
+    suffix = path.suffix.lower()
+    with open(path, encoding="utf-8", newline="") as fh:
+        if suffix == ".csv":
+            yield from csv.DictReader(fh)
+        elif suffix in (".jsonl", ".ndjson"):
+            for line in fh:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from json.load(fh)
+
+
+def _to_row(rec: dict) -> tuple | None:
+    uuid = rec.get("stationuuid") or rec.get("id")
+    url = rec.get("url_resolved") or rec.get("url")
+    name = (rec.get("name") or "").strip()
+    if not uuid or not url or not name:
+        return None
+    tags = rec.get("tags") or ""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    tags = tuple(sys.intern(t.strip().casefold()) for t in tags if t.strip())
+    country = sys.intern((rec.get("countrycode") or "").strip().upper())
+    try:
+        votes = int(rec.get("votes") or 0)
+    except (TypeError, ValueError):
+        votes = 0
+    return (str(uuid), name, url, country, tags, votes)
+
+
+def load_index(path: str | Path = "") -> StationIndex | None:
+    """Load and index the catalog file once. Returns None if not configured or it failed."""
+    global _index
+    path = str(path or CATALOG_FILE)
+    if _index is not None or not path or path in _failed:
+        return _index
+    with _load_lock:
+        if _index is None and path not in _failed:
+            rows = []
+            try:
+                for rec in _iter_records(Path(path)):
+                    row = _to_row(rec)
+                    if row:
+                        rows.append(row)
+            except Exception:
+                logger.exception("Failed to load station catalog %s", path)
+                _failed.add(path)
+                return None
+            _index = StationIndex(rows)
+            logger.info("Loaded station catalog: %d stations, %d tokens",
+                        len(_index), len(_index.sorted_tokens))
+    return _index
+
+
+async def load_index_async() -> StationIndex | None:
+    """Load the index off the event loop (first load can take a while)."""
+    if _index is not None or not CATALOG_FILE or CATALOG_FILE in _failed:
+        return _index
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, load_index)
+
+
+def preload(station_ids: Iterable[str]) -> None:
+    """Load the catalog in the background if any of `station_ids` is in it.
+
+    Called when alarms are scheduled, so an alarm never waits for the load.
+    """
+    global _preload_task
+    if _index is not None or not CATALOG_FILE or CATALOG_FILE in _failed:
+        return
+    if not any(s.startswith(ID_PREFIX) for s in station_ids):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _preload_task is None or _preload_task.done():
+        _preload_task = loop.create_task(load_index_async())
+
+
+def get_station(station_id: str) -> dict | None:
+    """Look up a built-in or catalog station: {"name", "url"} or None.
+
+    Never loads the catalog, so it is safe on the event loop; catalog
+    stations are found once it is loaded (see get_station_async).
+    """
+    station = RADIO_STATIONS.get(station_id)
+    if station or not station_id.startswith(ID_PREFIX) or _index is None:
+        return station
+    return _index.get(station_id[len(ID_PREFIX):])
+
+
+async def get_station_async(station_id: str) -> dict | None:
+    """get_station, loading the catalog off the event loop first if needed."""
+    if station_id.startswith(ID_PREFIX):
+        await load_index_async()
+    return get_station(station_id)
@@ -0,0 +1,56 @@
+"""Conditional GET: strong ETags from resource revisions, 304 on a match.
+
+An ETag is the process boot id plus the revision of whatever backs the
+resource (a store in config.py, the Hue room snapshot, ...). Routes check
+If-None-Match before loading or serializing anything:
+
+    tag = conditional.etag("alarms", config.revision("alarms"))
+    if conditional.matches(request, tag):
+        return conditional.not_modified(tag)
+    conditional.set_etag(response, tag)
+
+Revisions restart at 0 on every start; the boot id keeps tags from an
+earlier process from matching. In multi-worker mode revisions and the id
+come from the shared runtime database. Browsers revalidate on their own (fetch()
+uses the HTTP cache), so the frontend needs no changes.
+"""
+
+from __future__ import annotations
+
+import uuid
+
+from fastapi import Request, Response
+
+from . import shared
+
+# Workers sharing state also share revisions, and so their tags
+BOOT_ID = shared.generation() if shared.ENABLED else uuid.uuid4().hex[:8]
+
+# Cache, but ask every time; a match costs one 304 without a body
+CACHE_CONTROL = "no-cache"
+
+
+def etag(*parts: object) -> str:
+    return '"' + "-".join([BOOT_ID, *map(str, parts)]) + '"'
+
+
+def matches(request: Request, tag: str) -> bool:
+    """True if the request's If-None-Match lists `tag` (or is "*")."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        # If-None-Match uses the weak comparison (RFC 9110 13.1.2)
+        if candidate == "*" or candidate.removeprefix("W/") == tag:
+            return True
+    return False
+
+
+def not_modified(tag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": tag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, tag: str) -> None:
+    response.headers["ETag"] = tag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -7,14 +7,33 @@ import logging
 import os
 from pathlib import Path
 
+from . import metrics, shared
 from .models import Alarm, AppConfig
 
 logger = logging.getLogger(__name__)
 
 DATA_FILE = Path(os.environ.get("WAKEY_DATA", Path(__file__).parent / "alarms.json"))
 
+# Bumped on every save of a store; routes surface them as ETags.
+# With several workers they live in the shared runtime database instead.
+_revisions = {"alarms": 0, "config": 0, "spotify_presets": 0}
+
+
+def revision(store: str) -> int:
+    """Current revision of a store ("alarms", "config" or "spotify_presets")."""
+    if shared.ENABLED:
+        return shared.revision(store)
+    return _revisions[store]
+
+
+def _bump(store: str) -> None:
+    _revisions[store] += 1
+    if shared.ENABLED:
+        shared.bump(store)
+
 
 def _load_raw() -> dict:
+    metrics.data_file_ops.inc("read")
     if not DATA_FILE.exists():
         return {}
     try:
@@ -25,7 +44,11 @@ def _load_raw() -> dict:
 
 
 def _save_raw(data: dict) -> None:
-    DATA_FILE.write_text(json.dumps(data, indent=2) + "\n")
+    metrics.data_file_ops.inc("write")
+    # Replace in one step: other workers may be reading the file right now
+    tmp = DATA_FILE.with_name(DATA_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2) + "\n")
+    os.replace(tmp, DATA_FILE)
 
 
 def load_alarms() -> list[Alarm]:
@@ -38,6 +61,7 @@ def save_alarms(alarms: list[Alarm]) -> None:
     data = _load_raw()
     data["alarms"] = [a.model_dump() for a in alarms]
     _save_raw(data)
+    _bump("alarms")
 
 
 def load_config() -> AppConfig:
@@ -50,6 +74,7 @@ def save_config(config: AppConfig) -> None:
     data = _load_raw()
     data["config"] = config.model_dump()
     _save_raw(data)
+    _bump("config")
 
 
 def load_spotify_presets() -> list[dict]:
@@ -61,3 +86,4 @@ def save_spotify_presets(presets: list[dict]) -> None:
     data = _load_raw()
     data["spotify_presets"] = presets
     _save_raw(data)
+    _bump("spotify_presets")
@@ -0,0 +1,301 @@
+"""Fleet mode: one coordinator node drives alarms on several Wakeys.
+
+WAKEY_FLEET_ROLE=coordinator with WAKEY_FLEET_NODES=http://bedroom:8000,...
+makes this node hold the alarm set. It pushes the set to every follower
+(whenever it changes, and on each sync round if a follower differs) and
+keeps an estimate of each follower's clock offset: NTP-style pings, keeping
+the sample with the shortest round trip among the last CLOCK_SAMPLES.
+
+When an alarm fires on the coordinator, it picks a start time LEAD_SECONDS
+ahead and sends each follower that instant converted to the follower's
+clock. Every node, the coordinator included, sleeps until that instant and
+then runs its own audio, Hue and Bluetooth actions, so rooms start within
+the clock estimate's error (milliseconds on a LAN) of each other.
+
+Followers (WAKEY_FLEET_ROLE=follower) keep the pushed alarms scheduled
+locally as a fallback: if no trigger arrives within FALLBACK_SECONDS of a
+local fire, they ring on their own. All fleet calls carry
+WAKEY_FLEET_TOKEN, which must be the same on every node.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+import httpx
+
+from . import alarm as alarm_manager
+from . import latency, metrics
+from .config import load_alarms
+from .models import Alarm
+
+logger = logging.getLogger(__name__)
+
+ROLE = os.environ.get("WAKEY_FLEET_ROLE", "").lower()       # "", "coordinator" or "follower"
+NODES = [u.strip().rstrip("/") for u in os.environ.get("WAKEY_FLEET_NODES", "").split(",") if u.strip()]
+TOKEN = os.environ.get("WAKEY_FLEET_TOKEN", "")
+LEAD_SECONDS = int(os.environ.get("WAKEY_FLEET_LEAD_MS", "1500")) / 1000
+SYNC_SECONDS = 30
+PINGS_PER_SYNC = 3
+CLOCK_SAMPLES = 12
+FALLBACK_SECONDS = 10
+TOKEN_HEADER = "X-Wakey-Fleet-Token"
+
+
+def authorized(token: str) -> bool:
+    return bool(TOKEN) and hmac.compare_digest(token.encode(), TOKEN.encode())
+
+
+def alarms_digest(alarms: list[dict]) -> str:
+    return hashlib.sha1(json.dumps(alarms, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def _alarm_dicts() -> list[dict]:
+    return [a.model_dump(mode="json") for a in load_alarms()]
+
+
+class Node:
+    """A follower as seen from the coordinator."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.samples: deque[tuple[float, float]] = deque(maxlen=CLOCK_SAMPLES)  # (rtt, offset)
+        self.offset = 0.0           # follower clock minus ours, seconds
+        self.rtt = 0.0
+        self.digest = ""            # alarm set the follower last reported
+        self.last_seen: str | None = None
+        self.error: str | None = None
+
+    def add_sample(self, rtt: float, offset: float) -> None:
+        self.samples.append((rtt, offset))
+        # The fastest round trip has the least room for asymmetric delay
+        self.rtt, self.offset = min(self.samples)
+
+    def to_dict(self, digest: str) -> dict:
+        return {
+            "url": self.url,
+            "offset_ms": round(self.offset * 1000, 2),
+            "rtt_ms": round(self.rtt * 1000, 2),
+            "samples": len(self.samples),
+            "in_sync": self.digest == digest,
+            "last_seen": self.last_seen,
+            "error": self.error,
+        }
+
+
+_nodes = [Node(url) for url in NODES] if ROLE == "coordinator" else []
+_client: httpx.AsyncClient | None = None
+_sync_task: asyncio.Task | None = None
+_push_task: asyncio.Task | None = None
+_push_again = False
+
+# Follower side: alarm id -> start time (our clock) of the last fleet trigger
+_claims: dict[str, float] = {}
+_claimed: dict[str, asyncio.Event] = {}
+_last_start: dict | None = None
+_start_tasks: set[asyncio.Task] = set()
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=5, headers={TOKEN_HEADER: TOKEN},
+                                    transport=metrics.transport("fleet"))
+    return _client
+
+
+# ── Coordinator ──
+
+async def _ping(node: Node) -> None:
+    t0 = time.time()
+    resp = await _http().get(node.url + "/api/fleet/clock")
+    t2 = time.time()
+    resp.raise_for_status()
+    data = resp.json()
+    node.add_sample(t2 - t0, data["time"] - (t0 + t2) / 2)
+    node.digest = data.get("alarms_digest", "")
+
+
+async def _push(node: Node, alarms: list[dict]) -> None:
+    resp = await _http().put(node.url + "/api/fleet/alarms", json={"alarms": alarms})
+    resp.raise_for_status()
+    node.digest = resp.json().get("alarms_digest", "")
+    logger.info("Pushed %d alarms to %s", len(alarms), node.url)
+
+
+async def _sync(node: Node) -> None:
+    try:
+        for _ in range(PINGS_PER_SYNC):
+            await _ping(node)
+        alarms = _alarm_dicts()
+        if node.digest != alarms_digest(alarms):
+            await _push(node, alarms)
+        node.last_seen = datetime.now().isoformat(timespec="seconds")
+        node.error = None
+    except Exception as e:
+        node.error = str(e) or type(e).__name__
+        logger.warning("Fleet node %s unreachable: %s", node.url, node.error)
+
+
+async def _sync_all() -> None:
+    await asyncio.gather(*(_sync(n) for n in _nodes))
+
+
+async def _sync_loop() -> None:
+    while True:
+        await _sync_all()
+        await asyncio.sleep(SYNC_SECONDS)
+
+
+async def _push_changes() -> None:
+    global _push_again
+    while True:
+        _push_again = False
+        await _sync_all()
+        if not _push_again:
+            return
+
+
+def alarms_changed() -> None:
+    """Hook for scheduler.sync_alarms: push a changed alarm set right away."""
+    global _push_task, _push_again
+    if ROLE != "coordinator" or not _nodes:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _push_task is None or _push_task.done():
+        _push_task = loop.create_task(_push_changes())
+    else:
+        # Changed again while pushing: push once more when that finishes
+        _push_again = True
+
+
+async def _send_trigger(node: Node, alarm: Alarm, at: float) -> None:
+    try:
+        resp = await _http().post(node.url + "/api/fleet/trigger", timeout=LEAD_SECONDS,
+                                  json={"alarm": alarm.model_dump(mode="json"), "at": at + node.offset})
+        resp.raise_for_status()
+    except Exception as e:
+        node.error = str(e) or type(e).__name__
+        logger.warning("Fleet trigger to %s failed: %s", node.url, node.error)
+
+
+# ── Both ──
+
+async def _start_at(alarm: Alarm, at: float) -> None:
+    """Sleep until `at` (our clock) and trigger the alarm locally."""
+    global _last_start
+    # Loop timers can fire a little early; never start before the instant
+    while (delay := at - time.time()) > 0:
+        await asyncio.sleep(delay)
+    late_ms = (time.time() - at) * 1000
+    _last_start = {"alarm_id": alarm.id, "at": at, "late_ms": round(late_ms, 2)}
+    logger.info("Fleet start of alarm %s, %.1f ms after the agreed instant", alarm.id, late_ms)
+    await alarm_manager.trigger_alarm(alarm)
+
+
+async def fire(alarm: Alarm, scheduled: datetime | None) -> None:
+    """Scheduler entry point for an alarm job in fleet mode."""
+    if ROLE == "coordinator":
+        at = time.time() + LEAD_SECONDS
+        # Wake latency counts from the agreed start, as on the followers
+        latency.begin(alarm.id, datetime.fromtimestamp(at))
+        await asyncio.gather(*(_send_trigger(n, alarm, at) for n in _nodes))
+        await _start_at(alarm, at)
+        return
+    # Follower: the coordinator's trigger normally arrives around now
+    if await _wait_for_claim(alarm.id):
+        return
+    logger.warning("No fleet trigger for alarm %s; ringing on the local schedule", alarm.id)
+    latency.begin(alarm.id, scheduled)
+    await alarm_manager.trigger_alarm(alarm)
+
+
+# ── Follower ──
+
+def _recently_claimed(alarm_id: str) -> bool:
+    """True if a fleet trigger for this alarm starts close to now (before or after)."""
+    at = _claims.get(alarm_id)
+    return at is not None and abs(time.time() - at) < FALLBACK_SECONDS + LEAD_SECONDS
+
+
+async def _wait_for_claim(alarm_id: str) -> bool:
+    if _recently_claimed(alarm_id):
+        return True
+    event = _claimed.setdefault(alarm_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), FALLBACK_SECONDS)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _claimed.pop(alarm_id, None)
+    return True
+
+
+def receive_trigger(alarm: Alarm, at: float) -> None:
+    """Start `alarm` at `at` (our clock), as sent by the coordinator."""
+    if _claims.get(alarm.id) == at:
+        return      # the same trigger delivered twice
+    _claims[alarm.id] = at
+    event = _claimed.get(alarm.id)
+    if event is not None:
+        event.set()
+    latency.begin(alarm.id, datetime.fromtimestamp(at))
+    task = asyncio.create_task(_start_at(alarm, at))
+    _start_tasks.add(task)
+    task.add_done_callback(_start_done)
+
+
+def _start_done(task: asyncio.Task) -> None:
+    _start_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Fleet start failed", exc_info=task.exception())
+
+
+# ── Lifecycle ──
+
+def start() -> None:
+    global _sync_task
+    if ROLE == "coordinator" and _nodes and (_sync_task is None or _sync_task.done()):
+        _sync_task = asyncio.create_task(_sync_loop())
+        logger.info("Fleet coordinator for %d nodes", len(_nodes))
+    elif ROLE == "follower":
+        logger.info("Fleet follower; alarms are managed by the coordinator")
+
+
+async def stop() -> None:
+    global _sync_task, _push_task, _client
+    for task in (_sync_task, _push_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _sync_task = _push_task = None
+    for task in list(_start_tasks):
+        task.cancel()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_status() -> dict:
+    digest = alarms_digest(_alarm_dicts())
+    return {
+        "role": ROLE or "standalone",
+        "lead_ms": int(LEAD_SECONDS * 1000),
+        "alarms_digest": digest,
+        "nodes": [n.to_dict(digest) for n in _nodes],
+        "last_start": _last_start,
+    }
@@ -0,0 +1,165 @@
+"""Fleet check: run a coordinator and followers on one machine and time their starts.
+
+    python -m wakey.fleetcheck --rounds 5 --budget-ms 50
+
+Starts --nodes uvicorn processes on consecutive ports from --port (the
+first is the coordinator), each with its own data file in a temp dir and
+the soak harness's stub binaries on PATH, so nothing on the host is
+touched. Once the followers hold the coordinator's alarms, a silent test
+alarm (no audio, no Hue) is fired with /api/fleet/test/<id> every round
+and every node's last start is read back from /api/fleet/status. All nodes
+share one clock here, so the spread of their start instants is what the
+protocol itself adds. The check fails (exit status 1) if a node does not
+start or the spread exceeds the budget.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from .soak import _write_stubs
+
+logger = logging.getLogger("wakey.fleetcheck")
+
+TOKEN_HEADER = "X-Wakey-Fleet-Token"
+
+
+def _launch(work: Path, port: int, env: dict) -> subprocess.Popen:
+    data = work / str(port)
+    data.mkdir()
+    env = dict(
+        env,
+        WAKEY_DATA=str(data / "alarms.json"),
+        WAKEY_STATION_CACHE=str(data / "station_cache.json"),
+        WAKEY_PREBUFFER_DIR=str(data / "prebuffer"),
+    )
+    log = open(data / "uvicorn.log", "wb")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "wakey.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def _until(check, timeout: float, what: str) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if await check():
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("timed out waiting for " + what)
+        await asyncio.sleep(0.2)
+
+
+async def run(args: argparse.Namespace, work: Path) -> int:
+    token = secrets.token_hex(16)
+    urls = [f"http://127.0.0.1:{args.port + i}" for i in range(args.nodes)]
+    env = dict(os.environ, WAKEY_FLEET_TOKEN=token,
+               PATH=str(work / "bin") + os.pathsep + os.environ.get("PATH", ""))
+    procs = [_launch(work, args.port, dict(env, WAKEY_FLEET_ROLE="coordinator",
+                                           WAKEY_FLEET_NODES=",".join(urls[1:])))]
+    procs += [_launch(work, args.port + i, dict(env, WAKEY_FLEET_ROLE="follower"))
+              for i in range(1, args.nodes)]
+    coordinator = urls[0]
+    failed = False
+    try:
+        async with httpx.AsyncClient(timeout=10, headers={TOKEN_HEADER: token}) as client:
+            async def up() -> bool:
+                for url in urls:
+                    (await client.get(url + "/api/fleet/status")).raise_for_status()
+                return True
+
+            await _until(up, 30, "all nodes to start")
+            resp = await client.post(coordinator + "/api/alarms", json={
+                "label": "fleet check", "enabled": False,
+                "hue": {"enabled": False}, "audio": {"enabled": False},
+            })
+            resp.raise_for_status()
+            alarm_id = resp.json()["id"]
+
+            async def in_sync() -> bool:
+                status = (await client.get(coordinator + "/api/fleet/status")).json()
+                return all(n["in_sync"] for n in status["nodes"])
+
+            await _until(in_sync, 30, "followers to receive the alarm")
+            logger.info("%d nodes up, alarm %s on every node", args.nodes, alarm_id)
+
+            spreads = []
+            for round_ in range(1, args.rounds + 1):
+                before = {}
+                for url in urls:
+                    before[url] = (await client.get(url + "/api/fleet/status")).json()["last_start"]
+                (await client.post(f"{coordinator}/api/fleet/test/{alarm_id}")).raise_for_status()
+                starts = {}
+
+                async def started() -> bool:
+                    for url in urls:
+                        last = (await client.get(url + "/api/fleet/status")).json()["last_start"]
+                        if last and last != before[url]:
+                            starts[url] = last["at"] + last["late_ms"] / 1000
+                    return len(starts) == len(urls)
+
+                try:
+                    await _until(started, 10, "every node to start")
+                except TimeoutError:
+                    missing = ", ".join(u for u in urls if u not in starts)
+                    logger.error("Round %d: no start on %s", round_, missing)
+                    failed = True
+                    break
+                spread = (max(starts.values()) - min(starts.values())) * 1000
+                spreads.append(spread)
+                logger.info("Round %d: start spread %.2f ms", round_, spread)
+                for url in urls:
+                    await client.post(url + "/api/dismiss")
+
+            if spreads:
+                logger.info("Start spread over %d rounds: max %.2f ms, mean %.2f ms",
+                            len(spreads), max(spreads), sum(spreads) / len(spreads))
+                if max(spreads) > args.budget_ms:
+                    logger.error("Spread exceeds the %.0f ms budget", args.budget_ms)
+                    failed = True
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    if failed:
+        logger.error("Node logs are in %s", work)
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=3, help="coordinator plus followers (default 3)")
+    parser.add_argument("--port", type=int, default=8801, help="first port (default 8801)")
+    parser.add_argument("--rounds", type=int, default=5, help="test triggers to fire")
+    parser.add_argument("--budget-ms", type=float, default=50, help="allowed start spread")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    work = Path(tempfile.mkdtemp(prefix="wakey-fleetcheck-"))
+    (work / "bin").mkdir()
+    _write_stubs(work / "bin")
+    sys.exit(asyncio.run(run(args, work)))
+
+
+if __name__ == "__main__":
+    main()
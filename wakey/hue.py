@@ -3,14 +3,24 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import logging
+import time
 
 import httpx
 
+from . import latency, metrics, singleflight, timeline
 from .models import GlobalHueConfig, HueConfig
 
 logger = logging.getLogger(__name__)
 
+ROOMS_TTL_SECONDS = 60
+
+# Last room list (without light state). Its revision is a digest of the
+# content, so every worker agrees on it.
+_rooms: dict = {"rooms": None, "revision": None, "fetched": 0.0, "source": None}
+
 
 def _bridge_url(cfg: GlobalHueConfig) -> str:
     return f"http://{cfg.bridge_ip}/api/{cfg.username}"
@@ -19,7 +29,7 @@ def _bridge_url(cfg: GlobalHueConfig) -> str:
 async def register_user(bridge_ip: str) -> dict:
     """Register a new API user. The bridge link button must be pressed first."""
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             resp = await client.post(
                 f"http://{bridge_ip}/api",
                 json={"devicetype": "wakey#alarm"},
@@ -38,12 +48,13 @@ async def register_user(bridge_ip: str) -> dict:
         return {"ok": False, "error": str(e)}
 
 
+@singleflight.shared(lambda cfg, include_state=False: f"hue:rooms:{cfg.bridge_ip}:{cfg.username}:{include_state}")
 async def get_rooms(cfg: GlobalHueConfig, include_state: bool = False) -> list[dict]:
     """Fetch groups/rooms from the Hue bridge."""
     if not cfg.bridge_ip or not cfg.username:
         return []
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             resp = await client.get(f"{_bridge_url(cfg)}/groups")
             resp.raise_for_status()
             data = resp.json()
@@ -66,25 +77,54 @@ async def get_rooms(cfg: GlobalHueConfig, include_state: bool = False) -> list[d
         return []
 
 
+def rooms_revision(source: object) -> str | None:
+    """Revision of the cached room list, if it is fresh and came from `source`
+    (anything identifying the bridge settings)."""
+    if _rooms["rooms"] is None or _rooms["source"] != source:
+        return None
+    if time.monotonic() - _rooms["fetched"] > ROOMS_TTL_SECONDS:
+        return None
+    return _rooms["revision"]
+
+
+async def room_snapshot(cfg: GlobalHueConfig, source: object) -> tuple[list[dict], str | None]:
+    """Room list from the cache or the bridge, with its revision.
+    An empty list (no bridge, or it failed) is not cached and has no revision."""
+    revision = rooms_revision(source)
+    if revision is not None:
+        return _rooms["rooms"], revision
+    rooms = await get_rooms(cfg)
+    if not rooms:
+        return rooms, None
+    if rooms != _rooms["rooms"]:
+        _rooms["rooms"] = rooms
+        _rooms["revision"] = hashlib.sha1(json.dumps(rooms, sort_keys=True).encode()).hexdigest()[:12]
+    _rooms["source"] = source
+    _rooms["fetched"] = time.monotonic()
+    return rooms, _rooms["revision"]
+
+
 async def set_room_state(cfg: GlobalHueConfig, room_id: str, state: dict) -> dict:
     """Set room state (on, bri, ct)."""
     if not cfg.bridge_ip or not cfg.username or not room_id:
         return {"ok": False, "error": "Hue not configured"}
     url = f"{_bridge_url(cfg)}/groups/{room_id}/action"
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        # Keep writes to one room in order
+        async with singleflight.lock("hue:room:" + room_id), httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             await client.put(url, json=state)
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 
+@singleflight.shared(lambda cfg, room_id="": f"hue:scenes:{cfg.bridge_ip}:{cfg.username}:{room_id}")
 async def get_scenes(cfg: GlobalHueConfig, room_id: str = "") -> list[dict]:
     """Fetch scenes, optionally filtered by room (group)."""
     if not cfg.bridge_ip or not cfg.username:
         return []
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             resp = await client.get(f"{_bridge_url(cfg)}/scenes")
             resp.raise_for_status()
             data = resp.json()
@@ -111,19 +151,20 @@ async def activate_scene(cfg: GlobalHueConfig, room_id: str, scene_id: str) -> d
         return {"ok": False, "error": "Hue not configured"}
     url = f"{_bridge_url(cfg)}/groups/{room_id}/action"
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with singleflight.lock("hue:room:" + room_id), httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             await client.put(url, json={"scene": scene_id})
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 
+@singleflight.shared(lambda cfg: f"hue:bridge:{cfg.bridge_ip}:{cfg.username}")
 async def check_bridge(cfg: GlobalHueConfig) -> dict:
     """Check bridge connectivity and return status."""
     if not cfg.bridge_ip or not cfg.username:
         return {"connected": False, "error": "Bridge IP or username not configured"}
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             resp = await client.get(f"http://{cfg.bridge_ip}/api/{cfg.username}/config")
             resp.raise_for_status()
             data = resp.json()
@@ -140,7 +181,7 @@ async def test_light(cfg: GlobalHueConfig, room_id: str) -> dict:
         return {"ok": False, "error": "Hue not fully configured"}
     url = f"{_bridge_url(cfg)}/groups/{room_id}/action"
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with singleflight.lock("hue:room:" + room_id), httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             # Turn on warm and dim
             await client.put(url, json={"on": True, "bri": 80, "ct": 400, "transitiontime": 5})
             await asyncio.sleep(2)
@@ -151,59 +192,60 @@ async def test_light(cfg: GlobalHueConfig, room_id: str) -> dict:
         return {"ok": False, "error": str(e)}
 
 
-async def sunrise_ramp(gcfg: GlobalHueConfig, alarm_hue: HueConfig, duration_minutes: int) -> None:
-    """Gradually ramp lights from warm dim to bright daylight.
+SUNRISE_STEP_SECONDS = 30
+
 
-    Steps every 30 seconds. transitiontime=300 (30s in deciseconds).
-    Brightness: 1 -> 254, Color temp: 500 -> 153 mired.
-    Supports multiple rooms.
+def sunrise_tracks(gcfg: GlobalHueConfig, alarm_hue: HueConfig,
+                   duration_minutes: int) -> list[timeline.Track]:
+    """Timeline tracks for a sunrise: warm dim to bright daylight, then the scene.
+
+    Steps every 30 seconds with a matching transitiontime, so the bridge
+    fades smoothly between steps. Brightness: 1 -> 254, Color temp:
+    500 -> warmth mired. Supports multiple rooms.
     """
     # Build room list: prefer rooms list, fall back to single room_id
     rooms = alarm_hue.rooms or ([{"id": alarm_hue.room_id}] if alarm_hue.room_id else [])
     if not gcfg.bridge_ip or not gcfg.username or not rooms:
         logger.warning("Hue not configured, skipping sunrise ramp")
-        return
+        return []
 
-    total_steps = max(1, (duration_minutes * 60) // 30)
+    duration = duration_minutes * 60
     room_names = ", ".join(r.get("name", r.get("id", "?")) for r in rooms)
+    logger.info("Sunrise ramp over %d min for rooms: %s", duration_minutes, room_names)
+
+    final = {"bri": 254, "ct": alarm_hue.warmth}
 
-    logger.info("Starting sunrise ramp: %d steps over %d min for rooms: %s",
-                total_steps, duration_minutes, room_names)
-
-    async with httpx.AsyncClient(timeout=5) as client:
-        for step in range(total_steps + 1):
-            t = step / total_steps  # 0.0 -> 1.0
-            bri = int(1 + t * 253)
-            ct = int(500 - t * (500 - alarm_hue.warmth))  # 500 -> warmth mired
-
-            body = {
-                "on": True,
-                "bri": bri,
-                "ct": ct,
-                "transitiontime": 300,  # 30s
-            }
-            for room in rooms:
-                url = f"{_bridge_url(gcfg)}/groups/{room['id']}/action"
-                try:
-                    await client.put(url, json=body)
-                    logger.debug("Sunrise step %d/%d room %s: bri=%d ct=%d",
-                                 step, total_steps, room.get("name", room["id"]), bri, ct)
-                except Exception:
-                    logger.warning("Sunrise step %d failed for room %s, continuing",
-                                   step, room.get("id"))
-
-            if step < total_steps:
-                await asyncio.sleep(30)
-
-    # Activate scene at end of ramp if configured
-    if alarm_hue.scene_id:
+    async def scene() -> None:
         for room in rooms:
             logger.info("Activating scene %s in room %s",
                         alarm_hue.scene_name or alarm_hue.scene_id,
                         room.get("name", room["id"]))
             await activate_scene(gcfg, room["id"], alarm_hue.scene_id)
 
-    logger.info("Sunrise ramp complete")
+    async def apply(value: dict) -> None:
+        body = {"on": True, "bri": value["bri"], "ct": value["ct"],
+                "transitiontime": SUNRISE_STEP_SECONDS * 10}
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
+            # Rooms are updated concurrently so they stay in step
+            results = await asyncio.gather(*(
+                client.put(f"{_bridge_url(gcfg)}/groups/{room['id']}/action", json=body)
+                for room in rooms
+            ), return_exceptions=True)
+        for room, r in zip(rooms, results):
+            if isinstance(r, Exception):
+                logger.warning("Sunrise step failed for room %s, continuing", room.get("id"))
+            elif r.status_code < 400:
+                latency.mark("hue_first_ack")
+        if alarm_hue.scene_id and value == final:
+            # Activate the scene after the last ramp step, so its fade can't override it
+            await scene()
+
+    return [timeline.Track(
+        "light",
+        [(0, {"bri": 1, "ct": 500}), (duration, final)],
+        apply,
+        step_seconds=SUNRISE_STEP_SECONDS,
+    )]
 
 
 async def lights_off(gcfg: GlobalHueConfig, room_id: str) -> None:
@@ -212,7 +254,7 @@ async def lights_off(gcfg: GlobalHueConfig, room_id: str) -> None:
         return
     url = f"{_bridge_url(gcfg)}/groups/{room_id}/action"
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("hue")) as client:
             await client.put(url, json={"on": False})
     except Exception:
         logger.warning("Failed to turn off lights")
@@ -0,0 +1,204 @@
+"""Crash-safe journal of in-flight alarms.
+
+Alarm phase transitions are appended as JSON lines (and fsynced) to a
+journal next to the data file. The writes run in order on one writer
+thread, so the fsync never holds up the event loop on the wake path:
+
+    {"event": "trigger", "alarm": {...}, "started": epoch}   timeline position 0
+    {"event": "snooze", "alarm_id": ..., "audio_at": secs}   audio restarts there
+    {"event": "dismiss", "alarm_id": ...}
+
+Positions are seconds on the alarm's timeline, so after a restart an alarm
+that was still in flight resumes at now - started: the sunrise continues at
+the right point of its curve, and audio and auto-stop keep their times.
+Alarms whose cron time fell within MISFIRE_GRACE_MINUTES of downtime are
+started late, at the position they would have reached.
+
+When no alarm is active the journal is compacted to one "fired" line per
+alarm (its last start), which is what keeps a missed-fire check from
+ringing an alarm twice.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from . import alarm as alarm_manager
+from . import latency, scheduler
+from .config import DATA_FILE, load_alarms
+from .models import Alarm
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = Path(os.environ.get("WAKEY_JOURNAL", DATA_FILE.with_suffix(".journal")))
+MISFIRE_GRACE_MINUTES = int(os.environ.get("WAKEY_MISFIRE_GRACE_MINUTES", "30"))
+
+_jobs: queue.Queue[Callable[[], None]] = queue.Queue()
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+
+
+def _submit(job: Callable[[], None]) -> None:
+    """Queue a journal write; they run one at a time, in order."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_loop, name="journal-writer", daemon=True)
+            _writer.start()
+    _jobs.put(job)
+
+
+def _write_loop() -> None:
+    while True:
+        job = _jobs.get()
+        try:
+            job()
+        except Exception:
+            logger.exception("Alarm journal write failed")
+        finally:
+            _jobs.task_done()
+
+
+def flush() -> None:
+    """Block until every queued write is on disk (shutdown)."""
+    _jobs.join()
+
+
+def _append(entry: dict) -> None:
+    entry["ts"] = round(time.time(), 3)
+    _submit(lambda: _write_line(entry))
+
+
+def _write_line(entry: dict) -> None:
+    try:
+        with open(JOURNAL_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError:
+        logger.exception("Failed to write the alarm journal")
+
+
+def record_trigger(alarm: Alarm, started: float) -> None:
+    _append({"event": "trigger", "alarm": alarm.model_dump(mode="json"), "started": started})
+
+
+def record_snooze(alarm_id: str, audio_at: float) -> None:
+    _append({"event": "snooze", "alarm_id": alarm_id, "audio_at": audio_at})
+
+
+def record_dismiss(alarm_id: str) -> None:
+    _append({"event": "dismiss", "alarm_id": alarm_id})
+
+
+def _read() -> list[dict]:
+    if not JOURNAL_FILE.exists():
+        return []
+    entries = []
+    for line in JOURNAL_FILE.read_text().splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # A crash mid-write leaves at most one torn line at the end
+            logger.warning("Skipping a damaged alarm journal line")
+    return entries
+
+
+def _fold(entries: list[dict]) -> tuple[dict[str, dict], dict[str, float]]:
+    """In-flight alarms (id -> trigger entry + audio_at) and last start per alarm."""
+    active: dict[str, dict] = {}
+    fired: dict[str, float] = {}
+    for e in entries:
+        try:
+            event = e.get("event")
+            if event == "trigger":
+                aid = e["alarm"]["id"]
+                active[aid] = {"alarm": e["alarm"], "started": float(e["started"]), "audio_at": None}
+                fired[aid] = float(e["started"])
+            elif event == "fired":
+                fired[e["alarm_id"]] = max(fired.get(e["alarm_id"], 0), float(e["started"]))
+            elif event == "snooze" and e.get("alarm_id") in active:
+                active[e["alarm_id"]]["audio_at"] = float(e["audio_at"])
+            elif event == "dismiss":
+                active.pop(e.get("alarm_id"), None)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            logger.warning("Skipping a malformed alarm journal entry: %.200r", e)
+    return active, fired
+
+
+def _rewrite(active: dict[str, dict], fired: dict[str, float]) -> None:
+    lines = [{"event": "fired", "alarm_id": aid, "started": t} for aid, t in fired.items()]
+    for aid, entry in active.items():
+        lines.append({"event": "trigger", "alarm": entry["alarm"], "started": entry["started"]})
+        if entry["audio_at"] is not None:
+            lines.append({"event": "snooze", "alarm_id": aid, "audio_at": entry["audio_at"]})
+    tmp = JOURNAL_FILE.with_name(JOURNAL_FILE.name + ".tmp")
+    try:
+        with open(tmp, "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, JOURNAL_FILE)
+    except OSError:
+        logger.exception("Failed to compact the alarm journal")
+
+
+def compact() -> None:
+    """Rewrite the journal as the in-flight alarms plus one "fired" line per alarm.
+
+    Queued behind the pending appends, so it sees all of them.
+    """
+    _submit(lambda: _rewrite(*_fold(_read())))
+
+
+def _ends_at(alarm: Alarm, audio_at: float | None) -> float:
+    """Timeline position of the alarm's auto-stop."""
+    if audio_at is None:
+        audio_at = alarm.hue.offset_minutes * 60 if alarm.hue.enabled else 0
+    return audio_at + alarm.auto_stop_minutes * 60
+
+
+async def replay() -> None:
+    """Resume alarms that were in flight at shutdown and start missed ones.
+
+    One bad entry or alarm is logged and skipped; it never stops startup.
+    """
+    active, fired = _fold(_read())
+    # Start over from the last starts; resumed alarms are journalled again
+    _submit(lambda: _rewrite({}, fired))
+
+    now = time.time()
+    for aid, entry in active.items():
+        try:
+            alarm = Alarm.model_validate(entry["alarm"])
+            position = now - entry["started"]
+            if position >= _ends_at(alarm, entry["audio_at"]):
+                logger.info("Alarm %s would have auto-stopped during downtime", aid)
+                continue
+            logger.info("Resuming alarm %s at %.0f s into its timeline", aid, position)
+            await alarm_manager.trigger_alarm(alarm, position=position, audio_at=entry["audio_at"])
+        except Exception:
+            logger.exception("Could not resume alarm %s from the journal", aid)
+
+    alarms = {a.id: a for a in load_alarms()}
+    for aid, due in scheduler.missed_fires(MISFIRE_GRACE_MINUTES * 60):
+        alarm = alarms.get(aid)
+        if alarm is None or alarm_manager.get_alarm(aid) or fired.get(aid, 0) >= due.timestamp() - 60:
+            continue
+        position = now - due.timestamp()
+        if position >= _ends_at(alarm, None):
+            continue
+        logger.warning("Alarm %s was due at %s during downtime; starting it %.0f s late",
+                       aid, due.strftime("%H:%M"), position)
+        try:
+            latency.begin(aid, due)
+            await alarm_manager.trigger_alarm(alarm, position=position)
+        except Exception:
+            logger.exception("Could not start missed alarm %s", aid)
@@ -0,0 +1,126 @@
+"""Wake-path latency instrumentation.
+
+Each scheduled alarm fire gets a Fire record holding the time of every
+stage of the wake path, measured from when APScheduler meant to run the
+job (or, for audio stages, from when audio was meant to start):
+
+    trigger          scheduled time -> trigger_alarm starts
+    hue_first_ack    scheduled time -> first Hue PUT acknowledged
+    player_started   audio start    -> radio player process spawned
+    audio_playing    audio start    -> player stream appears in PulseAudio
+    spotify_play_ack audio start    -> go-librespot accepted the play command
+    spotify_playing  audio start    -> go-librespot reports playback
+
+The current fire travels in a context variable, so tasks spawned while
+handling a fire (timeline tracks, single-flight runs) record into it and
+manual playback (test-radio) does not. Rolling histograms per stage are
+served by GET /api/latency and each stage is logged as it happens.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "trigger",
+    "hue_first_ack",
+    "player_started",
+    "audio_playing",
+    "spotify_play_ack",
+    "spotify_playing",
+)
+# Stages measured from the intended audio start instead of the fire time
+_AUDIO_STAGES = {"player_started", "audio_playing", "spotify_play_ack", "spotify_playing"}
+
+BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+SAMPLES_PER_STAGE = 500
+RECENT_FIRES = 20
+
+
+class Fire:
+    """Stage timings of one alarm fire."""
+
+    def __init__(self, alarm_id: str, scheduled: float):
+        self.alarm_id = alarm_id
+        self.scheduled = scheduled      # epoch seconds the job was due
+        self.audio_at = scheduled       # epoch seconds audio was due
+        self.stages: dict[str, int] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            "alarm_id": self.alarm_id,
+            "scheduled": datetime.fromtimestamp(self.scheduled).isoformat(),
+            "stages": dict(self.stages),
+        }
+
+
+_current: contextvars.ContextVar[Fire | None] = contextvars.ContextVar("wake_fire", default=None)
+_samples: dict[str, deque[int]] = {s: deque(maxlen=SAMPLES_PER_STAGE) for s in STAGES}
+_fires: deque[Fire] = deque(maxlen=RECENT_FIRES)
+
+
+def begin(alarm_id: str, scheduled: datetime | None) -> Fire:
+    """Start recording a fire in the current context."""
+    due = scheduled.timestamp() if scheduled else time.time()
+    fire = Fire(alarm_id, due)
+    _fires.append(fire)
+    _current.set(fire)
+    return fire
+
+
+def current() -> Fire | None:
+    return _current.get()
+
+
+def set_audio_offset(seconds: float) -> None:
+    """Audio is due this long after the fire (the sunrise offset)."""
+    fire = _current.get()
+    if fire is not None:
+        fire.audio_at = fire.scheduled + seconds
+
+
+def mark(stage: str) -> None:
+    """Record the first occurrence of `stage` for the current fire, if any."""
+    fire = _current.get()
+    if fire is None or stage in fire.stages:
+        return
+    ref = fire.audio_at if stage in _AUDIO_STAGES else fire.scheduled
+    ms = int((time.time() - ref) * 1000)
+    fire.stages[stage] = ms
+    _samples[stage].append(ms)
+    logger.info("Wake latency alarm %s: %s %d ms", fire.alarm_id, stage, ms)
+
+
+def _histogram(values: list[int]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pct(p: float) -> int:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    buckets = {}
+    for bound in BUCKETS_MS:
+        buckets["le_" + str(bound)] = sum(1 for v in ordered if v <= bound)
+    buckets["le_inf"] = len(ordered)
+    return {
+        "count": len(ordered),
+        "min": ordered[0],
+        "p50": pct(0.5),
+        "p95": pct(0.95),
+        "max": ordered[-1],
+        "buckets": buckets,
+    }
+
+
+def get_stats() -> dict:
+    return {
+        "stages": {s: _histogram(list(_samples[s])) for s in STAGES},
+        "recent": [f.to_dict() for f in reversed(_fires)],
+    }
@@ -0,0 +1,257 @@
+"""Leader election between uvicorn workers (multi-worker mode).
+
+Every worker tries to take an exclusive flock() on a lock file next to the
+runtime database. The one that gets it is the leader: it runs the
+scheduler, the Bluetooth/PulseAudio watchers and all audio and Hue
+actuation, and publishes its status to shared.py. The lock dies with the
+process, so when the leader exits another worker takes over within
+RETRY_SECONDS.
+
+Followers answer plain reads themselves (file-backed data, the published
+status, the page and its assets). Every other request is forwarded to the
+leader over a unix socket and run there through the app itself, so it
+behaves exactly as in a single process; response bodies are relayed as
+they are produced, so event streams work through a follower too.
+
+Without WAKEY_SHARED_STATE the process is its own leader and nothing here
+runs.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+from typing import Awaitable, Callable
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+from . import shared
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = shared.DB_FILE.with_suffix(".lock")
+SOCKET_PATH = os.environ.get("WAKEY_LEADER_SOCKET", str(shared.DB_FILE.with_suffix(".sock")))
+RETRY_SECONDS = 2
+# Long enough for a profiling request (profiler.MAX_SECONDS) to come back
+FORWARD_TIMEOUT_SECONDS = 330
+
+# GETs any worker can answer without the leader
+LOCAL_PATHS = {
+    "/", "/api/status", "/api/alarms", "/api/config", "/api/stations",
+    "/api/spotify/presets", "/api/hue/rooms",
+}
+LOCAL_PREFIXES = ("/assets/", "/static/", "/api/alarms/")
+
+# Not forwarded in either direction: hop-by-hop headers, plus the ones the
+# receiving side sets itself for its own framing (bodies are re-chunked).
+# Content-Encoding describes the body and travels with it.
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+_is_leader = not shared.ENABLED
+_lock_fd: int | None = None
+_campaign: asyncio.Task | None = None
+_server: asyncio.AbstractServer | None = None
+_app = None
+
+
+def is_leader() -> bool:
+    return _is_leader
+
+
+def serves_locally(method: str, path: str) -> bool:
+    """True if a follower can answer this request itself."""
+    if method not in ("GET", "HEAD"):
+        return False
+    return path in LOCAL_PATHS or path.startswith(LOCAL_PREFIXES)
+
+
+def _try_acquire() -> bool:
+    global _lock_fd
+    fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, f"{os.getpid()}\n".encode())
+    _lock_fd = fd
+    return True
+
+
+async def _run_campaign(app, on_elected: Callable[[], Awaitable[None]]) -> None:
+    global _is_leader
+    while not _try_acquire():
+        await asyncio.sleep(RETRY_SECONDS)
+    _is_leader = True
+    logger.info("Worker %d is now the leader", os.getpid())
+    await _serve(app)
+    await on_elected()
+
+
+def start(app, on_elected: Callable[[], Awaitable[None]]) -> None:
+    """Campaign for leadership; `on_elected` starts the leader-only services."""
+    global _campaign
+    _campaign = asyncio.create_task(_run_campaign(app, on_elected))
+
+
+async def stop() -> None:
+    global _campaign, _server, _app, _lock_fd, _is_leader
+    if _campaign is not None:
+        _campaign.cancel()
+        try:
+            await _campaign
+        except asyncio.CancelledError:
+            pass
+        _campaign = None
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+        try:
+            os.unlink(SOCKET_PATH)
+        except FileNotFoundError:
+            pass
+    _app = None
+    if _lock_fd is not None:
+        os.close(_lock_fd)
+        _lock_fd = None
+        _is_leader = False
+
+
+# ── Forwarding: followers -> leader ──
+# One request per connection: a JSON header line and the body, answered by a
+# JSON header line and the response body in frames ("<hex length>\n" + data,
+# then "0\n"). Frames are relayed as the app sends them, so streaming
+# responses (Server-Sent Events) stream; when the follower's client goes
+# away the follower closes the socket and the app sees http.disconnect.
+
+async def _serve(app) -> None:
+    global _server, _app
+    _app = app
+    try:
+        os.unlink(SOCKET_PATH)
+    except FileNotFoundError:
+        pass
+    _server = await asyncio.start_unix_server(_handle, path=SOCKET_PATH)
+
+
+def _scope(head: dict) -> dict:
+    path, _, query = head["url"].partition("?")
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": head["method"],
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in head["headers"]],
+        "server": ("leader", 80),
+        "client": None,
+    }
+
+
+async def _until_closed(reader: asyncio.StreamReader) -> None:
+    try:
+        await reader.read()
+    except OSError:
+        pass
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        head = json.loads(await reader.readline())
+        body = await reader.readexactly(head["body_length"])
+    except (OSError, ValueError, asyncio.IncompleteReadError):
+        writer.close()
+        return
+    # The follower sends nothing more; EOF means its client disconnected
+    closed = asyncio.ensure_future(_until_closed(reader))
+    body_sent = False
+
+    async def receive() -> dict:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.shield(closed)
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            # The follower's next read should already see what this request changed
+            shared.publish_now()
+            headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in message["headers"]]
+            out = {
+                "status": message["status"],
+                "headers": [(k, v) for k, v in headers if k.lower() not in _HOP_HEADERS],
+            }
+            writer.write(json.dumps(out).encode() + b"\n")
+        elif message["type"] == "http.response.body":
+            data = message.get("body", b"")
+            if data:
+                writer.write(b"%x\n" % len(data) + data)
+            if not message.get("more_body", False):
+                writer.write(b"0\n")
+            await writer.drain()
+
+    try:
+        await _app(_scope(head), receive, send)
+    except OSError:
+        pass    # the follower went away mid-response
+    except Exception:
+        logger.exception("Failed to run a forwarded request")
+    finally:
+        closed.cancel()
+        writer.close()
+
+
+async def _frames(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Yield the leader's response body frames; closing the socket ends the request there."""
+    try:
+        while size := int(await reader.readline(), 16):
+            yield await reader.readexactly(size)
+    except (OSError, ValueError, asyncio.IncompleteReadError):
+        logger.warning("Leader worker closed a forwarded response early")
+    finally:
+        writer.close()
+
+
+async def forward(request: Request) -> Response:
+    """Run `request` on the leader and stream back its response."""
+    body = await request.body()
+    url = request.url.path + ("?" + request.url.query if request.url.query else "")
+    head = {
+        "method": request.method,
+        "url": url,
+        "headers": [(k, v) for k, v in request.headers.items() if k not in _HOP_HEADERS],
+        "body_length": len(body),
+    }
+    try:
+        reader, writer = await asyncio.open_unix_connection(SOCKET_PATH)
+    except OSError:
+        return Response('{"detail":"No leader worker available"}', status_code=503,
+                        media_type="application/json")
+    try:
+        writer.write(json.dumps(head).encode() + b"\n" + body)
+        await writer.drain()
+        out = json.loads(await asyncio.wait_for(reader.readline(), FORWARD_TIMEOUT_SECONDS))
+    except (OSError, ValueError, asyncio.TimeoutError):
+        writer.close()
+        logger.exception("Forwarding %s %s to the leader failed", request.method, url)
+        return Response('{"detail":"Leader worker did not answer"}', status_code=502,
+                        media_type="application/json")
+    response = StreamingResponse(_frames(reader, writer), status_code=out["status"])
+    for k, v in out["headers"]:
+        response.headers.append(k, v)
+    return response
@@ -2,23 +2,26 @@
 
 from __future__ import annotations
 
+import asyncio
+import importlib
 import logging
+import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
 
-from . import scheduler
+from . import (assets, bluetooth, fleet, journal, leader, metrics, profiler, pulse, responses, scheduler, shared,
+               speakers, startup, watchdog)
 from .config import load_alarms
 from .routes import alarms as alarms_router
-from .routes import bluetooth as bluetooth_router
 from .routes import config as config_router
-from .routes import hue as hue_router
-from .routes import spotify as spotify_router
+from .routes import debug as debug_router
+from .routes import fleet as fleet_router
+from .routes import metrics as metrics_router
 from .routes import status as status_router
 
 logging.basicConfig(
@@ -31,25 +34,129 @@ BASE_DIR = Path(__file__).parent
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    scheduler.start()
-    scheduler.sync_alarms(load_alarms())
+    metrics.start()
+    watchdog.start()
+    if shared.ENABLED:
+        # Only the elected worker schedules and drives hardware
+        leader.start(app, _start_leader_services)
+    else:
+        await _start_leader_services()
+    # Alarms are already scheduled; compressing assets must not hold up the loop
+    with startup.phase("assets"):
+        await asyncio.to_thread(assets.build, BASE_DIR / "static")
+        assets.set_index(_render_index())
+    startup.ready()
     yield
+    if leader.is_leader():
+        await _stop_leader_services()
+    await leader.stop()
+    watchdog.stop()
+    await metrics.stop()
+
+
+def _render_index() -> str:
+    """index.html has no per-request content; render it once with the hashed URLs."""
+    # Jinja2 is only needed for this one render
+    from fastapi.templating import Jinja2Templates
+
+    templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+    return templates.get_template("index.html").render(asset_url=assets.url)
+
+
+async def _start_leader_services() -> None:
+    # Alarms first: everything else can wait
+    with startup.phase("scheduler"):
+        scheduler.start()
+        scheduler.sync_alarms(load_alarms())
+    with startup.phase("journal"):
+        # Pick up alarms a crash or restart interrupted, or made us miss
+        await journal.replay()
+    with startup.phase("integrations"):
+        if startup.enabled("bluetooth"):
+            bluetooth.start_watcher()
+            speakers.start()
+        pulse.start_watcher()
+        fleet.start()
+    if shared.ENABLED:
+        shared.publish("status", status_router.build_status)
+        shared.start_publishing()
+
+
+async def _stop_leader_services() -> None:
+    await shared.stop_publishing()
+    await fleet.stop()
+    await speakers.stop()
+    await pulse.stop_watcher()
+    await bluetooth.stop_watcher()
     scheduler.shutdown()
+    await asyncio.to_thread(journal.flush)
 
 
-app = FastAPI(title="Wakey", lifespan=lifespan)
+app = FastAPI(title="Wakey", lifespan=lifespan,
+              default_response_class=responses.app_response_class())
 
 app.include_router(alarms_router.router)
-app.include_router(bluetooth_router.router)
 app.include_router(config_router.router)
-app.include_router(hue_router.router)
-app.include_router(spotify_router.router)
+app.include_router(debug_router.router)
+app.include_router(fleet_router.router)
+app.include_router(metrics_router.router)
 app.include_router(status_router.router)
+# Optional integrations' routes are only imported when enabled
+for _name in startup.INTEGRATIONS:
+    if startup.enabled(_name):
+        app.include_router(importlib.import_module(f".routes.{_name}", __package__).router)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not the raw path (ids, MACs)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.observe_http(request.method, route, status, time.perf_counter() - start)
+        profiler.request_finished(getattr(request.state, "profile_session", None))
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile a single request when it carries X-Wakey-Profile and the admin token."""
+    if "x-wakey-profile" not in request.headers or not profiler.authorized(
+        request.headers.get("x-wakey-token", "")
+    ):
+        return await call_next(request)
+    session = profiler.begin_request()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.finish(session)
+    response.headers["X-Wakey-Profile-Id"] = session.id
+    return response
+
+
+@app.middleware("http")
+async def route_to_leader(request: Request, call_next):
+    """In multi-worker mode, run everything but plain reads on the leader."""
+    if leader.is_leader() or leader.serves_locally(request.method, request.url.path):
+        return await call_next(request)
+    return await leader.forward(request)
+
 
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+
+
+@app.get("/assets/{name}")
+async def asset(name: str, request: Request):
+    return assets.asset_response(name, request)
 
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+    return assets.index_response(request)
+
+
+startup.imported()
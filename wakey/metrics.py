@@ -0,0 +1,246 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Counters, gauges and histograms are plain dicts keyed by label values, so
+recording is a dict lookup and a few additions; nothing is exported until
+/metrics is scraped. No client library or push gateway is needed.
+
+External calls (Hue and go-librespot HTTP, bluetoothctl, busctl, pactl,
+pacmd, player processes) are recorded in wakey_external_call_seconds,
+labelled by module, operation and outcome.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_INTERVAL_SECONDS = 0.5
+
+_registry: list["_Metric"] = []
+
+
+def _fmt_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, v in sorted(self.values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(v)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or read from `fn` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], float] | None = None):
+        super().__init__(name, doc)
+        self.value = 0.0
+        self.fn = fn
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def render(self) -> list[str]:
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                logger.debug("Gauge %s failed", self.name)
+        return super().render() + [f"{self.name} {_fmt_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        v = self.values.get(labels)
+        if v is None:
+            v = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        v[bisect.bisect_left(self.buckets, value)] += 1
+        v[-1] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for key, v in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), v[:-1]):
+                cumulative += count
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {v[-1]!r}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+external_calls = Histogram(
+    "wakey_external_call_seconds",
+    "Duration of calls to external services and tools.",
+    ("module", "operation", "outcome"),
+)
+http_requests = Histogram(
+    "wakey_http_request_duration_seconds",
+    "Duration of HTTP requests served by Wakey (until response start).",
+    ("method", "route", "status"),
+)
+scheduler_jobs = Counter(
+    "wakey_scheduler_job_runs_total",
+    "Scheduler job runs by job type and outcome.",
+    ("job", "outcome"),
+)
+data_file_ops = Counter(
+    "wakey_data_file_operations_total",
+    "Reads and writes of the JSON data file.",
+    ("operation",),
+)
+loop_lag = Histogram(
+    "wakey_event_loop_lag_seconds",
+    "Extra delay of a periodic event-loop timer.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+loop_lag_last = Gauge("wakey_event_loop_lag_last_seconds", "Most recent event-loop lag sample.")
+
+
+class _Call:
+    outcome = "ok"
+
+
+@contextmanager
+def timed(module: str, operation: str) -> Iterator[_Call]:
+    """Time an external call. Set `.outcome` on the yielded object to override "ok";
+    an exception records "error"."""
+    call = _Call()
+    start = time.perf_counter()
+    try:
+        yield call
+    except asyncio.CancelledError:
+        call.outcome = "cancelled"
+        raise
+    except BaseException:
+        call.outcome = "error"
+        raise
+    finally:
+        external_calls.observe(time.perf_counter() - start, module, operation, call.outcome)
+
+
+# Path segments that are ids or credentials (Hue username, light/group ids)
+_ID_SEGMENT = re.compile(r"^(\d+|[0-9A-Za-z_-]{16,})$")
+
+
+def _route_of(url: httpx.URL) -> str:
+    return "/".join(":id" if _ID_SEGMENT.match(s) else s for s in url.path.split("/"))
+
+
+class _InstrumentedTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, module: str, **kwargs):
+        super().__init__(**kwargs)
+        self.module = module
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with timed(self.module, request.method + " " + _route_of(request.url)) as call:
+            resp = await super().handle_async_request(request)
+            if resp.status_code >= 400:
+                call.outcome = f"http_{resp.status_code // 100}xx"
+            return resp
+
+
+def transport(module: str) -> httpx.AsyncBaseTransport:
+    """httpx transport that records every request of `module` as an external call."""
+    return _InstrumentedTransport(module)
+
+
+def observe_http(method: str, route: str, status: int, seconds: float) -> None:
+    http_requests.observe(seconds, method, route, str(status))
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_lag_task: asyncio.Task | None = None
+
+
+async def _measure_lag() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LAG_INTERVAL_SECONDS
+        await asyncio.sleep(LAG_INTERVAL_SECONDS)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+def start() -> None:
+    global _lag_task
+    if _lag_task is None or _lag_task.done():
+        _lag_task = asyncio.create_task(_measure_lag())
+
+
+async def stop() -> None:
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
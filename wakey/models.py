@@ -4,7 +4,7 @@ from __future__ import annotations
 
 import uuid
 from enum import Enum
-from typing import Optional
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field
 
@@ -40,6 +40,7 @@ class AudioConfig(BaseModel):
     spotify_name: str = ""      # display name
     volume: int = 70  # target volume %
     ramp_seconds: int = 30
+    speakers: list[str] = Field(default_factory=list)  # BT MACs for this zone; empty = default output
     enabled: bool = True
 
 
@@ -66,9 +67,42 @@ class AlarmUpdate(BaseModel):
     auto_stop_minutes: Optional[int] = None
 
 
+class AlarmOperation(BaseModel):
+    """One step of a batch: create takes `alarm`, update takes `id` and `changes`,
+    delete/enable/disable take `id`."""
+    op: Literal["create", "update", "delete", "enable", "disable"]
+    id: str = ""
+    alarm: Optional[Alarm] = None
+    changes: Optional[AlarmUpdate] = None
+
+
+class AlarmBatch(BaseModel):
+    operations: list[AlarmOperation]
+
+
+class AlarmImport(BaseModel):
+    alarms: list[Alarm]
+    replace: bool = True        # False: add or update by id, keep the rest
+
+
+class PrebufferConfig(BaseModel):
+    enabled: bool = False
+    lead_minutes: int = 3       # start recording this long before audio starts
+    max_mb: int = 16            # ring buffer size on disk
+    start_seconds: int = 10     # how far behind live buffered playback starts
+
+
+class SpeakerConfig(BaseModel):
+    enabled: bool = True
+    preferred: list[str] = Field(default_factory=list)  # Bluetooth MACs to keep connected
+    keep_awake_minutes: int = 10  # play silence this long before the next alarm
+
+
 class AppConfig(BaseModel):
     """Global app configuration persisted alongside alarms."""
     hue: GlobalHueConfig = Field(default_factory=GlobalHueConfig)
+    prebuffer: PrebufferConfig = Field(default_factory=PrebufferConfig)
+    speakers: SpeakerConfig = Field(default_factory=SpeakerConfig)
 
 
 class AppState(BaseModel):
@@ -0,0 +1,252 @@
+"""Rolling on-disk pre-buffer of a radio stream.
+
+A few minutes before an alarm the configured station is recorded into a
+fixed-size ring buffer file. When audio starts, the player is fed from the
+most recent buffered audio and then keeps following the recorder, so
+playback starts instantly and the live stream takes over without a gap.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from . import resolver
+
+logger = logging.getLogger(__name__)
+
+BUFFER_DIR = Path(os.environ.get(
+    "WAKEY_PREBUFFER_DIR", Path(tempfile.gettempdir()) / "wakey-prebuffer"
+))
+
+_CHUNK_SIZE = 16 * 1024
+_DEFAULT_BITRATE_KBPS = 128
+
+_recorder: Recorder | None = None
+# Alarms the current recording was started for
+_owners: set[str] = set()
+
+
+class RingBuffer:
+    """Fixed-capacity byte ring stored in a file.
+
+    Positions are absolute byte offsets since recording started; only the
+    last `capacity` bytes are retained.
+    """
+
+    def __init__(self, path: Path, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self.written = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(path, "w+b")
+
+    @property
+    def oldest(self) -> int:
+        return max(0, self.written - self.capacity)
+
+    def write(self, data: bytes) -> None:
+        if len(data) > self.capacity:
+            self.written += len(data) - self.capacity
+            data = data[-self.capacity:]
+        pos = self.written % self.capacity
+        first = data[:self.capacity - pos]
+        self._fh.seek(pos)
+        self._fh.write(first)
+        if len(first) < len(data):
+            self._fh.seek(0)
+            self._fh.write(data[len(first):])
+        self._fh.flush()
+        self.written += len(data)
+
+    def read(self, offset: int, size: int) -> tuple[int, bytes]:
+        """Read up to `size` bytes from absolute `offset`.
+
+        Returns (offset, data); offset is moved forward if the requested
+        data has already been overwritten.
+        """
+        offset = max(offset, self.oldest)
+        size = min(size, self.written - offset)
+        if size <= 0:
+            return offset, b""
+        pos = offset % self.capacity
+        first = min(size, self.capacity - pos)
+        self._fh.seek(pos)
+        data = self._fh.read(first)
+        if first < size:
+            self._fh.seek(0)
+            data += self._fh.read(size - first)
+        return offset, data
+
+    def close(self) -> None:
+        try:
+            self._fh.close()
+            self.path.unlink()
+        except Exception:
+            pass
+
+
+class Recorder:
+    """Records one stream URL into a RingBuffer, reconnecting on errors."""
+
+    def __init__(self, station_id: str, url: str, capacity: int):
+        self.station_id = station_id
+        self.url = url
+        self.buffer = RingBuffer(BUFFER_DIR / (station_id + ".buf"), capacity)
+        self.bitrate_kbps = _DEFAULT_BITRATE_KBPS
+        self.connected = False
+        self.deadline = 0.0
+        self._task: asyncio.Task | None = None
+        self._new_data = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, max_seconds: int) -> None:
+        self.deadline = time.monotonic() + max_seconds
+        self._task = asyncio.create_task(self._run())
+
+    def extend(self, seconds: int) -> None:
+        """Keep recording at least `seconds` from now."""
+        self.deadline = max(self.deadline, time.monotonic() + seconds)
+
+    def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        self.connected = False
+        self._notify()
+
+    async def wait_for_data(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._new_data.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def start_offset(self, seconds: int) -> int:
+        """Offset that leaves roughly `seconds` of audio before the live edge."""
+        lag = seconds * self.bitrate_kbps * 1000 // 8
+        return max(self.buffer.oldest, self.buffer.written - lag)
+
+    def _notify(self) -> None:
+        event, self._new_data = self._new_data, asyncio.Event()
+        event.set()
+
+    async def _run(self) -> None:
+        task = asyncio.create_task(self._record_forever())
+        try:
+            # A snooze can move the deadline while we wait
+            while (remaining := self.deadline - time.monotonic()) > 0 and not task.done():
+                await asyncio.wait({task}, timeout=remaining)
+            if task.done():
+                task.result()
+            logger.info("Pre-buffer for %s reached its time limit", self.station_id)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("Pre-buffer recorder for %s failed", self.station_id)
+        finally:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.connected = False
+            self._notify()
+
+    async def _record_forever(self) -> None:
+        backoff = 1
+        timeout = httpx.Timeout(10, read=30)
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+            while True:
+                try:
+                    async with client.stream("GET", self.url) as resp:
+                        resp.raise_for_status()
+                        br = resp.headers.get("icy-br", "").split(",")[0]
+                        if br.isdigit():
+                            self.bitrate_kbps = int(br)
+                        self.connected = True
+                        backoff = 1
+                        logger.info("Pre-buffering %s (%d kbps)",
+                                    self.station_id, self.bitrate_kbps)
+                        async for chunk in resp.aiter_bytes(_CHUNK_SIZE):
+                            self.buffer.write(chunk)
+                            self._notify()
+                    logger.warning("Pre-buffer stream for %s ended, reconnecting",
+                                   self.station_id)
+                except httpx.HTTPError as e:
+                    logger.warning("Pre-buffer stream for %s failed: %s", self.station_id, e)
+                    # A dead mirror from the resolver cache: use the station's own URL
+                    self.url = resolver.invalidate(self.station_id, self.url) or self.url
+                self.connected = False
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+async def start_recording(station_id: str, url: str, max_mb: int, max_seconds: int,
+                          alarm_id: str) -> None:
+    """Start recording `url` for an alarm into a fresh ring buffer, replacing any current one.
+
+    An alarm on the station already being recorded shares that recording.
+    """
+    global _recorder
+    if _recorder and _recorder.running and _recorder.station_id == station_id:
+        _owners.add(alarm_id)
+        _recorder.extend(max_seconds)
+        return
+    stop_recording()
+    _recorder = Recorder(station_id, url, max(1, max_mb) * 1024 * 1024)
+    _recorder.start(max_seconds)
+    _owners.add(alarm_id)
+    logger.info("Pre-buffer recorder started for %s (%d MB, max %ds)",
+                station_id, max_mb, max_seconds)
+
+
+def extend_recording(station_id: str, seconds: int) -> None:
+    """Keep the station's recorder going at least `seconds` longer (snooze)."""
+    if _recorder is not None and _recorder.running and _recorder.station_id == station_id:
+        _recorder.extend(seconds)
+
+
+def release(alarm_id: str) -> None:
+    """An alarm is over: stop the recording unless another alarm it was started for remains."""
+    _owners.discard(alarm_id)
+    if not _owners:
+        stop_recording()
+
+
+def stop_recording() -> None:
+    global _recorder
+    _owners.clear()
+    if _recorder is not None:
+        _recorder.stop()
+        _recorder.buffer.close()
+        logger.info("Pre-buffer recorder stopped for %s", _recorder.station_id)
+        _recorder = None
+
+
+def get_recorder(station_id: str) -> Recorder | None:
+    """Return the active recorder for a station if it holds any audio."""
+    if (_recorder is not None and _recorder.running
+            and _recorder.station_id == station_id and _recorder.buffer.written > 0):
+        return _recorder
+    return None
+
+
+def get_status() -> dict:
+    if _recorder is None:
+        return {"recording": False}
+    return {
+        "recording": _recorder.running,
+        "station": _recorder.station_id,
+        "connected": _recorder.connected,
+        "buffered_bytes": _recorder.buffer.written - _recorder.buffer.oldest,
+        "bitrate_kbps": _recorder.bitrate_kbps,
+    }
@@ -0,0 +1,268 @@
+"""On-demand sampling profiler for the live process.
+
+A daemon thread samples the Python stacks of the process's threads via
+sys._current_frames() every SAMPLE_INTERVAL_SECONDS while a profiling
+session is active, and aggregates them into collapsed stacks
+("frame;frame;frame count" lines), which flamegraph.pl, speedscope and
+similar tools read directly. Nothing runs when no session is active.
+
+A session covers a fixed number of seconds, the next N HTTP requests, or
+the first seconds after the next alarm trigger. A single request can also
+be profiled on its own with the X-Wakey-Profile header. All of it requires
+the admin token from WAKEY_ADMIN_TOKEN; without one, profiling is off.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.environ.get("WAKEY_ADMIN_TOKEN", "")
+# Each sample walks every thread's stack while holding the GIL; 10 ms costs
+# a few percent of one core on a Pi (see "overhead_percent" in reports)
+SAMPLE_INTERVAL_SECONDS = int(os.environ.get("WAKEY_PROFILE_INTERVAL_MS", "10")) / 1000
+MAX_SECONDS = 300
+MAX_DEPTH = 64
+TOP_FUNCTIONS = 20
+
+# Worker threads parked waiting for work; the loop's own idle time (select) is kept
+_IDLE_FRAMES = {("threading.py", "wait"), ("queue.py", "get"), ("threading.py", "_wait_for_tstate_lock")}
+
+
+def authorized(token: str) -> bool:
+    """True if `token` matches the configured admin token."""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+class Session:
+    """One profiling run and its aggregated samples."""
+
+    def __init__(self, mode: str, thread_id: int | None = None):
+        self.id = uuid.uuid4().hex[:8]
+        self.mode = mode                # "seconds", "requests", "alarm" or "request"
+        self.thread_id = thread_id      # only sample this thread (None = all)
+        self.armed_at = datetime.now().isoformat(timespec="seconds")
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.samples = 0
+        self.sampler_seconds = 0.0      # CPU time the sampler spent walking stacks
+        self.counts: Counter[str] = Counter()
+        self.requests_left = 0
+        self.alarm_seconds = 0
+        self.done = asyncio.Event()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def state(self) -> str:
+        if self.finished is not None:
+            return "finished"
+        return "running" if self.started is not None else "armed"
+
+    def summary(self) -> dict:
+        end = self.finished or time.monotonic()
+        duration = end - self.started if self.started else 0
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "state": self.state,
+            "armed_at": self.armed_at,
+            "duration_s": round(duration, 2),
+            "samples": self.samples,
+            "overhead_percent": round(100 * self.sampler_seconds / duration, 2) if duration else 0,
+        }
+
+    def _snapshot(self) -> Counter[str]:
+        with _lock:
+            return Counter(self.counts)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self._snapshot().most_common())
+
+    def report(self) -> dict:
+        counts = self._snapshot()
+        # Self time: samples whose innermost frame is the function
+        leaf: Counter[str] = Counter()
+        for stack, n in counts.items():
+            leaf[stack.rsplit(";", 1)[-1]] += n
+        total = self.samples or 1
+        return {
+            **self.summary(),
+            "interval_ms": SAMPLE_INTERVAL_SECONDS * 1000,
+            # percent of wall time; busy threads together can exceed 100
+            "top": [
+                {"function": fn, "samples": n, "percent": round(100 * n / total, 1)}
+                for fn, n in leaf.most_common(TOP_FUNCTIONS)
+            ],
+            "collapsed": "".join(f"{stack} {n}\n" for stack, n in counts.most_common()),
+        }
+
+
+_lock = threading.Lock()
+_active: list[Session] = []          # sessions currently sampled
+_armed: list[Session] = []           # waiting for their trigger (next alarm)
+_reports: deque[Session] = deque(maxlen=20)
+_thread: threading.Thread | None = None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame, thread_name: str) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+def _sample_loop() -> None:
+    global _thread
+    me = threading.get_ident()
+    while True:
+        t0 = time.thread_time()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frames = sys._current_frames()
+        with _lock:
+            if not _active:
+                _thread = None
+                return
+            for tid, frame in frames.items():
+                if tid == me or (os.path.basename(frame.f_code.co_filename),
+                                 frame.f_code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = None
+                for s in _active:
+                    if s.thread_id is not None and s.thread_id != tid:
+                        continue
+                    if stack is None:
+                        stack = _collapse(frame, names.get(tid, str(tid)))
+                    s.counts[stack] += 1
+            spent = time.thread_time() - t0
+            for s in _active:
+                s.samples += 1
+                s.sampler_seconds += spent
+        del frames
+        time.sleep(SAMPLE_INTERVAL_SECONDS)
+
+
+def _begin(session: Session) -> None:
+    global _thread
+    session.started = time.monotonic()
+    with _lock:
+        _active.append(session)
+        if _thread is None:
+            _thread = threading.Thread(target=_sample_loop, name="wakey-profiler", daemon=True)
+            _thread.start()
+
+
+def finish(session: Session) -> None:
+    """Stop sampling a session and keep its report."""
+    if session.finished is not None:
+        return
+    with _lock:
+        if session in _active:
+            _active.remove(session)
+        if session in _armed:
+            _armed.remove(session)
+    if session._timer is not None:
+        session._timer.cancel()
+    session.finished = time.monotonic()
+    _reports.append(session)
+    logger.info("Profile %s (%s) finished: %d samples", session.id, session.mode, session.samples)
+    session.done.set()
+
+
+def _finish_later(session: Session, seconds: float) -> None:
+    loop = asyncio.get_running_loop()
+    session._timer = loop.call_later(min(seconds, MAX_SECONDS), finish, session)
+
+
+async def profile_for(seconds: float) -> Session:
+    """Sample the whole process for `seconds` and return the session."""
+    session = Session("seconds")
+    _begin(session)
+    _finish_later(session, seconds)
+    await session.done.wait()
+    return session
+
+
+def profile_requests(count: int, timeout: float) -> Session:
+    """Sample the process until `count` more HTTP requests have completed."""
+    session = Session("requests")
+    session.requests_left = count
+    _begin(session)
+    _finish_later(session, timeout)
+    return session
+
+
+def profile_next_alarm(seconds: float, timeout: float) -> Session:
+    """Sample the first `seconds` after the next alarm trigger."""
+    session = Session("alarm")
+    session.alarm_seconds = seconds
+    with _lock:
+        _armed.append(session)
+    # Give up if no alarm fires within `timeout` (not capped like sampling)
+    session._timer = asyncio.get_running_loop().call_later(timeout, finish, session)
+    return session
+
+
+def alarm_triggered() -> None:
+    """Hook for alarm.trigger_alarm: start sessions armed for the next alarm."""
+    with _lock:
+        armed, _armed[:] = list(_armed), []
+    for session in armed:
+        if session._timer is not None:
+            session._timer.cancel()
+        _begin(session)
+        _finish_later(session, session.alarm_seconds)
+
+
+def request_finished(created: str | None = None) -> None:
+    """Hook for the HTTP middleware: count down request-limited sessions.
+
+    `created` is the id of a session the finished request itself started;
+    that request does not count towards it.
+    """
+    for session in [s for s in _active if s.mode == "requests" and s.id != created]:
+        session.requests_left -= 1
+        if session.requests_left <= 0:
+            finish(session)
+
+
+def begin_request() -> Session:
+    """Profile one request on the event loop thread."""
+    session = Session("request", thread_id=threading.get_ident())
+    _begin(session)
+    return session
+
+
+def get_session(session_id: str) -> Session | None:
+    with _lock:
+        sessions = list(_active) + list(_armed)
+    for s in sessions + list(_reports):
+        if s.id == session_id:
+            return s
+    return None
+
+
+def get_status() -> dict:
+    with _lock:
+        pending = [s.summary() for s in _active + _armed]
+    return {
+        "enabled": bool(ADMIN_TOKEN),
+        "active": pending,
+        "reports": [s.summary() for s in reversed(_reports)],
+    }
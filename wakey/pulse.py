@@ -0,0 +1,383 @@
+"""PulseAudio client layer: cached sinks/modules/volumes + persistent command session.
+
+A long-lived `pactl subscribe` stream tells us when sinks or modules change;
+the cache is then refreshed with one `pactl list` call per burst of events,
+so reads (sink names, volumes, modules) are in-memory. Volume and default
+sink writes go through one long-lived `pacmd` session (a line on its stdin)
+instead of a new process per call. A reader thread checks each reply (the
+text before the next ">>> " prompt) and reruns failed commands with
+`pactl`, which is also used when pacmd is unavailable (e.g. PipeWire
+without the CLI protocol module).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# PA_VOLUME_NORM: 100%
+VOLUME_NORM = 65536
+
+_ENV = dict(os.environ, LC_ALL="C")
+
+_sinks: dict[str, dict] = {}    # name -> {"index": int, "volume": int | None}
+_modules: list[dict] = []       # [{"index": str, "name": str, "args": str}]
+_live = False
+_watch_task: asyncio.Task | None = None
+_refresh_handle: asyncio.TimerHandle | None = None
+
+_cmd_proc: subprocess.Popen | None = None
+# Commands sent on the current session and awaiting their reply: (line, pactl args)
+_cmd_pending: deque[tuple[str, list[str]]] = deque()
+_cmd_lock = threading.Lock()
+_pacmd_missing = False
+
+PROMPT = b">>> "
+# Longest reply kept while waiting for its prompt
+_MAX_REPLY = 64 * 1024
+
+_EVENT_RE = re.compile(r"Event '(\w+)' on (sink|module|server) #?(\d*)")
+_NEW_STREAM_RE = re.compile(r"Event 'new' on sink-input #\d+")
+
+# pid -> set once a playback stream of that process exists
+_stream_waiters: dict[int, asyncio.Event] = {}
+
+
+def pactl(args: list[str], timeout: int = 5) -> str:
+    """Run a pactl command and return stdout."""
+    # "list sinks" etc. are distinct operations; other args are values
+    op = " ".join(args[:2]) if args[:1] == ["list"] else (args[0] if args else "")
+    with metrics.timed("pactl", op) as call:
+        try:
+            result = subprocess.run(
+                ["pactl"] + args,
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+                env=_ENV,
+            )
+            if result.returncode != 0:
+                call.outcome = "failed"
+                logger.warning("pactl %s failed (rc=%d): %s",
+                               " ".join(args), result.returncode, result.stderr.strip())
+            return result.stdout
+        except FileNotFoundError:
+            call.outcome = "missing"
+            logger.error("pactl not found")
+            return ""
+        except subprocess.TimeoutExpired:
+            call.outcome = "timeout"
+            logger.warning("pactl %s timed out", " ".join(args))
+            return ""
+        except Exception as e:
+            call.outcome = "error"
+            logger.error("pactl %s error: %s", " ".join(args), e)
+            return ""
+
+
+def _parse_volume(text: str) -> int | None:
+    """Pull the first percentage out of a pactl volume line."""
+    # e.g. "front-left: 28835 /  44% / -7.13 dB, ..."
+    for part in text.split("/"):
+        part = part.strip()
+        if part.endswith("%"):
+            try:
+                return int(part[:-1].strip())
+            except ValueError:
+                pass
+    return None
+
+
+def _parse_sinks(output: str) -> dict[str, dict]:
+    """Parse `pactl list sinks` into {name: {"index", "volume"}}."""
+    sinks: dict[str, dict] = {}
+    index = None
+    name = None
+    for line in output.splitlines():
+        stripped = line.strip()
+        if line.startswith("Sink #"):
+            index, name = int(line[6:].strip()), None
+        elif stripped.startswith("Name:") and index is not None:
+            name = stripped.split(":", 1)[1].strip()
+            sinks[name] = {"index": index, "volume": None}
+        elif stripped.startswith("Volume:") and name in sinks and sinks[name]["volume"] is None:
+            sinks[name]["volume"] = _parse_volume(stripped.split(":", 1)[1])
+    return sinks
+
+
+def _parse_modules(output: str) -> list[dict]:
+    modules = []
+    for line in output.strip().splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 2:
+            modules.append({
+                "index": parts[0],
+                "name": parts[1],
+                "args": parts[2] if len(parts) > 2 else "",
+            })
+    return modules
+
+
+def refresh() -> None:
+    """Reload sinks and modules from the server (two pactl calls)."""
+    global _sinks, _modules
+    _sinks = _parse_sinks(pactl(["list", "sinks"]))
+    _modules = _parse_modules(pactl(["list", "modules", "short"]))
+
+
+def sink_names() -> list[str]:
+    if not _live:
+        output = pactl(["list", "sinks", "short"])
+        return [p[1] for p in (l.split("\t") for l in output.strip().splitlines()) if len(p) >= 2]
+    return list(_sinks)
+
+
+def modules() -> list[dict]:
+    if not _live:
+        return _parse_modules(pactl(["list", "modules", "short"]))
+    return list(_modules)
+
+
+def get_sink_volume(sink_name: str) -> int | None:
+    """Volume percentage of a sink, from cache when the watcher is live."""
+    if _live and sink_name in _sinks and _sinks[sink_name]["volume"] is not None:
+        return _sinks[sink_name]["volume"]
+    return _parse_volume(pactl(["get-sink-volume", sink_name]))
+
+
+def set_sink_volume(sink_name: str, percent: int) -> None:
+    """Set sink volume via the persistent command session."""
+    percent = max(0, min(150, percent))
+    raw = VOLUME_NORM * percent // 100
+    _send_command(f"set-sink-volume {sink_name} {raw}",
+                  ["set-sink-volume", sink_name, str(percent) + "%"])
+    if sink_name in _sinks:
+        _sinks[sink_name]["volume"] = percent
+
+
+def set_default_sink(sink_name: str) -> None:
+    _send_command("set-default-sink " + sink_name, ["set-default-sink", sink_name])
+
+
+def load_module(name: str, args: list[str]) -> str:
+    """Load a module; returns the pactl output (module index)."""
+    return pactl(["load-module", name] + args)
+
+
+def unload_module(index: str) -> None:
+    pactl(["unload-module", index])
+    _modules[:] = [m for m in _modules if m["index"] != index]
+
+
+async def _has_sink_input(pid: int) -> bool:
+    output = await asyncio.get_running_loop().run_in_executor(None, pactl, ["list", "sink-inputs"])
+    return f'application.process.id = "{pid}"' in output
+
+
+async def _check_stream_waiters() -> None:
+    """A stream appeared: see whose it is (one pactl call for all waiters)."""
+    output = await asyncio.get_running_loop().run_in_executor(None, pactl, ["list", "sink-inputs"])
+    for pid, event in list(_stream_waiters.items()):
+        if f'application.process.id = "{pid}"' in output:
+            event.set()
+
+
+async def wait_for_sink_input(pid: int, timeout: float = 15) -> bool:
+    """Wait until a playback stream from process `pid` exists.
+
+    With the watcher live this checks once, then on each new-stream event
+    from `pactl subscribe`; without it, it polls.
+    """
+    loop = asyncio.get_running_loop()
+    event = _stream_waiters[pid] = asyncio.Event()
+    try:
+        if await _has_sink_input(pid):
+            return True
+        if _live:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+                return True
+            except asyncio.TimeoutError:
+                return False
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(0.5)
+            if await _has_sink_input(pid):
+                return True
+        return False
+    finally:
+        _stream_waiters.pop(pid, None)
+
+
+def _send_command(line: str, fallback: list[str]) -> None:
+    """Write one command to the long-lived pacmd session.
+
+    Does not wait for the reply: _read_replies() checks it and runs
+    `pactl fallback` if pacmd rejected the command or is unavailable.
+    """
+    global _cmd_proc, _cmd_pending, _pacmd_missing
+    if not _pacmd_missing:
+        with _cmd_lock, metrics.timed("pacmd", line.split(" ", 1)[0]) as call:
+            if _cmd_proc is None or _cmd_proc.poll() is not None:
+                try:
+                    _cmd_proc = subprocess.Popen(
+                        ["pacmd"],
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        env=_ENV,
+                    )
+                except FileNotFoundError:
+                    _pacmd_missing = True
+                    _cmd_proc = None
+                if _cmd_proc is not None:
+                    # Never shared between sessions, so replies can't pair up wrongly
+                    _cmd_pending = deque()
+                    threading.Thread(target=_read_replies, args=(_cmd_proc, _cmd_pending),
+                                     name="pacmd-replies", daemon=True).start()
+                    try:
+                        # pacmd only greets and prompts (">>> ") in interactive mode,
+                        # which it turns on by itself only when stdin is a TTY
+                        _cmd_proc.stdin.write(b"hello\n")
+                    except OSError:
+                        pass
+            if _cmd_proc is not None:
+                entry = (line, fallback)
+                _cmd_pending.append(entry)
+                try:
+                    _cmd_proc.stdin.write(line.encode() + b"\n")
+                    _cmd_proc.stdin.flush()
+                    return
+                except OSError:
+                    call.outcome = "failed"
+                    _cmd_proc = None
+                    try:
+                        _cmd_pending.remove(entry)
+                    except ValueError:
+                        return  # the dying session's reader thread already ran it
+            else:
+                call.outcome = "unavailable"
+    pactl(fallback)
+
+
+def _read_replies(proc: subprocess.Popen, pending: deque[tuple[str, list[str]]]) -> None:
+    """Pair each prompt-terminated reply with its command; rerun failures with pactl."""
+    global _pacmd_missing
+    buf = b""
+    welcomed = False
+    while data := proc.stdout.read1(4096):
+        buf += data
+        while (end := buf.find(PROMPT)) >= 0:
+            reply, buf = buf[:end].decode(errors="replace").strip(), buf[end + len(PROMPT):]
+            if not welcomed:
+                welcomed = True     # the greeting before the first prompt
+                continue
+            if not pending:
+                continue
+            line, fallback = pending.popleft()
+            if reply:
+                # Successful writes print nothing; anything else is an error
+                logger.warning("pacmd %s failed: %s; retrying with pactl", line, reply)
+                pactl(fallback)
+        if len(buf) > _MAX_REPLY:
+            buf = buf[-_MAX_REPLY:]
+    if not welcomed:
+        # pacmd exits right away if the CLI protocol is unavailable
+        logger.info("pacmd session unavailable, using pactl for writes")
+        _pacmd_missing = True
+    while pending:
+        pactl(pending.popleft()[1])
+
+
+def _schedule_refresh(delay: float = 0.3) -> None:
+    """Debounce a background cache refresh after change events."""
+    global _refresh_handle
+    if not _live:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    if _refresh_handle is not None:
+        _refresh_handle.cancel()
+    _refresh_handle = loop.call_later(
+        delay, lambda: loop.run_in_executor(None, refresh)
+    )
+
+
+async def _watch() -> None:
+    """Follow `pactl subscribe` and keep the sink/module cache current."""
+    global _live
+    loop = asyncio.get_running_loop()
+    backoff = 1
+    while True:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "pactl", "subscribe",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                env=_ENV,
+            )
+        except FileNotFoundError:
+            logger.info("pactl not found, PulseAudio cache disabled")
+            return
+
+        started = time.monotonic()
+        try:
+            await loop.run_in_executor(None, refresh)
+            _live = True
+            logger.info("PulseAudio cache live (%d sinks)", len(_sinks))
+            while True:
+                line = await proc.stdout.readline()
+                if not line:
+                    break
+                text = line.decode(errors="replace")
+                if _EVENT_RE.search(text):
+                    _schedule_refresh()
+                elif _stream_waiters and _NEW_STREAM_RE.search(text):
+                    await _check_stream_waiters()
+        finally:
+            _live = False
+            if proc.returncode is None:
+                proc.terminate()
+                try:
+                    await asyncio.wait_for(proc.wait(), 3)
+                except asyncio.TimeoutError:
+                    proc.kill()
+
+        if time.monotonic() - started > 60:
+            backoff = 1
+        logger.warning("pactl subscribe exited, restarting in %ds", backoff)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+def start_watcher() -> None:
+    global _watch_task
+    if _watch_task is None or _watch_task.done():
+        _watch_task = asyncio.create_task(_watch())
+
+
+async def stop_watcher() -> None:
+    global _watch_task, _cmd_proc
+    if _watch_task is not None:
+        _watch_task.cancel()
+        try:
+            await _watch_task
+        except asyncio.CancelledError:
+            pass
+        _watch_task = None
+    with _cmd_lock:
+        if _cmd_proc is not None and _cmd_proc.poll() is None:
+            _cmd_proc.terminate()
+        _cmd_proc = None
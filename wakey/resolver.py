@@ -0,0 +1,227 @@
+"""Station stream URL resolver with mirror latency probing.
+
+Station URLs in RADIO_STATIONS usually point at load-balanced hosts that
+redirect or serve a .pls/.m3u playlist. The resolver follows those to the
+candidate stream URLs, probes each for time-to-headers and time-to-first-
+byte, and caches the fastest per station with a TTL. The cache is persisted
+next to the data file so restarts start warm. A cached URL that fails is
+dropped (invalidate()) and playback retries the configured one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from . import catalog
+from .config import DATA_FILE
+from .models import RADIO_STATIONS
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = Path(os.environ.get("WAKEY_STATION_CACHE", DATA_FILE.parent / "station_cache.json"))
+
+CACHE_TTL_SECONDS = 6 * 3600
+REFRESH_INTERVAL_MINUTES = 30
+
+_PLAYLIST_TYPES = ("audio/x-scpls", "audio/scpls", "audio/x-mpegurl", "audio/mpegurl")
+_PLAYLIST_SUFFIXES = (".pls", ".m3u")
+_MAX_PLAYLIST_DEPTH = 3
+_MAX_PROBES = 4
+
+_cache: dict[str, dict] | None = None
+_refresh_lock = asyncio.Lock()
+
+
+def _load_cache() -> dict[str, dict]:
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if CACHE_FILE.exists():
+            try:
+                _cache = json.loads(CACHE_FILE.read_text())
+            except Exception:
+                logger.exception("Failed to load station cache")
+    return _cache
+
+
+def _save_cache() -> None:
+    try:
+        CACHE_FILE.write_text(json.dumps(_load_cache(), indent=2) + "\n")
+    except Exception:
+        logger.exception("Failed to save station cache")
+
+
+def get_url(station_id: str) -> str | None:
+    """Return the best known stream URL for a station (cache lookup only)."""
+    station = RADIO_STATIONS.get(station_id)
+    if not station:
+        # Catalog stations are not probed; use their listed URL
+        station = catalog.get_station(station_id)
+        return station["url"] if station else None
+    entry = _load_cache().get(station_id)
+    # Fall back to the configured URL if the station definition changed
+    if entry and entry.get("source_url") == station["url"]:
+        return entry["url"]
+    return station["url"]
+
+
+def invalidate(station_id: str, url: str) -> str | None:
+    """A stream from `url` failed: drop it from the cache.
+
+    Returns the station's configured URL to retry with, or None if `url`
+    already was that.
+    """
+    station = RADIO_STATIONS.get(station_id)
+    if not station or url == station["url"]:
+        return None
+    entry = _load_cache().get(station_id)
+    if entry and entry.get("url") == url:
+        del _cache[station_id]
+        _save_cache()
+        logger.warning("Cached stream URL of %s failed, falling back to %s", station_id, station["url"])
+    return station["url"]
+
+
+def get_cache() -> dict[str, dict]:
+    return dict(_load_cache())
+
+
+def parse_playlist(text: str, base_url: str) -> list[str]:
+    """Extract stream URLs from .pls or .m3u playlist text."""
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or line.startswith("["):
+            continue
+        if "=" in line and line.lower().startswith("file"):
+            line = line.split("=", 1)[1].strip()
+        elif "=" in line:
+            continue
+        urls.append(urljoin(base_url, line))
+    return urls
+
+
+def _is_playlist(resp: httpx.Response) -> bool:
+    ctype = resp.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype in _PLAYLIST_TYPES:
+        return True
+    return urlparse(str(resp.url)).path.lower().endswith(_PLAYLIST_SUFFIXES)
+
+
+async def resolve_candidates(client: httpx.AsyncClient, url: str, depth: int = 0) -> list[str]:
+    """Follow redirects and playlists from `url` to a list of stream URLs."""
+    async with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        final_url = str(resp.url)
+        if not _is_playlist(resp):
+            return [final_url]
+        body = b""
+        async for chunk in resp.aiter_bytes():
+            body += chunk
+            if len(body) > 64 * 1024:
+                break
+    text = body.decode("utf-8", errors="replace")
+    if "#EXT-X-" in text:
+        # HLS media playlist: the playlist itself is what the player opens
+        return [final_url]
+    entries = parse_playlist(text, final_url)
+    if depth >= _MAX_PLAYLIST_DEPTH:
+        return entries
+    candidates: list[str] = []
+    for entry in entries[:_MAX_PROBES]:
+        try:
+            for c in await resolve_candidates(client, entry, depth + 1):
+                if c not in candidates:
+                    candidates.append(c)
+        except httpx.HTTPError as e:
+            logger.debug("Playlist entry %s failed: %s", entry, e)
+    return candidates
+
+
+async def probe(client: httpx.AsyncClient, url: str) -> dict | None:
+    """Measure time to response headers and first audio byte for a stream."""
+    start = time.monotonic()
+    try:
+        async with client.stream("GET", url) as resp:
+            resp.raise_for_status()
+            headers_at = time.monotonic()
+            async for chunk in resp.aiter_bytes():
+                if chunk:
+                    break
+            first_byte_at = time.monotonic()
+    except httpx.HTTPError as e:
+        logger.debug("Probe of %s failed: %s", url, e)
+        return None
+    return {
+        "url": url,
+        "connect_ms": int((headers_at - start) * 1000),
+        "first_byte_ms": int((first_byte_at - start) * 1000),
+    }
+
+
+async def resolve_station(client: httpx.AsyncClient, station_id: str) -> dict | None:
+    """Resolve and probe one station, returning the fastest candidate."""
+    source_url = RADIO_STATIONS[station_id]["url"]
+    try:
+        candidates = await resolve_candidates(client, source_url)
+    except httpx.HTTPError as e:
+        logger.warning("Resolving %s failed: %s", station_id, e)
+        return None
+    results = await asyncio.gather(*(probe(client, c) for c in candidates[:_MAX_PROBES]))
+    results = [r for r in results if r]
+    if not results:
+        return None
+    best = min(results, key=lambda r: r["first_byte_ms"])
+    best.update({
+        "source_url": source_url,
+        "candidates": len(results),
+        "resolved_at": time.time(),
+    })
+    return best
+
+
+async def refresh(force: bool = False) -> int:
+    """Re-resolve stations whose cache entry is missing or expired.
+
+    Returns the number of stations updated.
+    """
+    async with _refresh_lock:
+        cache = _load_cache()
+        now = time.time()
+        stale = [
+            sid for sid, station in RADIO_STATIONS.items()
+            if force
+            or sid not in cache
+            or cache[sid].get("source_url") != station["url"]
+            or now - cache[sid].get("resolved_at", 0) > CACHE_TTL_SECONDS
+        ]
+        if not stale:
+            return 0
+
+        sem = asyncio.Semaphore(4)
+        timeout = httpx.Timeout(5, read=10)
+
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+            async def one(sid: str) -> tuple[str, dict | None]:
+                async with sem:
+                    return sid, await resolve_station(client, sid)
+
+            results = await asyncio.gather(*(one(sid) for sid in stale))
+
+        updated = 0
+        for sid, entry in results:
+            if entry:
+                cache[sid] = entry
+                updated += 1
+        if updated:
+            _save_cache()
+        logger.info("Resolved %d/%d stations", updated, len(stale))
+        return updated
@@ -0,0 +1,67 @@
+"""JSON responses: a faster encoder app-wide, and pre-encoded read snapshots.
+
+orjson is used when installed (pip install orjson), the stdlib otherwise.
+Recent FastAPI versions already serialize typed route results straight to
+JSON bytes with Pydantic, but only with the default response class, so the
+orjson class is only made the app default on versions without that path.
+Read routes whose data only changes with a store revision serve snapshot():
+the JSON bytes are built once per revision and returned as-is, skipping
+model dumping, jsonable_encoder and encoding on every other request.
+"""
+
+from __future__ import annotations
+
+import inspect
+import json
+from typing import Any, Callable
+
+import fastapi.routing
+from fastapi.datastructures import Default
+from fastapi.responses import JSONResponse as _StdJSONResponse
+from fastapi.responses import Response
+
+from . import metrics
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+snapshot_requests = metrics.Counter(
+    "wakey_response_snapshots_total",
+    "Snapshot-backed responses, served from cache or rebuilt.",
+    ("name", "outcome"),
+)
+
+# name -> (revision, encoded body)
+_snapshots: dict[str, tuple[Any, bytes]] = {}
+
+
+def dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class JSONResponse(_StdJSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def app_response_class() -> Any:
+    """Default response class for the app (see the module docstring)."""
+    native = "dump_json" in inspect.signature(fastapi.routing.serialize_response).parameters
+    if orjson is None or native:
+        return Default(_StdJSONResponse)
+    return JSONResponse
+
+
+def snapshot(name: str, revision: Any, build: Callable[[], Any]) -> Response:
+    """JSON response of `build()`, encoded once per `revision` of `name`."""
+    cached = _snapshots.get(name)
+    if cached is None or cached[0] != revision:
+        cached = _snapshots[name] = (revision, dumps(build()))
+        snapshot_requests.inc(name, "built")
+    else:
+        snapshot_requests.inc(name, "cached")
+    return Response(cached[1], media_type="application/json")
@@ -1,31 +1,52 @@
-"""CRUD routes for alarms."""
+"""CRUD and bulk routes for alarms."""
 
 from __future__ import annotations
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 
+from .. import catalog, conditional, config, fleet, resolver, responses
 from ..config import load_alarms, save_alarms
-from ..models import Alarm, AlarmUpdate, RADIO_STATIONS
+from ..models import Alarm, AlarmBatch, AlarmImport, AlarmUpdate, RADIO_STATIONS
 from ..scheduler import sync_alarms
 
 router = APIRouter(prefix="/api")
 
 
 @router.get("/alarms")
-async def list_alarms() -> list[dict]:
-    return [a.model_dump() for a in load_alarms()]
+async def list_alarms(request: Request) -> list[dict]:
+    revision = config.revision("alarms")
+    tag = conditional.etag("alarms", revision)
+    if conditional.matches(request, tag):
+        return conditional.not_modified(tag)
+    response = responses.snapshot(
+        "alarms", revision, lambda: [a.model_dump(mode="json") for a in load_alarms()])
+    conditional.set_etag(response, tag)
+    return response
+
+
+def _check_editable() -> None:
+    if fleet.ROLE == "follower":
+        raise HTTPException(409, "Alarms are managed by the fleet coordinator")
 
 
 @router.post("/alarms", status_code=201)
 async def create_alarm(alarm: Alarm) -> dict:
+    _check_editable()
     alarms = load_alarms()
     alarm.id = Alarm().id
+    _check_alarm(alarm)
     alarms.append(alarm)
     save_alarms(alarms)
     sync_alarms(alarms)
     return alarm.model_dump()
 
 
+@router.get("/alarms/export")
+async def export_alarms() -> dict:
+    """The full alarm set, in the format POST /api/alarms/import takes."""
+    return {"alarms": [a.model_dump(mode="json") for a in load_alarms()]}
+
+
 @router.get("/alarms/{alarm_id}")
 async def get_alarm(alarm_id: str) -> dict:
     for a in load_alarms():
@@ -36,6 +57,7 @@ async def get_alarm(alarm_id: str) -> dict:
 
 @router.put("/alarms/{alarm_id}")
 async def update_alarm(alarm_id: str, update: AlarmUpdate) -> dict:
+    _check_editable()
     alarms = load_alarms()
     for i, a in enumerate(alarms):
         if a.id == alarm_id:
@@ -43,6 +65,7 @@ async def update_alarm(alarm_id: str, update: AlarmUpdate) -> dict:
             updates = update.model_dump(exclude_none=True)
             data.update(updates)
             alarms[i] = Alarm.model_validate(data)
+            _check_alarm(alarms[i])
             save_alarms(alarms)
             sync_alarms(alarms)
             return alarms[i].model_dump()
@@ -51,6 +74,7 @@ async def update_alarm(alarm_id: str, update: AlarmUpdate) -> dict:
 
 @router.delete("/alarms/{alarm_id}")
 async def delete_alarm(alarm_id: str) -> dict:
+    _check_editable()
     alarms = load_alarms()
     alarms = [a for a in alarms if a.id != alarm_id]
     save_alarms(alarms)
@@ -58,6 +82,153 @@ async def delete_alarm(alarm_id: str) -> dict:
     return {"ok": True}
 
 
-@router.get("/stations")
-async def list_stations() -> list[dict]:
+def _alarm_errors(a: Alarm) -> list[str]:
+    """What the scheduler would reject about an alarm."""
+    errors = []
+    hour, _, minute = a.time.partition(":")
+    if not (hour.isdigit() and minute.isdigit() and int(hour) < 24 and int(minute) < 60):
+        errors.append(f"invalid time {a.time!r}, expected HH:MM")
+    if any(not 0 <= d <= 6 for d in a.days):
+        errors.append("days must be 0 (Mon) to 6 (Sun)")
+    return errors
+
+
+def _check_alarm(a: Alarm) -> None:
+    errors = _alarm_errors(a)
+    if errors:
+        raise HTTPException(422, errors)
+
+
+def _commit(alarms: list[Alarm], changed: list[Alarm], errors: list[str]) -> None:
+    """Save and reschedule once, or change nothing if anything was invalid.
+
+    Only `changed` alarms are checked; the stored ones already were.
+    """
+    for a in changed:
+        errors += [f"alarm {a.id}: {e}" for e in _alarm_errors(a)]
+    if errors:
+        raise HTTPException(422, errors)
+    save_alarms(alarms)
+    sync_alarms(alarms)
+
+
+@router.post("/alarms/import")
+async def import_alarms(body: AlarmImport) -> dict:
+    """Replace the alarm set, or with "replace": false add/update alarms by id."""
+    _check_editable()
+    errors = []
+    current = {} if body.replace else {a.id: a for a in load_alarms()}
+    seen = set()
+    for a in body.alarms:
+        if a.id in seen:
+            errors.append(f"alarm {a.id}: duplicate id")
+        seen.add(a.id)
+        current[a.id] = a
+    alarms = list(current.values())
+    _commit(alarms, body.alarms, errors)
+    return {"ok": True, "alarms": len(alarms)}
+
+
+@router.post("/alarms/batch")
+async def batch_alarms(batch: AlarmBatch) -> dict:
+    """Apply creates, updates, deletes and enable toggles all at once, or none.
+
+    {"operations": [{"op": "create", "alarm": {...}},
+                    {"op": "update", "id": "...", "changes": {...}},
+                    {"op": "delete", "id": "..."},
+                    {"op": "enable" | "disable", "id": "..."}]}
+    """
+    _check_editable()
+    alarms = {a.id: a for a in load_alarms()}
+    errors = []
+    created = []
+    changed = set()
+    for i, op in enumerate(batch.operations):
+        if op.op == "create":
+            if op.alarm is None:
+                errors.append(f"operations[{i}]: create needs an alarm")
+                continue
+            alarm = op.alarm.model_copy(update={"id": Alarm().id})
+            alarms[alarm.id] = alarm
+            created.append(alarm.id)
+            changed.add(alarm.id)
+            continue
+        if op.id not in alarms:
+            errors.append(f"operations[{i}]: alarm {op.id!r} not found")
+            continue
+        if op.op == "delete":
+            del alarms[op.id]
+            continue
+        if op.op == "update":
+            if op.changes is None:
+                errors.append(f"operations[{i}]: update needs changes")
+                continue
+            data = alarms[op.id].model_dump()
+            data.update(op.changes.model_dump(exclude_none=True))
+            alarms[op.id] = Alarm.model_validate(data)
+        else:
+            alarms[op.id] = alarms[op.id].model_copy(update={"enabled": op.op == "enable"})
+        changed.add(op.id)
+    _commit(list(alarms.values()), [alarms[i] for i in changed if i in alarms], errors)
+    return {"ok": True, "created": created, "alarms": len(alarms)}
+
+
+def _builtin_stations() -> list[dict]:
     return [{"id": k, "name": v["name"]} for k, v in RADIO_STATIONS.items()]
+
+
+@router.get("/stations")
+async def list_stations(
+    request: Request,
+    response: Response,
+    q: str = "",
+    tag: str = "",
+    country: str = "",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=catalog.MAX_PAGE_SIZE),
+) -> list[dict]:
+    """Built-in stations, or a page of catalog search results.
+
+    Without search parameters the built-in stations are returned as before.
+    With q/tag/country, built-in name matches come first, followed by the
+    station catalog (if configured). The total is in X-Total-Count.
+    Both are fixed for the life of the process, hence a constant ETag.
+    """
+    etag = conditional.etag("stations")
+    if conditional.matches(request, etag):
+        return conditional.not_modified(etag)
+    if not (q or tag or country):
+        builtin_response = responses.snapshot("stations", 0, _builtin_stations)
+        conditional.set_etag(builtin_response, etag)
+        return builtin_response
+    conditional.set_etag(response, etag)
+    builtin = _builtin_stations()
+
+    matches = []
+    if not (tag or country):
+        words = q.casefold().split()
+        matches = [s for s in builtin if all(w in s["name"].casefold() for w in words)]
+
+    total = len(matches)
+    page = matches[offset:offset + limit]
+    index = await catalog.load_index_async()
+    if index is not None:
+        cat_offset = max(0, offset - len(matches))
+        cat_total, items = index.search(q, tag, country, cat_offset, limit - len(page))
+        total += cat_total
+        page += items
+    response.headers["X-Total-Count"] = str(total)
+    return page
+
+
+@router.get("/stations/resolved")
+async def resolved_stations() -> dict:
+    """Cached resolved stream URLs and probe latencies per station."""
+    return resolver.get_cache()
+
+
+@router.post("/stations/resolve")
+async def resolve_stations() -> dict:
+    """Force re-resolving and probing of all stations."""
+    updated = await resolver.refresh(force=True)
+    return {"ok": True, "updated": updated}
@@ -2,9 +2,13 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
+
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 
-from .. import bluetooth
+from .. import bluetooth, speakers
 
 router = APIRouter(prefix="/api/bluetooth")
 
@@ -15,6 +19,41 @@ async def scan_devices() -> list[dict]:
     return await bluetooth.scan(duration=8)
 
 
+@router.get("/scan/stream")
+async def scan_stream() -> StreamingResponse:
+    """Scan as Server-Sent Events: known devices first, then discoveries.
+
+    Concurrent clients share one discovery session, which stops when the
+    last client disconnects (or after bluetooth.SCAN_MAX_SECONDS).
+    """
+    async def events():
+        async with bluetooth.scan_session() as queue:
+            sent: dict[str, dict] = {}
+            loop = asyncio.get_running_loop()
+            pending = await loop.run_in_executor(None, bluetooth.list_devices)
+            while True:
+                for dev in pending:
+                    if sent.get(dev["mac"]) != dev:
+                        sent[dev["mac"]] = dev
+                        yield "event: device\ndata: " + json.dumps(dev) + "\n\n"
+                try:
+                    dev = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    pending = []
+                    yield ": keepalive\n\n"
+                    continue
+                if dev is None:
+                    yield "event: done\ndata: {}\n\n"
+                    return
+                pending = [dev]
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 @router.get("/devices")
 async def get_devices() -> list[dict]:
     """List known Bluetooth devices (no scan)."""
@@ -39,7 +78,11 @@ async def connect(body: dict) -> dict:
     mac = body.get("mac", "")
     if not mac:
         return {"ok": False, "error": "MAC address required"}
-    return await bluetooth.connect_device(mac)
+    result = await bluetooth.connect_device(mac)
+    if result.get("ok"):
+        # Remember it so the supervisor keeps it connected
+        speakers.set_preferred(mac, True)
+    return result
 
 
 @router.post("/disconnect")
@@ -48,6 +91,8 @@ async def disconnect(body: dict) -> dict:
     mac = body.get("mac", "")
     if not mac:
         return {"ok": False, "error": "MAC address required"}
+    # An explicit disconnect means the supervisor should not reconnect it
+    speakers.set_preferred(mac, False)
     return await bluetooth.disconnect_device(mac)
 
 
@@ -71,7 +116,11 @@ async def set_volume(body: dict) -> dict:
 @router.post("/setup-combined")
 async def setup_combined() -> dict:
     """Manually trigger combined sink setup."""
-    import asyncio
-    loop = asyncio.get_event_loop()
-    ok = await loop.run_in_executor(None, bluetooth.setup_combined_sink)
+    ok = await bluetooth.ensure_combined_sink()
     return {"ok": ok}
+
+
+@router.get("/supervisor")
+async def supervisor_status() -> dict:
+    """Preferred speakers, reconnect state and connect latency."""
+    return speakers.get_status()
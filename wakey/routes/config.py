@@ -2,45 +2,64 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
-from .. import audio, spotify
-from ..config import load_config, save_config
-from ..models import AudioConfig, RADIO_STATIONS
+from .. import audio, catalog, conditional, config, prebuffer, responses, spotify
+from ..config import load_alarms, load_config, save_config
+from ..models import AudioConfig
+from ..scheduler import sync_alarms
 
 router = APIRouter(prefix="/api/config")
 
 
 @router.get("")
-async def get_config() -> dict:
-    return load_config().model_dump()
+async def get_config(request: Request) -> dict:
+    revision = config.revision("config")
+    tag = conditional.etag("config", revision)
+    if conditional.matches(request, tag):
+        return conditional.not_modified(tag)
+    response = responses.snapshot("config", revision, lambda: load_config().model_dump(mode="json"))
+    conditional.set_etag(response, tag)
+    return response
 
 
 @router.put("")
 async def update_config(body: dict) -> dict:
     cfg = load_config()
-    if "hue" in body:
-        hue_data = cfg.hue.model_dump()
-        hue_data.update(body["hue"])
-        cfg.hue = cfg.hue.model_validate(hue_data)
+    for section in ("hue", "prebuffer", "speakers"):
+        if section in body:
+            current = getattr(cfg, section)
+            data = current.model_dump()
+            data.update(body[section])
+            setattr(cfg, section, current.model_validate(data))
     save_config(cfg)
+    if "prebuffer" in body:
+        # Pre-buffer jobs are scheduled alongside the alarms
+        sync_alarms(load_alarms())
     return cfg.model_dump()
 
 
+@router.get("/prebuffer/status")
+async def prebuffer_status() -> dict:
+    return prebuffer.get_status()
+
+
 @router.post("/test-radio")
 async def test_radio(body: dict) -> dict:
     """Start playing a radio station for testing."""
     station_id = body.get("station", "npo_radio_1")
     volume = body.get("volume", 50)
-    if station_id not in RADIO_STATIONS:
+    speakers = body.get("speakers", [])
+    station = await catalog.get_station_async(station_id)
+    if not station:
         return {"ok": False, "error": "Unknown station"}
     # Stop Spotify before playing radio (mutual exclusion)
     await spotify.stop()
-    cfg = AudioConfig(station=station_id, volume=volume, ramp_seconds=0)
+    cfg = AudioConfig(station=station_id, volume=volume, ramp_seconds=0, speakers=speakers)
     err = await audio.start_playback(cfg)
     if err:
         return {"ok": False, "error": err}
-    return {"ok": True, "station": RADIO_STATIONS[station_id]["name"]}
+    return {"ok": True, "station": station["name"]}
 
 
 @router.post("/test-radio/stop")
@@ -51,11 +70,11 @@ async def stop_test_radio() -> dict:
 
 @router.get("/test-radio/status")
 async def radio_status() -> dict:
-    return {"playing": audio.is_playing()}
+    return {"playing": audio.is_playing(), "zones": audio.get_zones()}
 
 
 @router.post("/test-radio/volume")
 async def set_radio_volume(body: dict) -> dict:
     volume = body.get("volume", 50)
-    audio._set_volume(volume)
+    audio.set_volume(volume, body.get("zone", audio.DEFAULT_ZONE))
     return {"ok": True}
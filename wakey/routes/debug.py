@@ -0,0 +1,84 @@
+"""Diagnostics routes for finding performance problems in production."""
+
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from .. import profiler, startup, watchdog
+
+router = APIRouter(prefix="/api/debug")
+
+
+def require_admin(authorization: str = Header(""), x_wakey_token: str = Header("")) -> None:
+    """Accept the admin token as a Bearer token or in X-Wakey-Token."""
+    if not profiler.ADMIN_TOKEN:
+        raise HTTPException(403, "Profiling is disabled (set WAKEY_ADMIN_TOKEN)")
+    token = x_wakey_token or authorization.removeprefix("Bearer ").strip()
+    if not profiler.authorized(token):
+        raise HTTPException(401, "Invalid admin token")
+
+
+def _render(session: profiler.Session, fmt: str):
+    if fmt == "collapsed":
+        return PlainTextResponse(session.collapsed())
+    return session.report()
+
+
+@router.get("/stalls")
+async def get_stalls() -> dict:
+    """Event-loop stalls caught by the watchdog, with the blocking stack."""
+    return watchdog.get_stats()
+
+
+@router.get("/startup")
+async def get_startup() -> dict:
+    """How long the last start took, by phase."""
+    return startup.report()
+
+
+@router.get("/profile", dependencies=[Depends(require_admin)])
+async def profile_status() -> dict:
+    return profiler.get_status()
+
+
+@router.post("/profile", dependencies=[Depends(require_admin)])
+async def start_profile(request: Request, body: dict, format: str = "json"):
+    """Start a sampling profile.
+
+    {"seconds": 10}                      profile now, return the report when done
+    {"requests": 5, "timeout": 300}      profile until 5 more requests completed
+    {"alarm": true, "seconds": 60}       profile the first minute of the next alarm
+    Reports are kept and served by GET /api/debug/profile/{id};
+    ?format=collapsed returns flamegraph-ready collapsed stacks.
+    """
+    seconds = float(body.get("seconds", 10))
+    if not 0 < seconds <= profiler.MAX_SECONDS:
+        raise HTTPException(400, f"seconds must be between 0 and {profiler.MAX_SECONDS}")
+    if body.get("alarm"):
+        session = profiler.profile_next_alarm(seconds, float(body.get("timeout", 86400)))
+        return {"ok": True, "id": session.id, "state": session.state}
+    if body.get("requests"):
+        session = profiler.profile_requests(int(body["requests"]), float(body.get("timeout", 300)))
+        # This request finishes after the session starts; it is not one of the N
+        request.state.profile_session = session.id
+        return {"ok": True, "id": session.id, "state": session.state}
+    session = await profiler.profile_for(seconds)
+    return _render(session, format)
+
+
+@router.get("/profile/{session_id}", dependencies=[Depends(require_admin)])
+async def get_profile(session_id: str, format: str = "json"):
+    session = profiler.get_session(session_id)
+    if not session:
+        raise HTTPException(404, "Profile not found")
+    return _render(session, format)
+
+
+@router.delete("/profile/{session_id}", dependencies=[Depends(require_admin)])
+async def stop_profile(session_id: str) -> dict:
+    session = profiler.get_session(session_id)
+    if not session:
+        raise HTTPException(404, "Profile not found")
+    profiler.finish(session)
+    return {"ok": True, "id": session.id, "samples": session.samples}
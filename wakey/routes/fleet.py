@@ -0,0 +1,68 @@
+"""Fleet routes: clock pings, alarm set pushes and synchronized triggers."""
+
+from __future__ import annotations
+
+import time
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from .. import fleet
+from ..config import load_alarms, save_alarms
+from ..models import Alarm
+from ..scheduler import sync_alarms
+
+router = APIRouter(prefix="/api/fleet")
+
+
+def require_fleet(x_wakey_fleet_token: str = Header("")) -> None:
+    if not fleet.TOKEN:
+        raise HTTPException(403, "Fleet mode is disabled (set WAKEY_FLEET_TOKEN)")
+    if not fleet.authorized(x_wakey_fleet_token):
+        raise HTTPException(401, "Invalid fleet token")
+
+
+def require_follower() -> None:
+    if fleet.ROLE != "follower":
+        raise HTTPException(409, "This node is not a fleet follower")
+
+
+@router.get("/status")
+async def fleet_status() -> dict:
+    """Role, per-node clock offsets and sync state, last synchronized start."""
+    return fleet.get_status()
+
+
+@router.get("/clock", dependencies=[Depends(require_fleet)])
+async def clock() -> dict:
+    """Our wall clock, for the coordinator's offset estimate."""
+    digest = fleet.alarms_digest([a.model_dump(mode="json") for a in load_alarms()])
+    return {"time": time.time(), "alarms_digest": digest}
+
+
+@router.put("/alarms", dependencies=[Depends(require_fleet), Depends(require_follower)])
+async def replace_alarms(body: dict) -> dict:
+    """Replace our alarm set with the coordinator's."""
+    alarms = [Alarm.model_validate(a) for a in body.get("alarms", [])]
+    save_alarms(alarms)
+    sync_alarms(alarms)
+    return {"ok": True, "alarms_digest": fleet.alarms_digest([a.model_dump(mode="json") for a in alarms])}
+
+
+@router.post("/trigger", dependencies=[Depends(require_fleet), Depends(require_follower)])
+async def trigger(body: dict) -> dict:
+    """Start an alarm at an absolute time of our clock: {"alarm": {...}, "at": epoch}."""
+    alarm = Alarm.model_validate(body["alarm"])
+    fleet.receive_trigger(alarm, float(body["at"]))
+    return {"ok": True}
+
+
+@router.post("/test/{alarm_id}", dependencies=[Depends(require_fleet)])
+async def test_trigger(alarm_id: str) -> dict:
+    """Coordinator only: fire an alarm on every node now, as the scheduler would."""
+    if fleet.ROLE != "coordinator":
+        raise HTTPException(409, "This node is not the fleet coordinator")
+    for a in load_alarms():
+        if a.id == alarm_id:
+            await fleet.fire(a, None)
+            return {"ok": True, **fleet.get_status()}
+    raise HTTPException(404, "Alarm not found")
@@ -2,18 +2,31 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
-from .. import hue
+from .. import conditional, config, hue, responses
 from ..config import load_config, save_config
 
 router = APIRouter(prefix="/api/hue")
 
 
 @router.get("/rooms")
-async def get_rooms(state: bool = False) -> list[dict]:
-    cfg = load_config().hue
-    return await hue.get_rooms(cfg, include_state=state)
+async def get_rooms(request: Request, state: bool = False) -> list[dict]:
+    if state:
+        return await hue.get_rooms(load_config().hue, include_state=True)
+    # The room snapshot belongs to the bridge settings it was fetched with
+    source = config.revision("config")
+    revision = hue.rooms_revision(source)
+    if revision is not None:
+        tag = conditional.etag("hue-rooms", revision)
+        if conditional.matches(request, tag):
+            return conditional.not_modified(tag)
+    rooms, revision = await hue.room_snapshot(load_config().hue, source)
+    if revision is None:
+        return rooms
+    response = responses.snapshot("hue-rooms", revision, lambda: rooms)
+    conditional.set_etag(response, conditional.etag("hue-rooms", revision))
+    return response
 
 
 @router.get("/status")
@@ -2,9 +2,9 @@
 
 from __future__ import annotations
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
-from .. import spotify
+from .. import conditional, config, responses, spotify
 from ..config import load_spotify_presets, save_spotify_presets
 
 router = APIRouter(prefix="/api/spotify")
@@ -123,9 +123,15 @@ async def repeat(body: dict) -> dict:
 # ── Saved presets ──
 
 @router.get("/presets")
-async def get_presets() -> list[dict]:
+async def get_presets(request: Request) -> list[dict]:
     """Get saved Spotify playlists/albums."""
-    return load_spotify_presets()
+    revision = config.revision("spotify_presets")
+    tag = conditional.etag("spotify_presets", revision)
+    if conditional.matches(request, tag):
+        return conditional.not_modified(tag)
+    response = responses.snapshot("spotify_presets", revision, load_spotify_presets)
+    conditional.set_etag(response, tag)
+    return response
 
 
 @router.post("/presets")
@@ -5,55 +5,92 @@ from __future__ import annotations
 from fastapi import APIRouter, HTTPException
 
 from .. import alarm as alarm_manager
-from ..config import load_alarms
+from .. import latency, leader, shared
 from ..models import AlarmState
 from ..scheduler import get_next_fire_time
 
 router = APIRouter(prefix="/api")
 
 
-@router.get("/status")
-async def get_status() -> dict:
+def _alarm_status(a: alarm_manager.ActiveAlarm) -> dict:
+    return {
+        "id": a.alarm.id,
+        "state": a.state.state.value,
+        "alarm": a.alarm.model_dump(),
+        "sunrise_start": a.state.sunrise_start,
+        "audio_start": a.state.audio_start,
+        "timeline": a.timeline.status(),
+    }
+
+
+def build_status() -> dict:
+    """Summary of the most urgent alarm, plus every active alarm in "alarms"."""
     st = alarm_manager.get_state()
-    active_alarm = None
-    if st.active_alarm_id:
-        for a in load_alarms():
-            if a.id == st.active_alarm_id:
-                active_alarm = a.model_dump()
-                break
+    active = alarm_manager.get_alarm(st.active_alarm_id) if st.active_alarm_id else None
 
     return {
         "state": st.state.value,
         "active_alarm_id": st.active_alarm_id,
-        "active_alarm": active_alarm,
+        "active_alarm": active.alarm.model_dump() if active else None,
         "sunrise_start": st.sunrise_start,
         "audio_start": st.audio_start,
+        "alarms": [_alarm_status(a) for a in alarm_manager.get_active()],
         "next_fire_time": get_next_fire_time(),
     }
 
 
+@router.get("/status")
+async def get_status() -> dict:
+    if not leader.is_leader():
+        # Followers serve what the leader last published (at most a second old)
+        status = shared.get("status")
+        if status is not None:
+            return status
+    return build_status()
+
+
 @router.post("/dismiss")
-async def dismiss_alarm() -> dict:
-    st = alarm_manager.get_state()
-    if st.state == AlarmState.IDLE:
+async def dismiss_all() -> dict:
+    """Dismiss every active alarm."""
+    if not alarm_manager.get_active():
         raise HTTPException(400, "No active alarm")
     await alarm_manager.dismiss()
     return {"ok": True}
 
 
+@router.post("/dismiss/{alarm_id}")
+async def dismiss_alarm(alarm_id: str) -> dict:
+    if not alarm_manager.get_alarm(alarm_id):
+        raise HTTPException(404, "Alarm not active")
+    await alarm_manager.dismiss(alarm_id)
+    return {"ok": True}
+
+
 @router.post("/snooze")
-async def snooze_alarm() -> dict:
-    st = alarm_manager.get_state()
-    if st.state not in (AlarmState.ACTIVE, AlarmState.SUNRISE):
+async def snooze_all() -> dict:
+    """Snooze every ringing (or sunrise) alarm."""
+    ringing = [
+        a.alarm.id for a in alarm_manager.get_active()
+        if a.state.state in (AlarmState.ACTIVE, AlarmState.SUNRISE)
+    ]
+    if not ringing:
         raise HTTPException(400, "No active alarm to snooze")
+    minutes = [await alarm_manager.snooze(aid) for aid in ringing]
+    return {"ok": True, "snooze_minutes": min(minutes), "alarm_ids": ringing}
+
+
+@router.post("/snooze/{alarm_id}")
+async def snooze_alarm(alarm_id: str) -> dict:
+    a = alarm_manager.get_alarm(alarm_id)
+    if not a:
+        raise HTTPException(404, "Alarm not active")
+    if a.state.state not in (AlarmState.ACTIVE, AlarmState.SUNRISE):
+        raise HTTPException(400, "Alarm is not ringing")
+    minutes = await alarm_manager.snooze(alarm_id)
+    return {"ok": True, "snooze_minutes": minutes}
 
-    alarm = None
-    for a in load_alarms():
-        if a.id == st.active_alarm_id:
-            alarm = a
-            break
-    if not alarm:
-        raise HTTPException(404, "Active alarm not found")
 
-    await alarm_manager.snooze(alarm)
-    return {"ok": True, "snooze_minutes": alarm.snooze_minutes}
+@router.get("/latency")
+async def get_latency() -> dict:
+    """Wake-path latency histograms per stage and the most recent fires."""
+    return latency.get_stats()
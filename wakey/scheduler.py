@@ -3,13 +3,24 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
-
+from datetime import datetime, timedelta
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_EXECUTED,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+    JobExecutionEvent,
+    JobSubmissionEvent,
+)
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
 from . import alarm as alarm_manager
-from .models import Alarm
+from . import catalog, fleet, latency, metrics, prebuffer, resolver
+from .config import load_config
+from .models import Alarm, PrebufferConfig
 
 logger = logging.getLogger(__name__)
 
@@ -18,14 +29,44 @@ scheduler = AsyncIOScheduler()
 # Map day index (0=Mon) to cron day_of_week
 _DAY_MAP = {0: "mon", 1: "tue", 2: "wed", 3: "thu", 4: "fri", 5: "sat", 6: "sun"}
 
+# Jobs owned by sync_alarms; other jobs (e.g. station resolving) are left alone
+_ALARM_JOB_PREFIXES = ("alarm_", "prebuffer_")
+
 # Map job_id -> offset_minutes so we can recover the real alarm time
 _job_offsets: dict[str, int] = {}
 
+# job_id -> when the job was due, for wake latency measurement
+_scheduled_at: dict[str, datetime] = {}
+
+MISFIRE_GRACE_SECONDS = 300
+
+
+def _on_submitted(event: JobSubmissionEvent) -> None:
+    if event.job_id in _job_offsets and event.scheduled_run_times:
+        _scheduled_at[event.job_id] = event.scheduled_run_times[-1]
+
+
+def _on_job_event(event: JobExecutionEvent) -> None:
+    outcome = {EVENT_JOB_EXECUTED: "ok", EVENT_JOB_ERROR: "error"}.get(event.code, "missed")
+    # alarm_<id> -> alarm; resolve_stations stays as is
+    job = event.job_id.split("_", 1)[0] if event.job_id.startswith(_ALARM_JOB_PREFIXES) else event.job_id
+    metrics.scheduler_jobs.inc(job, outcome)
+
 
 def start() -> None:
     if not scheduler.running:
+        scheduler.add_listener(_on_submitted, EVENT_JOB_SUBMITTED)
+        scheduler.add_listener(_on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
         scheduler.start()
         logger.info("Scheduler started")
+    # Keep resolved station URLs warm; first run shortly after startup
+    scheduler.add_job(
+        resolver.refresh,
+        IntervalTrigger(minutes=resolver.REFRESH_INTERVAL_MINUTES),
+        id="resolve_stations",
+        replace_existing=True,
+        next_run_time=datetime.now() + timedelta(seconds=30),
+    )
 
 
 def shutdown() -> None:
@@ -35,16 +76,36 @@ def shutdown() -> None:
 
 
 def sync_alarms(alarms: list[Alarm]) -> None:
-    """Remove all existing jobs and re-add enabled alarms."""
-    scheduler.remove_all_jobs()
+    """Remove all existing alarm jobs and re-add enabled alarms."""
+    for job in scheduler.get_jobs():
+        if job.id.startswith(_ALARM_JOB_PREFIXES):
+            job.remove()
     _job_offsets.clear()
+    prebuffer_cfg = load_config().prebuffer
 
     for a in alarms:
         if not a.enabled or not a.days:
             continue
         _add_alarm_job(a)
+        if prebuffer_cfg.enabled:
+            _add_prebuffer_job(a, prebuffer_cfg)
+
+    logger.info("Synced %d alarm jobs", len(_job_offsets))
+    # Catalog stations must be looked up when the alarm fires; load them now
+    catalog.preload(a.audio.station for a in alarms if a.enabled and a.audio.enabled)
+    fleet.alarms_changed()
+
+
+def _before(a: Alarm, minutes: int) -> tuple[int, int, str]:
+    """(hour, minute, cron day_of_week) `minutes` before the alarm time.
 
-    logger.info("Synced %d alarm jobs", len(scheduler.get_jobs()))
+    Days move back one when that crosses midnight: a Monday 00:10 alarm with
+    a 20 minute lead starts on Sunday.
+    """
+    hour, minute = map(int, a.time.split(":"))
+    day_shift, start = divmod(hour * 60 + minute - minutes, 24 * 60)
+    days = sorted({(d + day_shift) % 7 for d in a.days})
+    return start // 60, start % 60, ",".join(_DAY_MAP[d] for d in days)
 
 
 def _add_alarm_job(a: Alarm) -> None:
@@ -53,13 +114,7 @@ def _add_alarm_job(a: Alarm) -> None:
     offset = a.hue.offset_minutes if a.hue.enabled else 0
 
     # Subtract offset to get trigger time
-    trigger_dt = datetime.now().replace(hour=hour, minute=minute, second=0)
-    from datetime import timedelta
-    trigger_dt -= timedelta(minutes=offset)
-    trigger_hour = trigger_dt.hour
-    trigger_minute = trigger_dt.minute
-
-    days_of_week = ",".join(_DAY_MAP[d] for d in sorted(a.days))
+    trigger_hour, trigger_minute, days_of_week = _before(a, offset)
 
     trigger = CronTrigger(
         day_of_week=days_of_week,
@@ -68,31 +123,75 @@ def _add_alarm_job(a: Alarm) -> None:
         second=0,
     )
 
+    job_id = f"alarm_{a.id}"
+
     async def fire():
+        scheduled = _scheduled_at.pop(job_id, None)
+        if fleet.ROLE:
+            await fleet.fire(a, scheduled)
+            return
+        latency.begin(a.id, scheduled)
         await alarm_manager.trigger_alarm(a)
 
-    job_id = f"alarm_{a.id}"
-    scheduler.add_job(fire, trigger, id=job_id, replace_existing=True)
+    # A busy loop must not make APScheduler skip an alarm (its default grace is 1 s)
+    scheduler.add_job(fire, trigger, id=job_id, replace_existing=True, coalesce=True,
+                      misfire_grace_time=MISFIRE_GRACE_SECONDS)
     _job_offsets[job_id] = offset
     logger.info("Scheduled alarm %s at %02d:%02d (trigger %02d:%02d) on %s",
                 a.id, hour, minute, trigger_hour, trigger_minute, days_of_week)
 
 
+def _add_prebuffer_job(a: Alarm, cfg: PrebufferConfig) -> None:
+    """Start recording the alarm's radio station lead_minutes before audio starts."""
+    if not a.audio.enabled or a.audio.source != "radio":
+        return
+
+    start_hour, start_minute, days_of_week = _before(a, cfg.lead_minutes)
+    trigger = CronTrigger(day_of_week=days_of_week, hour=start_hour, minute=start_minute, second=0)
+    # Keep recording through the lead time, snoozes and auto-stop
+    max_seconds = (cfg.lead_minutes + a.snooze_minutes + a.auto_stop_minutes) * 60
+
+    async def fire():
+        if await catalog.get_station_async(a.audio.station) is None:
+            return
+        await prebuffer.start_recording(a.audio.station, resolver.get_url(a.audio.station),
+                                        cfg.max_mb, max_seconds, a.id)
+
+    scheduler.add_job(fire, trigger, id=f"prebuffer_{a.id}", replace_existing=True)
+
+
+metrics.Gauge("wakey_scheduler_jobs", "Scheduled jobs.", lambda: len(scheduler.get_jobs()))
+
+
+def missed_fires(grace_seconds: float) -> list[tuple[str, datetime]]:
+    """(alarm id, due time) of alarm jobs that were due in the last `grace_seconds`.
+
+    Jobs are rebuilt at startup, so these are fires lost to downtime.
+    """
+    missed = []
+    for job in scheduler.get_jobs():
+        if not job.id.startswith("alarm_"):
+            continue
+        now = datetime.now(job.trigger.timezone)
+        due = job.trigger.get_next_fire_time(None, now - timedelta(seconds=grace_seconds))
+        if due is not None and due <= now:
+            missed.append((job.id.removeprefix("alarm_"), due))
+    return missed
+
+
 def get_next_fire_time() -> str | None:
     """Return the next alarm audio start time as ISO string, or None.
 
     Jobs fire at alarm_time - hue_offset. We add the offset back
     so the home screen shows when music actually starts.
     """
-    from datetime import timedelta
-
     jobs = scheduler.get_jobs()
     if not jobs:
         return None
 
     earliest = None
     for job in jobs:
-        if not job.next_run_time:
+        if not job.next_run_time or job.id not in _job_offsets:
             continue
         offset = _job_offsets.get(job.id, 0)
         audio_time = job.next_run_time + timedelta(minutes=offset)
@@ -0,0 +1,136 @@
+"""Runtime state shared between worker processes (multi-worker mode).
+
+With WAKEY_SHARED_STATE=1, several uvicorn workers can serve the API. One
+of them is elected leader (see leader.py) and owns the scheduler and the
+hardware; the others read what it publishes here. The store is a small
+SQLite database next to the data file (WAL mode, so reads never wait on
+the leader's writes) holding:
+
+    state      key -> JSON value, e.g. the leader's /api/status
+    revisions  store -> revision of the alarms, config and preset stores,
+               so every worker's ETags and snapshots follow every save
+
+Without WAKEY_SHARED_STATE nothing here is used and the app runs as a
+single process, as before.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("WAKEY_SHARED_STATE", "").lower() in ("1", "true", "yes")
+_DATA_FILE = Path(os.environ.get("WAKEY_DATA", Path(__file__).parent / "alarms.json"))
+DB_FILE = Path(os.environ.get("WAKEY_RUNTIME_DB", _DATA_FILE.with_suffix(".runtime.db")))
+PUBLISH_SECONDS = 1.0
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS revisions "
+                     "(store TEXT PRIMARY KEY, revision INTEGER NOT NULL)")
+        _conn = conn
+    return _conn
+
+
+def get(key: str) -> Any | None:
+    with _lock:
+        row = _db().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def _write(key: str, data: str) -> None:
+    with _lock:
+        _db().execute("INSERT INTO state (key, value) VALUES (?, ?) "
+                      "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, data))
+
+
+def put(key: str, value: Any) -> None:
+    _write(key, json.dumps(value))
+
+
+def generation() -> str:
+    """Random id of this database, created by whichever worker gets there first."""
+    with _lock:
+        db = _db()
+        db.execute("INSERT OR IGNORE INTO state (key, value) VALUES ('generation', ?)",
+                   (json.dumps(uuid.uuid4().hex[:8]),))
+        row = db.execute("SELECT value FROM state WHERE key = 'generation'").fetchone()
+    return json.loads(row[0])
+
+
+def revision(store: str) -> int:
+    with _lock:
+        row = _db().execute("SELECT revision FROM revisions WHERE store = ?", (store,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump(store: str) -> None:
+    with _lock:
+        _db().execute("INSERT INTO revisions (store, revision) VALUES (?, 1) "
+                      "ON CONFLICT(store) DO UPDATE SET revision = revision + 1", (store,))
+
+
+# ── Publishing (leader only) ──
+
+_publishers: dict[str, Callable[[], Any]] = {}
+_published: dict[str, str] = {}
+_publish_task: asyncio.Task | None = None
+
+
+def publish(key: str, fn: Callable[[], Any]) -> None:
+    """Have the leader keep `key` up to date with the value of `fn()`."""
+    _publishers[key] = fn
+
+
+def publish_now() -> None:
+    """Write every published value that changed since the last write."""
+    for key, fn in _publishers.items():
+        try:
+            data = json.dumps(fn())
+        except Exception:
+            logger.exception("Failed to build shared %s", key)
+            continue
+        if _published.get(key) != data:
+            _write(key, data)
+            _published[key] = data
+
+
+async def _publish_loop() -> None:
+    while True:
+        publish_now()
+        await asyncio.sleep(PUBLISH_SECONDS)
+
+
+def start_publishing() -> None:
+    global _publish_task
+    if _publish_task is None or _publish_task.done():
+        _publish_task = asyncio.create_task(_publish_loop())
+
+
+async def stop_publishing() -> None:
+    global _publish_task
+    if _publish_task is not None:
+        _publish_task.cancel()
+        try:
+            await _publish_task
+        except asyncio.CancelledError:
+            pass
+        _publish_task = None
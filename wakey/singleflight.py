@@ -0,0 +1,66 @@
+"""Keyed single-flight execution and per-resource locks.
+
+Identical concurrent operations (same key) share one execution and its
+result or exception. Conflicting operations on the same resource (e.g.
+connect/disconnect of one MAC, or rebuilding the combined sink) are
+serialized with a named asyncio.Lock, which exists only while someone
+holds or waits for it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+_inflight: dict[str, asyncio.Task] = {}
+# resource -> [lock, holders + waiters]
+_locks: dict[str, list] = {}
+
+
+async def run(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    """Run `fn()` unless a call with the same key is in flight; then join it."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fn())
+        _inflight[key] = task
+
+        def _done(t: asyncio.Task) -> None:
+            if _inflight.get(key) is t:
+                del _inflight[key]
+
+        task.add_done_callback(_done)
+    # A cancelled caller (e.g. a disconnected client) must not cancel the shared run
+    return await asyncio.shield(task)
+
+
+def shared(key_fn: Callable[..., str]):
+    """Decorator: single-flight an async function, keyed by key_fn(*args, **kwargs)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await run(key_fn(*args, **kwargs), lambda: fn(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+@asynccontextmanager
+async def lock(resource: str) -> AsyncIterator[None]:
+    """Hold the lock serializing operations on `resource`."""
+    entry = _locks.get(resource)
+    if entry is None:
+        entry = _locks[resource] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        # Nobody holds or waits for it: don't keep one lock per MAC or room forever
+        if entry[1] == 0 and _locks.get(resource) is entry:
+            del _locks[resource]
+
+
+def in_flight() -> list[str]:
+    return sorted(_inflight)
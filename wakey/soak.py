@@ -0,0 +1,276 @@
+"""Soak test: drive the app for hours against local stand-ins and watch for leaks.
+
+    python -m wakey.soak --duration 7200 --budget-mb 8
+
+The app runs in-process (lifespan included) and is driven through its HTTP
+API: alarm create/edit/delete (each one re-syncs the scheduler), alarm
+triggers with sunrise, snooze and dismiss, radio test playback, and status,
+metrics and Bluetooth polls. Hue and go-librespot are served by a local
+HTTP stand-in; bluetoothctl, busctl, pactl, pacmd, pacat and mpv are
+replaced by stub scripts on PATH, and the data file lives in a temp dir.
+Nothing on the host is touched.
+
+After a warm-up, a baseline is taken; every --interval seconds the
+tracemalloc snapshot is diffed against it together with the open file
+descriptors, child processes, asyncio tasks and scheduler jobs. The run
+fails (exit status 1) as soon as any growth exceeds its budget.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+logger = logging.getLogger("wakey.soak")
+
+_STUBS = {
+    "mpv": "exec sleep 3600",
+    "bluetoothctl": "exec cat >/dev/null",
+    "busctl": "exit 1",
+    "pactl": 'if [ "$1" = subscribe ]; then exec sleep 100000; fi',
+    "pacmd": "exec cat >/dev/null",
+    "pacat": "exec cat >/dev/null",
+}
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    """Hue bridge (/api/...) and go-librespot (/player, /status) stand-in."""
+
+    def _reply(self, body) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.endswith("/groups"):
+            self._reply({"1": {"name": "Bedroom", "type": "Room", "lights": ["1"],
+                               "action": {"on": False, "bri": 1, "ct": 400}}})
+        elif self.path.endswith("/scenes"):
+            self._reply({"s1": {"name": "Bright", "group": "1", "type": "GroupScene"}})
+        elif self.path == "/status":
+            self._reply({"track": {"name": "Soak"}, "paused": False, "stopped": False})
+        else:
+            self._reply({})
+
+    def do_PUT(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply([{"success": {}}])
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def _write_stubs(bin_dir: Path) -> None:
+    for name, body in _STUBS.items():
+        path = bin_dir / name
+        path.write_text("#!/bin/sh\n" + body + "\n")
+        path.chmod(0o755)
+
+
+def _fd_count() -> int:
+    for d in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(d):
+            return len(os.listdir(d))
+    return -1
+
+
+def _child_count() -> int:
+    """Live (non-zombie) child processes, from /proc; -1 where unavailable."""
+    if not os.path.isdir("/proc"):
+        return -1
+    me, count = str(os.getpid()), 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            stat = Path(f"/proc/{pid}/stat").read_text()
+        except OSError:
+            continue
+        # pid (comm) state ppid ...
+        fields = stat.rsplit(")", 1)[1].split()
+        if fields[1] == me and fields[0] != "Z":
+            count += 1
+    return count
+
+
+class _Probe:
+    def __init__(self, scheduler_module):
+        self.scheduler = scheduler_module
+
+    def sample(self) -> dict:
+        gc.collect()
+        return {
+            "snapshot": tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]),
+            "traced": tracemalloc.get_traced_memory()[0],
+            "fds": _fd_count(),
+            "children": _child_count(),
+            "tasks": len(asyncio.all_tasks()),
+            "jobs": len(self.scheduler.scheduler.get_jobs()),
+        }
+
+
+def _report(base: dict, now: dict, top: int = 10) -> tuple[dict, list[str]]:
+    growth = {
+        "memory_mb": (now["traced"] - base["traced"]) / 1e6,
+        "fds": now["fds"] - base["fds"],
+        "children": now["children"] - base["children"],
+        "tasks": now["tasks"] - base["tasks"],
+        "jobs": now["jobs"] - base["jobs"],
+    }
+    stats = now["snapshot"].compare_to(base["snapshot"], "lineno")
+    lines = [str(s) for s in stats[:top] if s.size_diff > 0]
+    return growth, lines
+
+
+async def _workload(client, rng: random.Random, alarm_manager, models) -> None:
+    """One round of typical (and some unusual) use."""
+    r = await client.post("/api/alarms", json={
+        "time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+        "days": rng.sample(range(7), rng.randint(1, 7)),
+        "hue": {"enabled": True, "rooms": [{"id": "1", "name": "Bedroom"}],
+                "offset_minutes": rng.choice([0, 1, 20])},
+        "audio": {"source": rng.choice(["radio", "spotify"]),
+                  "spotify_uri": "spotify:playlist:soak", "ramp_seconds": 3},
+    })
+    alarm = r.json()
+    for _ in range(3):
+        await client.put(f"/api/alarms/{alarm['id']}", json={"label": str(rng.random())})
+    await client.get("/api/alarms")
+
+    # Trigger, maybe snooze, then dismiss
+    await alarm_manager.trigger_alarm(models.Alarm.model_validate(alarm))
+    await asyncio.sleep(0.05)
+    if rng.random() < 0.5:
+        await client.post(f"/api/snooze/{alarm['id']}")
+        await asyncio.sleep(0.01)
+    await client.post(f"/api/dismiss/{alarm['id']}")
+
+    await client.post("/api/config/test-radio", json={"station": "npo_radio_1", "volume": 30})
+    await client.post("/api/config/test-radio/volume", json={"volume": 40})
+    await client.post("/api/config/test-radio/stop")
+
+    for path in ("/api/status", "/api/bluetooth/status", "/api/hue/rooms",
+                 "/api/spotify/status", "/metrics", "/api/latency"):
+        await client.get(path)
+    await client.delete(f"/api/alarms/{alarm['id']}")
+
+
+async def run(args: argparse.Namespace) -> int:
+    import httpx
+
+    from . import alarm as alarm_manager
+    from . import models, scheduler, spotify
+    from .main import app
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stand_in = f"127.0.0.1:{server.server_address[1]}"
+    spotify.API_BASE = "http://" + stand_in
+
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app)
+    failed = False
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://soak") as client:
+        # No real network: station URL resolving is not part of the soak
+        if scheduler.scheduler.get_job("resolve_stations"):
+            scheduler.scheduler.remove_job("resolve_stations")
+        await client.put("/api/config", json={"hue": {"bridge_ip": stand_in, "username": "soak"}})
+
+        probe = _Probe(scheduler)
+        start = time.monotonic()
+        rounds = 0
+        while time.monotonic() - start < args.warmup:
+            await _workload(client, rng, alarm_manager, models)
+            rounds += 1
+        base = probe.sample()
+        logger.info("Baseline after %d warm-up rounds: %.1f MB traced, %d fds, %d children",
+                    rounds, base["traced"] / 1e6, base["fds"], base["children"])
+
+        next_check = time.monotonic() + args.interval
+        while time.monotonic() - start < args.duration:
+            await _workload(client, rng, alarm_manager, models)
+            rounds += 1
+            if time.monotonic() < next_check:
+                continue
+            next_check = time.monotonic() + args.interval
+            growth, top = _report(base, probe.sample())
+            logger.info("Round %d: %s", rounds,
+                        ", ".join(f"{k} {v:+.2f}" if k == "memory_mb" else f"{k} {v:+d}"
+                                  for k, v in growth.items()))
+            over = [k for k, budget in (("memory_mb", args.budget_mb), ("fds", args.fd_budget),
+                                        ("children", args.child_budget), ("tasks", args.task_budget),
+                                        ("jobs", 0))
+                    if growth[k] > budget]
+            if over or args.verbose:
+                logger.info("Largest allocation growth:\n%s", "\n".join(top))
+            if over:
+                logger.error("Budget exceeded (%s) after %d rounds; largest allocations:\n%s",
+                             ", ".join(over), rounds, "\n".join(top))
+                failed = True
+                break
+        await client.post("/api/dismiss")
+    server.shutdown()
+    if not failed:
+        logger.info("Soak passed: %d rounds in %.0f s", rounds, time.monotonic() - start)
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=3600, help="seconds to run (default 3600)")
+    parser.add_argument("--warmup", type=float, default=60, help="seconds before the baseline")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between checks")
+    parser.add_argument("--budget-mb", type=float, default=5, help="allowed traced memory growth")
+    parser.add_argument("--fd-budget", type=int, default=10)
+    parser.add_argument("--child-budget", type=int, default=2)
+    parser.add_argument("--task-budget", type=int, default=20)
+    parser.add_argument("--frames", type=int, default=1,
+                        help="traceback depth kept by tracemalloc (deeper is much slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log top allocations at every check")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Everything below runs against throwaway state and stubs
+    work = Path(tempfile.mkdtemp(prefix="wakey-soak-"))
+    (work / "bin").mkdir()
+    _write_stubs(work / "bin")
+    os.environ["PATH"] = str(work / "bin") + os.pathsep + os.environ.get("PATH", "")
+    os.environ["WAKEY_DATA"] = str(work / "alarms.json")
+    os.environ["WAKEY_STATION_CACHE"] = str(work / "station_cache.json")
+    os.environ["WAKEY_PREBUFFER_DIR"] = str(work / "prebuffer")
+    if "wakey.config" in sys.modules:
+        sys.exit("wakey.soak must be started as its own process (python -m wakey.soak)")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    os.environ.setdefault("WAKEY_STALL_THRESHOLD_MS", "5000")  # snapshots block the loop
+    tracemalloc.start(args.frames)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Speaker supervisor: keep preferred Bluetooth speakers connected and awake.
+
+Preferred speakers (config.speakers.preferred) are reconnected with
+exponential backoff whenever they drop. Ahead of the next alarm, and during
+a sunrise, the backoff is capped low and a silent PulseAudio stream keeps
+the speakers from going to sleep, so the alarm never starts on the Pi's
+internal output. The combined sink is only rebuilt when the set of
+Bluetooth sinks actually changes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+from . import alarm as alarm_manager
+from . import bluetooth, scheduler
+from .config import load_config, save_config
+from .models import AlarmState
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL_SECONDS = 15
+MIN_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 600
+ALARM_MAX_BACKOFF_SECONDS = 30
+
+_task: asyncio.Task | None = None
+_devices: dict[str, dict] = {}  # mac -> reconnect state and stats
+_last_sinks: frozenset[str] | None = None
+_keepalive: subprocess.Popen | None = None
+
+
+def _device_state(mac: str) -> dict:
+    if mac not in _devices:
+        _devices[mac] = {
+            "connected": False,
+            "attempts": 0,
+            "failures": 0,
+            "backoff": 0,
+            "next_attempt": 0.0,
+            "last_connect_ms": None,
+            "last_error": None,
+        }
+    return _devices[mac]
+
+
+def _alarm_soon(minutes: int) -> bool:
+    """True during a sunrise or within `minutes` before the next audio start."""
+    if any(a.state.state == AlarmState.SUNRISE for a in alarm_manager.get_active()):
+        return True
+    next_fire = scheduler.get_next_fire_time()
+    if not next_fire:
+        return False
+    fire = datetime.fromisoformat(next_fire)
+    now = datetime.now(timezone.utc) if fire.tzinfo else datetime.now()
+    return now <= fire <= now + timedelta(minutes=minutes)
+
+
+async def _reconnect(mac: str, st: dict, max_backoff: int) -> None:
+    st["attempts"] += 1
+    start = time.monotonic()
+    try:
+        result = await bluetooth.connect_device(mac)
+    except Exception as e:
+        result = {"ok": False, "error": str(e)}
+    elapsed_ms = int((time.monotonic() - start) * 1000)
+
+    if result.get("ok"):
+        st.update(connected=True, backoff=0, next_attempt=0.0,
+                  last_connect_ms=elapsed_ms, last_error=None)
+        logger.info("Reconnected speaker %s in %d ms", mac, elapsed_ms)
+        return
+
+    st["failures"] += 1
+    st["backoff"] = min(max(MIN_BACKOFF_SECONDS, st["backoff"] * 2), max_backoff)
+    st["next_attempt"] = time.monotonic() + st["backoff"]
+    st["last_error"] = result.get("error", "unknown error")
+    logger.warning("Reconnecting speaker %s failed (%s), retry in %ds",
+                   mac, st["last_error"], st["backoff"])
+
+
+async def _sync_combined_sink() -> None:
+    """Rebuild or remove the combined sink only when the BT sink set changes."""
+    global _last_sinks
+    loop = asyncio.get_running_loop()
+    sinks = frozenset(await loop.run_in_executor(None, bluetooth.get_bt_sinks))
+    if sinks == _last_sinks:
+        return
+    if len(sinks) > 1:
+        await bluetooth.ensure_combined_sink()
+    elif _last_sinks and len(_last_sinks) > 1:
+        await bluetooth.clear_combined_sink()
+    _last_sinks = sinks
+
+
+def _set_keepalive(on: bool) -> None:
+    """Start or stop a silent stream to the default sink."""
+    global _keepalive
+    running = _keepalive is not None and _keepalive.poll() is None
+    if on and not running:
+        try:
+            # pacat plays raw samples from stdin; zeros are silence
+            with open("/dev/zero", "rb") as zero:
+                _keepalive = subprocess.Popen(
+                    ["pacat"],
+                    stdin=zero,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            logger.info("Speaker keep-alive started")
+        except (FileNotFoundError, OSError):
+            logger.debug("pacat not available, speaker keep-alive disabled")
+            _keepalive = None
+    elif not on and running:
+        _keepalive.terminate()
+        try:
+            _keepalive.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            _keepalive.kill()
+        _keepalive = None
+        logger.info("Speaker keep-alive stopped")
+
+
+async def check() -> None:
+    """One supervision pass: reconnect, sync combined sink, keep awake."""
+    cfg = load_config().speakers
+    if not cfg.enabled or not cfg.preferred:
+        _set_keepalive(False)
+        return
+
+    soon = _alarm_soon(cfg.keep_awake_minutes)
+    max_backoff = ALARM_MAX_BACKOFF_SECONDS if soon else MAX_BACKOFF_SECONDS
+    connected = {d["mac"].upper() for d in bluetooth.get_connected_devices()}
+
+    for mac in (m.upper() for m in cfg.preferred):
+        st = _device_state(mac)
+        if mac in connected:
+            if not st["connected"]:
+                st.update(connected=True, backoff=0, next_attempt=0.0)
+            continue
+        if st["connected"]:
+            logger.warning("Preferred speaker %s dropped", mac)
+            st["connected"] = False
+        # Shorten a long backoff once an alarm is coming up
+        now = time.monotonic()
+        st["backoff"] = min(st["backoff"], max_backoff)
+        st["next_attempt"] = min(st["next_attempt"], now + max_backoff)
+        if now >= st["next_attempt"]:
+            await _reconnect(mac, st, max_backoff)
+
+    await _sync_combined_sink()
+    # Once the alarm's own audio plays it keeps the speakers awake
+    _set_keepalive(soon and bool(connected))
+
+
+async def _run() -> None:
+    while True:
+        try:
+            await check()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Speaker supervisor pass failed")
+        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+
+
+def start() -> None:
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    _set_keepalive(False)
+
+
+def set_preferred(mac: str, preferred: bool) -> None:
+    """Add or remove a speaker from the preferred list."""
+    cfg = load_config()
+    macs = [m for m in cfg.speakers.preferred if m.upper() != mac.upper()]
+    if preferred:
+        macs.append(mac.upper())
+    if macs != cfg.speakers.preferred:
+        cfg.speakers.preferred = macs
+        save_config(cfg)
+    if not preferred:
+        _devices.pop(mac.upper(), None)
+
+
+def get_status() -> dict:
+    cfg = load_config().speakers
+    now = time.monotonic()
+    return {
+        "enabled": cfg.enabled,
+        "preferred": cfg.preferred,
+        "keep_awake": _keepalive is not None and _keepalive.poll() is None,
+        "devices": {
+            mac: {
+                "connected": st["connected"],
+                "attempts": st["attempts"],
+                "failures": st["failures"],
+                "retry_in": max(0, int(st["next_attempt"] - now)) if not st["connected"] else None,
+                "last_connect_ms": st["last_connect_ms"],
+                "last_error": st["last_error"],
+            }
+            for mac, st in _devices.items()
+        },
+    }
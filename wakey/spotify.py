@@ -7,21 +7,39 @@ via the local REST API (no OAuth needed).
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
 
 import httpx
 
+from . import latency, metrics
+
 logger = logging.getLogger(__name__)
 
 API_BASE = "http://127.0.0.1:3678"
 
+# Background tasks, referenced so they aren't garbage-collected mid-flight
+_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+
+
+def _task_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Spotify background task failed", exc_info=task.exception())
+
 
 async def _api(method: str, path: str, json_body: dict | None = None) -> dict | None:
     """Make a request to the go-librespot local API."""
     try:
         logger.debug("go-librespot %s %s body=%s", method, path, json_body)
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with httpx.AsyncClient(timeout=5, transport=metrics.transport("spotify")) as client:
             if method == "GET":
                 resp = await client.get(API_BASE + path)
             elif method == "POST":
@@ -69,7 +87,23 @@ async def play(uri: str | None = None) -> bool:
         data = await _api("POST", "/player/play", {"uri": uri})
     else:
         data = await _api("POST", "/player/resume")
-    return data is not None and "_error" not in data
+    ok = data is not None and "_error" not in data
+    if ok and latency.current() is not None:
+        latency.mark("spotify_play_ack")
+        _spawn(_confirm_playing())
+    return ok
+
+
+async def _confirm_playing(timeout: float = 15) -> None:
+    """Record wake latency once go-librespot reports a playing track."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        data = await _api("GET", "/status")
+        if data and data.get("track") and not data.get("paused") and not data.get("stopped"):
+            latency.mark("spotify_playing")
+            return
+        await asyncio.sleep(0.2)
 
 
 async def pause() -> bool:
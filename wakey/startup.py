@@ -0,0 +1,89 @@
+"""Startup timing and optional integrations.
+
+main.py runs each startup step inside phase(). Once the app is ready, the
+breakdown is logged and kept for GET /api/debug/startup and /metrics, so a
+slower cold start shows up as a number. The "imports" phase runs from
+process start (read from /proc, so it includes the interpreter and uvicorn)
+until main.py has built the app.
+
+WAKEY_DISABLE=spotify,bluetooth,hue leaves out those integrations' routes
+and background work on devices that don't use them.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+INTEGRATIONS = ("bluetooth", "hue", "spotify")
+DISABLED = {s.strip().lower() for s in os.environ.get("WAKEY_DISABLE", "").split(",") if s.strip()}
+
+for _name in sorted(DISABLED - set(INTEGRATIONS)):
+    logger.warning("WAKEY_DISABLE: unknown integration %r (known: %s)", _name, ", ".join(INTEGRATIONS))
+
+
+def enabled(integration: str) -> bool:
+    return integration not in DISABLED
+
+
+def _process_age() -> float | None:
+    """Seconds since this process started (Linux only)."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesized command name
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+_age = _process_age()
+# perf_counter() at process start, or at this import where /proc is unavailable
+_t0 = time.perf_counter() - (_age or 0.0)
+_phases: dict[str, float] = {}
+_ready_at: float | None = None
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases[name] = _phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def imported() -> None:
+    """End of the "imports" phase; called once main.py has built the app."""
+    _phases["imports"] = time.perf_counter() - _t0
+
+
+def ready() -> None:
+    """The app is about to serve: log the breakdown."""
+    global _ready_at
+    _ready_at = time.perf_counter()
+    logger.info("Ready %.2f s after %s (%s)", _ready_at - _t0,
+                "process start" if _age is not None else "import",
+                ", ".join(f"{name} {secs:.2f}" for name, secs in _phases.items()))
+
+
+def report() -> dict:
+    return {
+        "ready": _ready_at is not None,
+        "total_seconds": round(_ready_at - _t0, 4) if _ready_at is not None else None,
+        "measured_from": "process start" if _age is not None else "import",
+        # Phases after "ready" belong to a worker elected leader later
+        "phases": {name: round(secs, 4) for name, secs in _phases.items()},
+        "disabled": sorted(DISABLED & set(INTEGRATIONS)),
+    }
+
+
+metrics.Gauge("wakey_startup_seconds", "Seconds from process start until ready to serve.",
+              lambda: _ready_at - _t0 if _ready_at is not None else 0.0)
@@ -103,7 +103,11 @@
         active: "Alarm ringing!",
         snoozed: "Snoozed..."
       };
-      statusText.textContent = labels[data.state] || data.state;
+      var text = labels[data.state] || data.state;
+      if (data.alarms && data.alarms.length > 1) {
+        text += " (" + data.alarms.length + " alarms)";
+      }
+      statusText.textContent = text;
     }
   }
 
@@ -1188,15 +1192,68 @@
       .catch(function () {});
   }
 
+  var BT_SCAN_SECONDS = 10;
+
+  function btScanDone(btn, statusEl, count) {
+    btn.disabled = false;
+    btn.textContent = "Scan for Devices";
+    statusEl.textContent = count + " available device(s)";
+    statusEl.className = "status-msg";
+  }
+
+  function btScanStream(btn, statusEl) {
+    // Devices appear as BlueZ discovers them; the server shares one
+    // discovery session between clients and stops it when we disconnect.
+    var found = {};
+    var order = [];
+    var source = new EventSource("/api/bluetooth/scan/stream");
+    var finished = false;
+
+    function render() {
+      var available = [];
+      for (var i = 0; i < order.length; i++) {
+        if (!found[order[i]].connected) {
+          available.push(found[order[i]]);
+        }
+      }
+      renderBtDevices(available);
+      return available.length;
+    }
+
+    function finish() {
+      if (finished) return;
+      finished = true;
+      source.close();
+      btScanDone(btn, statusEl, render());
+    }
+
+    source.addEventListener("device", function (e) {
+      var d = JSON.parse(e.data);
+      if (!found[d.mac]) {
+        order.push(d.mac);
+      }
+      found[d.mac] = d;
+      statusEl.textContent = "Scanning... " + render() + " device(s) found";
+    });
+    source.addEventListener("done", finish);
+    source.onerror = finish;
+    setTimeout(finish, BT_SCAN_SECONDS * 1000);
+  }
+
   $("#btn-bt-scan").addEventListener("click", function () {
     var statusEl = $("#bt-status");
     var btn = $("#btn-bt-scan");
-    statusEl.textContent = "Scanning... (~8 seconds)";
+    statusEl.textContent = "Scanning...";
     statusEl.className = "status-msg";
     btn.disabled = true;
     btn.textContent = "Scanning...";
     $("#bt-devices").innerHTML = "";
 
+    if (window.EventSource) {
+      btScanStream(btn, statusEl);
+      return;
+    }
+
     json("POST", "/api/bluetooth/scan", {}).then(function (devices) {
       btn.disabled = false;
       btn.textContent = "Scan for Devices";
@@ -0,0 +1,249 @@
+"""Keyframed timeline engine for alarm ramps.
+
+A Timeline holds tracks (light, radio volume, Spotify volume, one-off cues)
+positioned on a shared clock. Every step is scheduled at an absolute
+monotonic deadline computed from the timeline origin, so a slow Hue or
+pactl call delays only that step instead of shifting all later ones, and
+tracks stay in sync with each other. Tracks run concurrently; lateness of
+every action is recorded. Timelines can be paused, resumed, seeked and
+cancelled (snooze/dismiss).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+Actuator = Callable[[Any], Awaitable[Any]]
+
+HISTORY_SIZE = 200
+
+
+def interpolate(keyframes: list[tuple[float, Any]], t: float) -> Any:
+    """Linear interpolation over (time, value) keyframes.
+
+    Values are numbers or dicts of numbers; results are rounded to int.
+    """
+    if t <= keyframes[0][0]:
+        return _round(keyframes[0][1])
+    for (t0, v0), (t1, v1) in zip(keyframes, keyframes[1:]):
+        if t <= t1:
+            f = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+            if isinstance(v0, dict):
+                return {k: int(v0[k] + f * (v1[k] - v0[k])) for k in v0}
+            return int(v0 + f * (v1 - v0))
+    return _round(keyframes[-1][1])
+
+
+def _round(v: Any) -> Any:
+    if isinstance(v, dict):
+        return {k: int(x) for k, x in v.items()}
+    return int(v) if isinstance(v, (int, float)) else v
+
+
+class Track:
+    """Keyframes applied by an actuator every `step_seconds`, starting at `at`.
+
+    `prepare` (optional) runs once before the first step and returns the
+    actuator to use, or None to end the track (e.g. playback failed to start).
+    """
+
+    def __init__(self, name: str, keyframes: list[tuple[float, Any]],
+                 actuator: Actuator | None = None, step_seconds: float = 1,
+                 at: float = 0, prepare: Callable[[], Awaitable[Actuator | None]] | None = None):
+        self.name = name
+        self.keyframes = keyframes
+        self.actuator = actuator
+        self.at = at
+        self.prepare = prepare
+        self.prepared = prepare is None
+        end = keyframes[-1][0]
+        n = max(1, round(end / step_seconds)) if end > 0 else 0
+        self.steps = [end * i / n for i in range(n + 1)] if n else [0.0]
+        self.done = 0
+        self.finished = False
+        self.skipped = 0
+        self.late_ms: list[int] = []
+
+    @property
+    def end(self) -> float:
+        return self.at + self.steps[-1]
+
+    def stats(self) -> dict:
+        return {
+            "at": self.at,
+            "steps": len(self.steps),
+            "done": self.done,
+            "skipped": self.skipped,
+            "max_late_ms": max(self.late_ms, default=None),
+            "avg_late_ms": int(sum(self.late_ms) / len(self.late_ms)) if self.late_ms else None,
+        }
+
+
+def cue(name: str, at: float, fn: Callable[[], Awaitable[Any]]) -> Track:
+    """A one-shot action at time `at`."""
+    return Track(name, [(0, None)], lambda _: fn(), at=at)
+
+
+class Timeline:
+    def __init__(self, name: str):
+        self.name = name
+        self.tracks: dict[str, Track] = {}
+        self.history: deque[dict] = deque(maxlen=HISTORY_SIZE)
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._origin: float | None = None   # monotonic time of position 0 while running
+        self._position = 0.0                # position while paused / before start
+        self.state = "idle"                 # idle, running, paused, cancelled
+
+    @property
+    def position(self) -> float:
+        if self.state == "running":
+            return time.monotonic() - self._origin
+        return self._position
+
+    def add(self, track: Track) -> None:
+        """Add (or replace) a track; it starts right away if the timeline runs."""
+        self.remove(track.name)
+        self.tracks[track.name] = track
+        if self.state == "running":
+            self._spawn(track)
+
+    def remove(self, name: str) -> None:
+        self._cancel(name)
+        self.tracks.pop(name, None)
+
+    def start(self, position: float = 0) -> None:
+        self._position = position
+        self.resume()
+
+    def resume(self) -> None:
+        if self.state == "running" or self.state == "cancelled":
+            return
+        self._origin = time.monotonic() - self._position
+        self.state = "running"
+        for track in self.tracks.values():
+            self._spawn(track)
+
+    def pause(self) -> None:
+        if self.state != "running":
+            return
+        self._position = self.position
+        self.state = "paused"
+        for name in list(self._tasks):
+            self._cancel(name)
+
+    def seek(self, position: float) -> None:
+        running = self.state == "running"
+        self.pause()
+        self._position = max(0.0, position)
+        if running:
+            self.resume()
+
+    def cancel(self) -> None:
+        self.pause()
+        self.state = "cancelled"
+
+    async def wait(self) -> None:
+        """Wait until every running track has finished."""
+        while self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "position": round(self.position, 1),
+            "tracks": {name: t.stats() for name, t in self.tracks.items()},
+            "recent": list(self.history)[-10:],
+        }
+
+    def _spawn(self, track: Track) -> None:
+        task = asyncio.create_task(self._run_track(track))
+        self._tasks[track.name] = task
+
+        def _done(t: asyncio.Task) -> None:
+            if self._tasks.get(track.name) is t:
+                del self._tasks[track.name]
+
+        task.add_done_callback(_done)
+
+    def _cancel(self, name: str) -> None:
+        task = self._tasks.pop(name, None)
+        # A cue may cancel its own timeline (auto-stop -> dismiss)
+        if task and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+
+    async def _run_track(self, track: Track) -> None:
+        origin = self._origin
+        local = self.position - track.at
+        if local > track.steps[-1] and track.finished:
+            return
+        # First step not yet due; earlier ones were passed by a seek/resume
+        i = next((k for k, s in enumerate(track.steps) if s >= local - 0.001), len(track.steps) - 1)
+        try:
+            await self._sleep_until(origin + track.at)
+            if not track.prepared:
+                track.actuator = await track.prepare()
+                track.prepared = True
+                if track.actuator is None:
+                    return
+            if i > 0 and len(track.keyframes) > 1:
+                # Resumed mid-ramp: catch up to the current value first
+                await self._act(track, i - 1, self.position - track.at, origin)
+            while i < len(track.steps):
+                deadline = origin + track.at + track.steps[i]
+                await self._sleep_until(deadline)
+                # Fell behind by more than a step: jump to the latest due one
+                last = len(track.steps) - 1
+                due = i
+                while due < last and origin + track.at + track.steps[due + 1] <= time.monotonic():
+                    due += 1
+                track.skipped += due - i
+                await self._act(track, due, track.steps[due], origin)
+                i = due + 1
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("Timeline %s track %s failed", self.name, track.name)
+
+    async def _act(self, track: Track, step: int, t: float, origin: float) -> None:
+        deadline = origin + track.at + t
+        start = time.monotonic()
+        late_ms = max(0, int((start - deadline) * 1000))
+        try:
+            await track.actuator(interpolate(track.keyframes, t))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning("Timeline %s track %s step %d failed", self.name, track.name, step)
+        track.done += 1
+        track.finished = step == len(track.steps) - 1
+        track.late_ms.append(late_ms)
+        self.history.append({
+            "track": track.name,
+            "step": step,
+            "t": round(track.at + t, 1),
+            "late_ms": late_ms,
+            "duration_ms": int((time.monotonic() - start) * 1000),
+        })
+        if late_ms > 1000:
+            logger.warning("Timeline %s track %s step %d ran %d ms late",
+                           self.name, track.name, step, late_ms)
+
+    @staticmethod
+    async def _sleep_until(deadline: float) -> None:
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def volume_keyframes(start: int, target: int, ramp_seconds: int) -> list[tuple[float, Any]]:
+    """Keyframes for a linear volume ramp (or an immediate set without ramp)."""
+    if ramp_seconds <= 0:
+        return [(0, target)]
+    return [(0, start), (ramp_seconds, target)]
@@ -0,0 +1,127 @@
+"""Event-loop stall watchdog.
+
+The loop bumps a heartbeat every HEARTBEAT_SECONDS. A background thread
+checks it; when the heartbeat is older than the threshold the loop is
+blocked (typically a synchronous subprocess or file call), so the thread
+captures the loop thread's Python stack and the running task, logs them,
+and records the stall once the loop recovers. Stalls are counted in
+/metrics and listed under /api/debug/stalls.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD_SECONDS = int(os.environ.get("WAKEY_STALL_THRESHOLD_MS", "500")) / 1000
+HEARTBEAT_SECONDS = 0.1
+MAX_STACK_LINES = 40
+
+stalls_total = metrics.Counter("wakey_event_loop_stalls_total",
+                               "Event-loop stalls above the watchdog threshold.")
+stall_seconds = metrics.Histogram("wakey_event_loop_stall_seconds",
+                                  "Duration of detected event-loop stalls.",
+                                  buckets=(0.5, 1, 2, 5, 10, 30, 60))
+
+_last_beat = 0.0
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread_id: int | None = None
+_heartbeat: asyncio.TimerHandle | None = None
+_thread: threading.Thread | None = None
+_stop = threading.Event()
+
+_stats = {"count": 0, "total_ms": 0, "longest_ms": 0}
+_recent: deque[dict] = deque(maxlen=20)
+
+
+def _beat() -> None:
+    global _last_beat, _heartbeat
+    _last_beat = time.monotonic()
+    _heartbeat = _loop.call_later(HEARTBEAT_SECONDS, _beat)
+
+
+def _capture() -> dict:
+    """Stack of the loop thread and the task it is running, as seen from outside."""
+    frame = sys._current_frames().get(_loop_thread_id)
+    stack = traceback.format_stack(frame) if frame else []
+    task = None
+    try:
+        current = asyncio.current_task(_loop)
+        if current is not None:
+            task = current.get_name() + " " + repr(current.get_coro())
+    except Exception:
+        pass
+    lines = [line for entry in stack for line in entry.rstrip().splitlines()]
+    return {"task": task, "stack": lines[-MAX_STACK_LINES:]}
+
+
+def _monitor() -> None:
+    stall: dict | None = None
+    stalled_beat = 0.0
+    while not _stop.wait(THRESHOLD_SECONDS / 4):
+        beat = _last_beat
+        age = time.monotonic() - beat
+        if stall is None and age > THRESHOLD_SECONDS:
+            stalled_beat = beat
+            stall = {"started": datetime.now().isoformat(timespec="seconds"), **_capture()}
+            logger.warning("Event loop blocked for %.1fs in %s\n%s", age,
+                           stall["task"] or "a callback", "\n".join(stall["stack"]))
+        elif stall is not None and beat != stalled_beat:
+            # Heartbeat resumed: the loop was blocked from one beat to the next
+            _record(stall, beat - stalled_beat - HEARTBEAT_SECONDS)
+            stall = None
+
+
+def _record(stall: dict, duration: float) -> None:
+    ms = int(duration * 1000)
+    stall["duration_ms"] = ms
+    _stats["count"] += 1
+    _stats["total_ms"] += ms
+    _stats["longest_ms"] = max(_stats["longest_ms"], ms)
+    _recent.append(stall)
+    stalls_total.inc()
+    stall_seconds.observe(duration)
+    logger.warning("Event loop stalled for %d ms in %s", ms, stall["task"] or "a callback")
+
+
+def start() -> None:
+    """Start the heartbeat on the running loop and the watchdog thread."""
+    global _loop, _loop_thread_id, _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    _loop = asyncio.get_running_loop()
+    _loop_thread_id = threading.get_ident()
+    _beat()
+    _stop.clear()
+    _thread = threading.Thread(target=_monitor, name="wakey-watchdog", daemon=True)
+    _thread.start()
+
+
+def stop() -> None:
+    global _thread, _heartbeat
+    _stop.set()
+    if _heartbeat is not None:
+        _heartbeat.cancel()
+        _heartbeat = None
+    if _thread is not None:
+        _thread.join(timeout=1)
+        _thread = None
+
+
+def get_stats() -> dict:
+    return {
+        "threshold_ms": int(THRESHOLD_SECONDS * 1000),
+        **_stats,
+        "recent": list(reversed(_recent)),
+    }